@@ -1,72 +1,589 @@
+import argparse
+import logging
+import os
+import time
+import uuid
+import tracemalloc
+from contextlib import contextmanager
+import cluster_stats
 import data_manipulation
 import database
 import numpy as np
-import Knn
 import pandas as pd
-from sklearn.cluster import AgglomerativeClustering
+import Knn
+import metrics
+import parallel
+import prediction_table
+import reference_cache
+import snapshot
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+_logger = logging.getLogger(__name__)
 
 _NUMBER_OF_NEIGHBORS = 1
 
+"""
+The clustering settings of each heating source partition. The same metric is used for serving, so that the
+classification of new records is consistent with the labels.
+"""
+_PARTITIONS = {"Yes": {"metric": "l1", "n_clusters": 3},
+               "No": {"metric": "euclidean", "n_clusters": 4}}
+
+"""
+Retraining settings: the cursor and mini-batch size, the number of label updates per bulk write, the largest
+partition trained with the full agglomerative clustering, and the sample size and number of representatives of the
+scalable mode.
+"""
+_TRAINING_BATCH = int(os.environ.get("TRAINING_BATCH_SIZE", 10000))
+_WRITE_CHUNK = int(os.environ.get("TRAINING_WRITE_CHUNK", 1000))
+_FULL_TRAINING_LIMIT = int(os.environ.get("TRAINING_FULL_LIMIT", 20000))
+_TRAINING_SAMPLE = int(os.environ.get("TRAINING_SAMPLE_SIZE", 200000))
+_REPRESENTATIVES = int(os.environ.get("TRAINING_REPRESENTATIVES", 2000))
+
+"""
+How long (in seconds) the 'New_entries' records claimed by a promotion job stay claimed. The records of a job that
+died before finishing are claimed again by the next job after this timeout.
+"""
+_PROMOTION_CLAIM_TIMEOUT = float(os.environ.get("PROMOTION_CLAIM_TIMEOUT", 3600))
+
+"""
+The classification mode used by default and the relative distance margin under which the "hybrid" mode falls back to
+the exact nearest neighbor search:
+-> exact : 1-Nearest-Neighbors over every reference record.
+-> centroid : the cluster with the closest representative.
+-> hybrid : the closest representative, unless the second closest one is within the margin.
+-> approximate : 1-Nearest-Neighbors over the records of the closest inverted lists (see Knn.IVFSearch).
+"""
+_CLASSIFICATION_MODES = ["exact", "centroid", "hybrid", "approximate"]
+_CLASSIFICATION_MODE = os.environ.get("CLASSIFICATION_MODE", "exact")
+_HYBRID_MARGIN = float(os.environ.get("CLASSIFICATION_HYBRID_MARGIN", 0.2))
+
+
+def classify(reference, vector, mode=None, metric="euclidean") -> tuple:
+    """
+    Classifies an encoded record to a cluster of the reference set.
+
+    :param reference: (reference_cache.ReferenceSet)The reference set.
+    :param vector: (np.ndarray)The encoded record.
+    :param mode: (str)The classification mode: "exact", "centroid", "hybrid" or "approximate". Defaults
+    to CLASSIFICATION_MODE.
+    :param metric: (str)The distance metric, "euclidean" or "l1".
+    :return: (tuple)The cluster label and whether the exact search was performed.
+    """
+    mode = mode or _CLASSIFICATION_MODE
+    if mode not in _CLASSIFICATION_MODES:
+        raise ValueError("Classification mode should be: {exact/centroid/hybrid/approximate}")
+
+    if mode == "approximate":
+        with metrics.timed("ann"):
+            label = Knn.Knn(record=vector, k=_NUMBER_OF_NEIGHBORS, engine=reference.search_engine(metric, "ivf"))
+        return label, False
+
+    if mode != "exact":
+        with metrics.timed("centroid"):
+            labels, points = reference.representatives(metric)
+            dist = Knn.distances(vector, points, metric)
+            order = np.argsort(dist)
+        if mode == "centroid" or len(order) == 1:
+            return labels[order[0]], False
+
+        closest, second = dist[order[0]], dist[order[1]]
+        if second - closest > _HYBRID_MARGIN * second:
+            return labels[order[0]], False
 
-def apply_algorithm(db, record) -> tuple:
+    with metrics.timed("knn"):
+        label = Knn.Knn(record=vector, k=_NUMBER_OF_NEIGHBORS, engine=reference.search_engine(metric))
+    return label, True
+
+
+def agreement_rate(db, mode, limit=1000) -> dict:
     """
-    Fetches all the records from the 'Active_data' database collection and performs the 1-Nearest-Neighbors algorithm
-    to classify the given record to the closest cluster.
-    After that, calculates the expected energy consumption by finding the mean consumption from the records within
-    the cluster.
+    Replays the records of the 'New_entries' database collection and compares the labels of the given classification
+    mode against the exact mode.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param mode: (str)The classification mode to be evaluated, "centroid", "hybrid" or "approximate".
+    :param limit: (int)The maximum number of replayed records.
+    :return: (dict)The number of replayed records, the agreement rate and the rate of fallbacks to the exact search.
+    """
+    agreements = fallbacks = total = 0
+    for record in db["New_entries"].find({"Heating Source": {"$in": list(_PARTITIONS)}}, limit=limit):
+        metric = _PARTITIONS[record["Heating Source"]]["metric"]
+        reference = reference_cache.get_reference_set(db, record["Heating Source"])
+        vector = reference_cache.get_feature_encoder(db, reference).encode(record)
+
+        exact_label, _ = classify(reference, vector, "exact", metric)
+        label, exact_used = classify(reference, vector, mode, metric)
+        agreements += int(label == exact_label)
+        fallbacks += int(exact_used)
+        total += 1
+
+    return {"records": total, "agreement": agreements / total if total else 0.0,
+            "fallback": fallbacks / total if total else 0.0}
+
+
+def predict(db, record, mode=None) -> dict:
+    """
+    Routes the given record to the cached 'Active_data' partition of its heating source and classifies it to the
+    closest cluster with the partition metric, by performing the 1-Nearest-Neighbors algorithm or by comparing it
+    against the cluster representatives (see classify).
+    Repeated profiles are answered from the precomputed prediction table or the memo of the dataset version (see
+    prediction_table.lookup) without any search.
+    After that, looks up the expected energy consumption, i.e. the mean consumption from the records within the
+    cluster, in the precomputed cluster statistics.
 
     :param db: (pymongo.database)The MongoDB database connection.
     :param record: (dict)The record to be classified.
+    :param mode: (str)The classification mode: "exact", "centroid", "hybrid" or "approximate". Defaults
+    to CLASSIFICATION_MODE.
+    :return: (dict)The predicted consumption, the cluster label and the heating source partition.
+    """
+    heating_source = record["Heating Source"]
+    if heating_source not in _PARTITIONS:
+        raise ValueError("Heating source should be: {Yes/No}")
+
+    reference = reference_cache.get_reference_set(db, heating_source)
+    with metrics.timed("encode"):
+        vector = reference_cache.get_feature_encoder(db, reference).encode(record)
+
+    metric = _PARTITIONS[heating_source]["metric"]
+    label = prediction_table.lookup(db, reference, vector, mode or _CLASSIFICATION_MODE,
+                                    lambda: int(classify(reference, vector, mode, metric)[0]))
+    with metrics.timed("cluster_mean"):
+        mean = reference.stats.mean(label)
+    return {"prediction": mean, "label": int(label), "heating_source": heating_source}
+
+
+def apply_algorithm(db, record, mode=None) -> tuple:
+    """
+    Classifies the given record and calculates its expected energy consumption (see predict).
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param record: (dict)The record to be classified.
+    :param mode: (str)The classification mode: "exact", "centroid", "hybrid" or "approximate". Defaults
+    to CLASSIFICATION_MODE.
     :return: (tuple)The mean consumption from the cluster and a pandas data frame with all the data.
     """
-    dataFrame = database.retrieve_data(db, "Active_data", {})
-    labels = dataFrame["label"]
+    prediction = predict(db, record, mode)["prediction"]
+    return prediction, reference_cache.get_reference_set(db).data_frame
 
-    data_manipulation.preprocess_pipeline(db, record)
 
-    dataFrame_processed = pd.concat([dataFrame, pd.DataFrame(record, index=[0])], ignore_index=True)
-    dataFrame_processed.fillna(value=0, inplace=True)
-    dataFrame_processed.drop(["_id", "Kwh/day/m2", "Heating Source", "label"], axis=1, inplace=True)
-    dataFrame_processed = dataFrame_processed.to_numpy()
+@contextmanager
+def _stage(report, name, profile_memory):
+    """
+    Measures the wall time and the peak traced memory of a training stage and appends them to the report.
 
-    label = Knn.Knn(record=dataFrame_processed[-1], k=_NUMBER_OF_NEIGHBORS, data=dataFrame_processed[:-1],
-                    labels=labels)
-    prediction = np.mean(dataFrame[dataFrame.loc[:, "label"] == label]["Kwh/day/m2"])
+    :param report: (list)The training report.
+    :param name: (str)The stage name.
+    :param profile_memory: (bool)Whether the peak memory is measured with tracemalloc.
+    """
+    if profile_memory:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    yield
+    stage = {"stage": name, "seconds": time.perf_counter() - start}
+    if profile_memory:
+        stage["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    report.append(stage)
 
-    return prediction, dataFrame
 
+def _stream_partition(db, heating_source, batch_size) -> tuple:
+    """
+    Streams the records of a heating source partition from the 'Active_data' database collection in batches and
+    decodes each batch straight into a float32 block, instead of materializing every document at once.
+    The current 'label' is not a feature: the records are clustered on the same columns they are served with (see
+    reference_cache.ReferenceSet), whereas the original retraining also clustered on the labels of the previous run.
 
-def train_clustering_algorithm(db, heating_source) -> None:
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param heating_source: (str)The heating source partition.
+    :param batch_size: (int)The number of records per cursor batch.
+    :return: (tuple)The record IDs, the feature matrix, the consumption and the dwelling grade of every record.
     """
-    Fetches records from the 'Active_data' database collection based on the 'heating_source' argument and performs an
-    agglomerative clustering algorithm on them.
-    It updates each record back to the database with the calculated label.
+    columns = {}
+    ids, consumption, grades, blocks = [], [], [], []
+
+    def flush(batch) -> None:
+        for document in batch:
+            ids.append(document.pop("_id"))
+            consumption.append(document.pop("Kwh/day/m2"))
+            grades.append(document["Dwelling Grade"])
+            document.pop("Heating Source", None)
+            document.pop("label", None)
+            for column in document:
+                columns.setdefault(column, len(columns))
+
+        block = np.zeros((len(batch), len(columns)), dtype=np.float32)
+        for row, document in enumerate(batch):
+            for column, value in document.items():
+                if value is not None:
+                    block[row, columns[column]] = value
+        blocks.append(block)
+
+    batch = []
+    for document in db["Active_data"].find({"Heating Source": heating_source}, batch_size=batch_size):
+        batch.append(document)
+        if len(batch) == batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    # Blocks decoded before a column first appeared are narrower; the missing values are 0, as in the reference set.
+    features = np.zeros((len(ids), len(columns)), dtype=np.float32)
+    row = 0
+    while blocks:
+        block = blocks.pop(0)
+        features[row:row + len(block), :block.shape[1]] = block
+        row += len(block)
+
+    return ids, features, np.asarray(consumption, dtype=np.float64), np.asarray(grades, dtype=np.float64)
+
+
+def _cluster(features, partition, mode, seed=0, workers=None) -> np.ndarray:
+    """
+    Clusters the records of a partition.
+    -> full : average-linkage agglomerative clustering over every record, O(n^2) memory.
+    -> scalable : mini-batch k-means condenses a sample of the records into _REPRESENTATIVES points, the
+    representatives are merged with average-linkage agglomerative clustering under the partition metric, and every
+    record inherits the label of its closest representative under the partition metric, which is found by a pool of
+    'workers' processes (see parallel.nearest).
+
+    :param features: (np.ndarray)The feature matrix.
+    :param partition: (dict)The clustering settings of the partition.
+    :param mode: (str)The training mode, "full" or "scalable".
+    :param seed: (int)The random seed of the scalable mode.
+    :param workers: (int)The number of processes of the scalable mode, see parallel.workers.
+    :return: (np.ndarray)The cluster label of every record.
+    """
+    from sklearn.cluster import AgglomerativeClustering, MiniBatchKMeans
+
+    if mode == "full":
+        return AgglomerativeClustering(linkage="average", metric=partition["metric"],
+                                       n_clusters=partition["n_clusters"]).fit_predict(features)
+    elif mode != "scalable":
+        raise ValueError("Training mode should be: {full/scalable}")
+
+    rng = np.random.default_rng(seed)
+    sample = features[rng.choice(len(features), size=min(_TRAINING_SAMPLE, len(features)), replace=False)]
+    representatives = MiniBatchKMeans(n_clusters=min(_REPRESENTATIVES, len(sample)), batch_size=_TRAINING_BATCH,
+                                      n_init=3, random_state=seed).fit(sample)
+    merged = AgglomerativeClustering(linkage="average", metric=partition["metric"],
+                                     n_clusters=partition["n_clusters"]).fit_predict(representatives.cluster_centers_)
+
+    return merged[parallel.nearest(features, representatives.cluster_centers_, partition["metric"],
+                                   workers)].astype(np.int64)
+
+
+def _write_labels(db, ids, labels) -> None:
+    """
+    Writes the labels back to the 'Active_data' database collection with unordered bulk writes of _WRITE_CHUNK
+    updates each.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param ids: (list)The record IDs.
+    :param labels: (np.ndarray)The label of each record.
+    """
+    for start in range(0, len(ids), _WRITE_CHUNK):
+        requests = [UpdateOne({"_id": Id}, {"$set": {"label": int(label)}})
+                    for Id, label in zip(ids[start:start + _WRITE_CHUNK], labels[start:start + _WRITE_CHUNK])]
+        db["Active_data"].bulk_write(requests, ordered=False)
+
+
+def save_prediction_table(db, heating_source) -> int:
+    """
+    Reloads the current version of a heating source partition and materializes the labels of its distinct profiles
+    (see prediction_table.build).
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param heating_source: (str)The heating source partition.
+    :return: (int)The number of profiles in the table.
+    """
+    reference_cache.invalidate(reference_cache.dataset_name(heating_source))
+    reference = reference_cache.get_reference_set(db, heating_source)
+    table = prediction_table.build(reference, _PARTITIONS[heating_source]["metric"], _NUMBER_OF_NEIGHBORS)
+    prediction_table.save(db, table, reference.version, reference.dataset)
+    return len(table)
+
+
+def export_snapshots(db, heating_sources=None, missing_only=False, whole_collection=True) -> list:
+    """
+    Writes the snapshots of the current version of the given heating source partitions and of the whole 'Active_data'
+    collection, so that new workers memory-map them instead of fetching the records (see snapshot). The partition
+    snapshots include the neighbour index of the partition metric.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param heating_sources: (list)The heating source partitions, all of them by default.
+    :param missing_only: (bool)Whether the datasets whose current version already has a snapshot are skipped.
+    :param whole_collection: (bool)Whether the snapshot of the whole 'Active_data' collection is written too.
+    :return: (list)The snapshot directories.
+    """
+    directories = []
+    for heating_source in list(heating_sources or _PARTITIONS) + ([None] if whole_collection else []):
+        name = reference_cache.dataset_name(heating_source)
+        version = reference_cache.get_version(db, name)
+        if missing_only and snapshot.current_version(name) == version:
+            continue
+        reference_cache.confirm_version(name, version)
+        engines = [(_PARTITIONS[heating_source]["metric"], None)] if heating_source is not None else []
+        directories.append(reference_cache.export_snapshot(db, heating_source, engines))
+    return directories
+
+
+def publish_snapshots(db, interval=5.0) -> None:
+    """
+    Runs the snapshot loader of a host: every 'interval' seconds, it exports the snapshot of every dataset version that
+    has not been exported yet, so that the workers serving shared snapshots (see snapshot.shared) swap to it.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param interval: (float)The seconds between two version checks.
+    """
+    while True:
+        for directory in export_snapshots(db, missing_only=True):
+            print(f"Exported {directory}")
+        time.sleep(interval)
+
+
+def save_collection_stats(db) -> int:
+    """
+    Bumps the version of the whole 'Active_data' collection and stores the consumption statistics of its clusters.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :return: (int)The new version of the collection.
+    """
+    name = reference_cache.dataset_name()
+    data_frame = database.retrieve_data(db, "Active_data", projection=reference_cache._STATS_PROJECTION)
+    version = reference_cache.bump_version(db, name)
+    cluster_stats.save(db, cluster_stats.compute(data_frame, version, name), name)
+    return version
+
+
+def train_clustering_algorithm(db, heating_source, mode=None, profile_memory=True, workers=None,
+                               whole_collection=True) -> list:
+    """
+    Streams the records of the 'Active_data' database collection based on the 'heating_source' argument and performs
+    an agglomerative clustering algorithm on them (see _cluster for the training modes).
+    It writes the calculated labels back to the database in bulk, bumps the version of the partition and of the whole
+    collection, so that the workers reload their cached reference sets, and stores the consumption statistics of the
+    new clusters, the prediction table of the partition and the snapshots of the new versions.
 
     :param db: (pymongo.database)The MongoDB database connection.
     :param heating_source: (str)The heating source to filter the records.
-    :return: (None)
-    """
-    dataFrame = database.retrieve_data(db, "Active_data", {"Heating Source": f"{heating_source}"})
-    IDs = dataFrame["_id"]
-
-    dataFrame_processed = np.array(dataFrame.drop(["_id", "Kwh/day/m2", "Heating Source"], axis=1))
-    if heating_source == "Yes":
-        labels = AgglomerativeClustering(linkage="average", metric="l1", n_clusters=3).fit_predict(
-            dataFrame_processed)
-    elif heating_source == "No":
-        labels = AgglomerativeClustering(linkage="average", metric="euclidean", n_clusters=4).fit_predict(
-            dataFrame_processed)
-    else:
+    :param mode: (str)The training mode, "full" or "scalable". By default, partitions larger than _FULL_TRAINING_LIMIT
+    records are trained in the scalable mode.
+    :param profile_memory: (bool)Whether the peak memory of every stage is measured with tracemalloc.
+    :param workers: (int)The number of processes of the clustering, see _cluster.
+    :param whole_collection: (bool)Whether the version, the statistics and the snapshot of the whole collection are
+    updated too. Concurrent trainings of both partitions leave them to train_partitions, which updates them once both
+    partitions are written.
+    :return: (list)The wall time (and peak memory) of each training stage.
+    """
+    if heating_source not in _PARTITIONS:
         raise ValueError("Heating source should be: {Yes/No}")
+    partition = _PARTITIONS[heating_source]
+
+    tracing = profile_memory and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+
+    report = []
+    try:
+        with _stage(report, "fetch", profile_memory):
+            IDs, features, consumption, grades = _stream_partition(db, heating_source, _TRAINING_BATCH)
+
+        if mode is None:
+            mode = "full" if len(IDs) <= _FULL_TRAINING_LIMIT else "scalable"
+        with _stage(report, f"cluster ({mode})", profile_memory):
+            labels = _cluster(features, partition, mode, workers=workers)
+
+        with _stage(report, "write", profile_memory):
+            _write_labels(db, IDs, labels)
+
+        with _stage(report, "statistics", profile_memory):
+            name = reference_cache.dataset_name(heating_source)
+            data_frame = pd.DataFrame({"Dwelling Grade": grades, "Heating Source": heating_source, "label": labels,
+                                       "Kwh/day/m2": consumption})
+            cluster_stats.save(db, cluster_stats.compute(data_frame, reference_cache.bump_version(db, name), name),
+                               name)
+            if whole_collection:
+                save_collection_stats(db)
+
+        with _stage(report, "prediction table", profile_memory):
+            save_prediction_table(db, heating_source)
 
-    for Id, label in zip(IDs, labels):
-        db["Active_data"].update_one({"_id": Id}, {"$set": {"label": int(label)}})
+        with _stage(report, "snapshot", profile_memory):
+            export_snapshots(db, [heating_source], whole_collection=whole_collection)
+    finally:
+        if tracing:
+            tracemalloc.stop()
+
+    return report
+
+
+def _train_job(connection_string, name, heating_source, mode, workers, profile_memory) -> list:
+    """
+    Trains a heating source partition in a separate process, with its own connection to the database of the caller
+    (see train_clustering_algorithm).
+
+    :param connection_string: (str)The connection string of the caller's database (see database.connection_string).
+    :param name: (str)The database name.
+    """
+    database.set_client(database._create_client(connection_string), connection_string)
+    return train_clustering_algorithm(database.get_client()[name], heating_source, mode, profile_memory, workers,
+                                      whole_collection=False)
+
+
+def train_partitions(db, heating_sources=None, mode=None, workers=None, profile_memory=True) -> dict:
+    """
+    Retrains the given heating source partitions concurrently, in a process each, splitting the worker processes
+    between them (see parallel.workers), and then updates the version, the statistics and the snapshot of the whole
+    'Active_data' collection once. A single worker trains the partitions one after the other in this process, as
+    does a database that other processes cannot connect to (see database.connection_string), e.g. the in-process fake.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param heating_sources: (list)The heating source partitions, all of them by default.
+    :param mode: (str)The training mode, see train_clustering_algorithm.
+    :param workers: (int)The number of processes, see parallel.workers.
+    :param profile_memory: (bool)Whether the peak memory of every stage is measured with tracemalloc.
+    :return: (dict)The training report of every partition, and the stages of the whole collection under "All".
+    """
+    heating_sources = list(heating_sources or _PARTITIONS)
+    workers = parallel.workers(workers)
+    connection_string = database.connection_string(db)
+    if workers == 1 or connection_string is None:
+        reports = [train_clustering_algorithm(db, heating_source, mode, profile_memory, workers,
+                                              whole_collection=False)
+                   for heating_source in heating_sources]
+    else:
+        share = max(1, workers // len(heating_sources))
+        reports = parallel.run_concurrently(_train_job, [(connection_string, db.name, heating_source, mode, share,
+                                                          profile_memory)
+                                                         for heating_source in heating_sources], workers)
+
+    collection = []
+    with _stage(collection, "statistics", False):
+        save_collection_stats(db)
+    with _stage(collection, "snapshot", False):
+        name = reference_cache.dataset_name()
+        reference_cache.confirm_version(name, reference_cache.get_version(db, name))
+        reference_cache.export_snapshot(db)
+    return dict(zip(heating_sources, reports), All=collection)
+
+
+def promote_new_entries(db) -> int:
+    """
+    Promotes the records of the 'New_entries' database collection into the 'Active_data' reference set without
+    retraining: the records of each heating source partition are encoded in a batch, labeled with the exact nearest
+    neighbor of the partition, preprocessed, and appended to the database and to the cached reference sets. The
+    records whose heating source has no partition are not promoted: they are flagged with a 'promotion_error' and
+    never claimed again.
+    The records are first claimed with a unique token and a timestamp, so that concurrent promotion jobs never promote
+    a record twice, and the records of a job that died are claimed again after PROMOTION_CLAIM_TIMEOUT seconds. Every
+    record is inserted under the '_id' of its 'New_entries' record, so a record that the dead job had already inserted
+    is not inserted twice.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :return: (int)The number of promoted records.
+    """
+    token = uuid.uuid4().hex
+    now = time.time()
+    db["New_entries"].update_many({"$or": [{"promoted": {"$exists": False}, "promotion_error": {"$exists": False}},
+                                           {"promoted": {"$type": "string"},
+                                            "claimed_at": {"$lt": now - _PROMOTION_CLAIM_TIMEOUT}}]},
+                                  {"$set": {"promoted": token, "claimed_at": now}})
+
+    promoted = {heating_source: [] for heating_source in _PARTITIONS}
+    invalid = []
+    for entry in db["New_entries"].find({"promoted": token}, batch_size=_TRAINING_BATCH):
+        record = {key: value for key, value in entry.items() if key not in ("promoted", "claimed_at")}
+        if record.get("Heating Source") in _PARTITIONS:
+            promoted[record["Heating Source"]].append(record)
+        else:
+            invalid.append(record["_id"])
+    if invalid:
+        db["New_entries"].update_many({"_id": {"$in": invalid}},
+                                      {"$set": {"promotion_error": "The heating source has no partition."},
+                                       "$unset": {"promoted": "", "claimed_at": ""}})
+        _logger.warning("Skipped %d new entries whose heating source has no partition", len(invalid))
+
+    attributes_info = reference_cache.get_attributes_info(db)
+    for heating_source, records in promoted.items():
+        if not records:
+            continue
+        reference = reference_cache.get_reference_set(db, heating_source)
+        matrix = reference_cache.get_feature_encoder(db, reference).encode_batch(records)
+        for record, vector in zip(records, matrix):
+            label, _ = classify(reference, vector, "exact", _PARTITIONS[heating_source]["metric"])
+            data_manipulation.preprocess_record(record, attributes_info)
+            record["label"] = int(label)
+
+    reinserted = False
+    for heating_source, documents in promoted.items():
+        if documents:
+            if _insert_promoted(db, documents):
+                # The cached reference set may already hold the records inserted by the dead job.
+                reinserted = True
+                reference_cache.invalidate(reference_cache.dataset_name(heating_source))
+            reference_cache.extend(db, heating_source, documents)
+
+    documents = [document for partition in promoted.values() for document in partition]
+    if documents:
+        if reinserted:
+            reference_cache.invalidate(reference_cache.dataset_name())
+        reference_cache.extend(db, None, documents)
+        export_snapshots(db, [heating_source for heating_source, partition in promoted.items() if partition])
+    db["New_entries"].update_many({"promoted": token}, {"$set": {"promoted": True}, "$unset": {"claimed_at": ""}})
+
+    return len(documents)
+
+
+def _insert_promoted(db, documents) -> bool:
+    """
+    Inserts promoted records into the 'Active_data' database collection. The records that are already there (i.e.
+    inserted by a promotion job that died before marking them as promoted) are rejected as duplicates of their '_id'.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param documents: (list)The records, with the '_id' of their 'New_entries' record.
+    :return: (bool)Whether any of the records was already inserted.
+    """
+    try:
+        db["Active_data"].insert_many(documents, ordered=False)
+    except BulkWriteError as error:
+        write_errors = error.details.get("writeErrors", [])
+        if not write_errors or error.details.get("writeConcernErrors") or \
+                any(write_error.get("code") != 11000 for write_error in write_errors):
+            raise
+        return True
+    return False
 
 
 """
-Run main to re-calculate the clusters with records from the 'Active_data' database collection.
+Run main to re-calculate the clusters with records from the 'Active_data' database collection, to promote the
+records of the 'New_entries' database collection into it, to rebuild the prediction tables (e.g. after promotions), or
+to export the snapshots of the current versions, or to keep publishing the snapshot of every new version.
 """
 if __name__ == "__main__":
-    database = database.get_database()
-    train_clustering_algorithm(db=database, heating_source="Yes")
-    train_clustering_algorithm(db=database, heating_source="No")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("job", nargs="?", choices=["train", "promote", "table", "snapshot", "publish"],
+                        default="train")
+    parser.add_argument("--interval", type=float, default=5.0, help="The seconds between two checks of 'publish'.")
+    parser.add_argument("--workers", type=int, help="The processes of 'train', PARALLEL_WORKERS by default. The "
+                                                    "partitions are trained concurrently by more than one.")
+    args = parser.parse_args()
+
+    db = database.get_database()
+    if args.job == "promote":
+        print(f"Promoted {promote_new_entries(db)} new entries.")
+    elif args.job == "table":
+        for source in _PARTITIONS:
+            print(f"{source:>3}: {save_prediction_table(db, source)} profiles")
+    elif args.job == "publish":
+        publish_snapshots(db, args.interval)
+    elif args.job == "snapshot":
+        for directory in export_snapshots(db):
+            print(f"Exported {directory}")
+    else:
+        for source, steps in train_partitions(db, workers=args.workers).items():
+            for step in steps:
+                print(f"{source:>3} {step['stage']:>20}: {step['seconds']:9.2f}s "
+                      f"{step.get('peak_mb', 0):10.1f}MB peak")
@@ -1,11 +1,433 @@
+import os
 import numpy as np
 from functools import total_ordering
 from heapq import heappop, heappush
 
+"""
+The supported distance metrics (named after the 'metric' argument of the clustering algorithm) and their names in
+the sklearn.neighbors tree indexes.
+"""
+_TREE_METRICS = {"euclidean": "euclidean", "l1": "manhattan"}
 
-def Knn(record, k, data, labels):
+"""
+The neighbour search engine used by default ("brute", "sharded", "kd_tree", "ball_tree" or the approximate "ivf") and
+the number of reference rows whose distances are computed at once by the brute-force engine.
+"""
+_DEFAULT_ENGINE = os.environ.get("KNN_ENGINE", "brute")
+_CHUNK_SIZE = int(os.environ.get("KNN_CHUNK_SIZE", 65536))
+
+"""
+The approximate "ivf" engine: the number of inverted lists (0 picks the square root of the number of reference rows),
+the number of lists scanned per query (more lists raise the recall and the latency), and the number of rows per list
+its coarse quantizer is trained on.
+"""
+_IVF_LISTS = int(os.environ.get("KNN_IVF_LISTS", 0))
+_IVF_PROBES = int(os.environ.get("KNN_IVF_PROBES", 8))
+_IVF_TRAINING_ROWS = 64
+
+"""
+Batched euclidean distances are computed through the dot product expansion, whose rounding errors grow with the norms
+of the rows. Squared distances below this tolerance, relative to the squared norms, are computed again from the
+differences, so that only exact matches have a distance of 0 and close neighbors keep their true distance.
+"""
+_RECHECK_TOLERANCE = 1e-6
+
+
+def distances(record, data, metric="euclidean") -> np.ndarray:
+    """
+    Calculates the distance of the given record from every row of 'data' with batched NumPy operations.
+
+    :param record: (np.ndarray)The central record.
+    :param data: (np.ndarray)All the records.
+    :param metric: (str)The distance metric, "euclidean" or "l1".
+    :return: (np.ndarray)The distance of each 'data' row from the record.
+    """
+    if metric not in _TREE_METRICS:
+        raise ValueError("Metric should be: {euclidean/l1}")
+
+    record = np.asarray(record, dtype=data.dtype)
+    result = np.empty(len(data), dtype=np.float64)
+    for start in range(0, len(data), _CHUNK_SIZE):
+        diff = data[start:start + _CHUNK_SIZE] - record
+        if metric == "euclidean":
+            result[start:start + len(diff)] = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+        else:
+            result[start:start + len(diff)] = np.abs(diff).sum(axis=1)
+    return result
+
+
+def batch_distances(records, data, metric="euclidean") -> np.ndarray:
+    """
+    Calculates the distance of every record from every row of 'data'. Exact matches have a distance of exactly 0.
+
+    :param records: (np.ndarray)The central records, one per row.
+    :param data: (np.ndarray)A block of reference records.
+    :param metric: (str)The distance metric, "euclidean" or "l1".
+    :return: (np.ndarray)A matrix with the distance of each 'data' row (columns) from each record (rows).
+    """
+    records = np.asarray(records, dtype=np.float64)
+    data = np.asarray(data, dtype=np.float64)
+    if metric == "euclidean":
+        records_norm = np.einsum("ij,ij->i", records, records)[:, np.newaxis]
+        data_norm = np.einsum("ij,ij->i", data, data)[np.newaxis, :]
+        squared = records_norm - 2 * records @ data.T + data_norm
+        rows, columns = np.nonzero(squared < _RECHECK_TOLERANCE * (1 + records_norm + data_norm))
+        diff = records[rows] - data[columns]
+        squared[rows, columns] = np.einsum("ij,ij->i", diff, diff)
+        return np.sqrt(squared)
+    elif metric == "l1":
+        result = np.empty((len(records), len(data)))
+        step = max(1, _CHUNK_SIZE // max(1, len(data)))
+        for start in range(0, len(records), step):
+            result[start:start + step] = np.abs(records[start:start + step, np.newaxis, :] - data).sum(axis=2)
+        return result
+    raise ValueError("Metric should be: {euclidean/l1}")
+
+
+def vote(labels):
     """
-    A modified version of K-nearest-neighbors for calculating the k-closest records to the given one.
+    :param labels: (array-like)The cluster labels of the nearest records.
+    :return: (int)The most frequent label among them.
+    """
+    # The different labels and the number each of them appears among the neighbors.
+    unique_vals, counts = np.unique(labels, return_counts=True)
+    return unique_vals[np.argmax(counts)]
+
+
+class BruteForceSearch:
+    """
+    A neighbour search engine that computes the distance from every reference row in batches and selects the k
+    closest ones with 'argpartition', which is O(n) instead of the O(n log k) heap.
+    """
+    def __init__(self, data, labels, metric="euclidean") -> None:
+        """
+        Initializing class variables.
+
+        :param data: (np.ndarray)The reference records.
+        :param labels: (np.ndarray)The cluster label of each reference record.
+        :param metric: (str)The distance metric, "euclidean" or "l1".
+        """
+        self.data = data
+        self.labels = np.asarray(labels)
+        self.metric = metric
+
+    def query(self, record, k) -> tuple:
+        """
+        Finds the k reference records closest to the given one. Records at distance 0 (i.e. the record itself) are
+        skipped.
+
+        :param record: (np.ndarray)The central record.
+        :param k: (int)The number of neighbors to be calculated.
+        :return: (tuple)The distances and the labels of the neighbors in ascending distance order.
+        """
+        dist = distances(record, self.data, self.metric)
+        dist[dist == 0] = np.inf
+
+        k = min(k, len(dist))
+        nearest = np.argpartition(dist, k - 1)[:k] if k < len(dist) else np.arange(len(dist))
+        nearest = nearest[np.argsort(dist[nearest], kind="stable")]
+        nearest = nearest[np.isfinite(dist[nearest])]
+
+        return dist[nearest], self.labels[nearest]
+
+    def query_batch(self, records, k) -> tuple:
+        """
+        Finds the k reference records closest to each of the given records, keeping a running top-k per record while
+        scanning the reference records in blocks. Records at distance 0 are skipped.
+
+        :param records: (np.ndarray)The central records, one per row.
+        :param k: (int)The number of neighbors to be calculated.
+        :return: (tuple)Two matrices with the distances and the labels of the neighbors of each record in ascending
+        distance order; missing neighbors have an infinite distance.
+        """
+        best_dist, best_index = top_k(records, self.data, k, self.metric)
+        return best_dist, self.labels[best_index]
+
+
+def top_k(records, data, k, metric="euclidean", offset=0) -> tuple:
+    """
+    Finds the k rows of 'data' closest to each of the given records, keeping a running top-k per record while scanning
+    'data' in blocks. Rows at distance 0 are skipped.
+
+    :param records: (np.ndarray)The central records, one per row.
+    :param data: (np.ndarray)The reference records.
+    :param k: (int)The number of neighbors to be calculated.
+    :param metric: (str)The distance metric, "euclidean" or "l1".
+    :param offset: (int)Added to the returned indices, e.g. the position of 'data' in a larger matrix.
+    :return: (tuple)Two matrices with the distances and the indices of the neighbors of each record in ascending
+    distance order; missing neighbors have an infinite distance.
+    """
+    best_dist = np.full((len(records), k), np.inf)
+    best_index = np.zeros((len(records), k), dtype=np.intp)
+    block_size = max(k, _CHUNK_SIZE * 16 // max(1, len(records)))
+
+    for start in range(0, len(data), block_size):
+        dist = batch_distances(records, data[start:start + block_size], metric)
+        dist[dist == 0] = np.inf
+
+        block_index = np.broadcast_to(np.arange(start, start + dist.shape[1]), dist.shape)
+        best_dist, best_index = merge_top_k([best_dist, dist], [best_index, block_index], k)
+
+    return best_dist, best_index + offset
+
+
+def merge_top_k(distances_list, indices_list, k) -> tuple:
+    """
+    Merges partial top-k results (e.g. of the blocks or the shards of a reference matrix) into the overall top-k.
+
+    :param distances_list: (list)The distance matrices, with a row per record.
+    :param indices_list: (list)The matching index matrices.
+    :param k: (int)The number of neighbors to be kept.
+    :return: (tuple)The distances and the indices of the k closest neighbors of each record in ascending distance
+    order.
+    """
+    dist = np.hstack(distances_list)
+    index = np.hstack(indices_list)
+    keep = np.argpartition(dist, k - 1, axis=1)[:, :k] if dist.shape[1] > k else np.argsort(dist, axis=1)
+    dist = np.take_along_axis(dist, keep, axis=1)
+    index = np.take_along_axis(index, keep, axis=1)
+    order = np.argsort(dist, axis=1, kind="stable")
+    return np.take_along_axis(dist, order, axis=1), np.take_along_axis(index, order, axis=1)
+
+
+class TreeSearch:
+    """
+    A neighbour search engine backed by a KD-tree or a Ball-tree index, which is built once over the reference records.
+    """
+    def __init__(self, data, labels, metric="euclidean", kind="kd_tree", leaf_size=40) -> None:
+        """
+        Initializing class variables.
+
+        :param data: (np.ndarray)The reference records.
+        :param labels: (np.ndarray)The cluster label of each reference record.
+        :param metric: (str)The distance metric, "euclidean" or "l1".
+        :param kind: (str)The index type, "kd_tree" or "ball_tree".
+        :param leaf_size: (int)The number of records in the leaves of the tree.
+        """
+        from sklearn.neighbors import BallTree, KDTree
+
+        if metric not in _TREE_METRICS:
+            raise ValueError("Metric should be: {euclidean/l1}")
+        if kind not in ("kd_tree", "ball_tree"):
+            raise ValueError("Index type should be: {kd_tree/ball_tree}")
+
+        tree_class = KDTree if kind == "kd_tree" else BallTree
+        self.tree = tree_class(np.asarray(data, dtype=np.float64), leaf_size=leaf_size, metric=_TREE_METRICS[metric])
+        self.labels = np.asarray(labels)
+        self.metric = metric
+        self.size = len(data)
+
+    def query(self, record, k) -> tuple:
+        """
+        Finds the k reference records closest to the given one. Records at distance 0 (i.e. the record itself) are
+        skipped, so the index is queried again for more neighbors while duplicates fill the result.
+
+        :param record: (np.ndarray)The central record.
+        :param k: (int)The number of neighbors to be calculated.
+        :return: (tuple)The distances and the labels of the neighbors in ascending distance order.
+        """
+        record = np.asarray(record, dtype=np.float64).reshape(1, -1)
+        requested = k + 1
+        while True:
+            requested = min(requested, self.size)
+            dist, nearest = self.tree.query(record, k=requested)
+            dist, nearest = dist[0], nearest[0]
+            keep = dist != 0
+            if keep.sum() >= k or requested == self.size:
+                dist, nearest = dist[keep][:k], nearest[keep][:k]
+                return dist, self.labels[nearest]
+            requested *= 2
+
+    def query_batch(self, records, k) -> tuple:
+        """
+        Finds the k reference records closest to each of the given records with a single index query. Records at
+        distance 0 are skipped, so the index is queried again for the records whose neighbors include duplicates.
+
+        :param records: (np.ndarray)The central records, one per row.
+        :param k: (int)The number of neighbors to be calculated.
+        :return: (tuple)Two matrices with the distances and the labels of the neighbors of each record in ascending
+        distance order; missing neighbors have an infinite distance.
+        """
+        records = np.asarray(records, dtype=np.float64)
+        best_dist = np.full((len(records), k), np.inf)
+        best_labels = np.zeros((len(records), k), dtype=self.labels.dtype)
+
+        dist, nearest = self.tree.query(records, k=min(k + 1, self.size))
+        for row in range(len(records)):
+            keep = dist[row] != 0
+            if keep.sum() < k and len(dist[row]) < self.size:
+                row_dist, row_labels = self.query(records[row], k)
+            else:
+                row_dist, row_labels = dist[row][keep][:k], self.labels[nearest[row][keep][:k]]
+            best_dist[row, :len(row_dist)] = row_dist
+            best_labels[row, :len(row_labels)] = row_labels
+
+        return best_dist, best_labels
+
+
+class IVFSearch:
+    """
+    An approximate neighbour search engine with an inverted file index: a k-means coarse quantizer splits the reference
+    records into lists, and every query only scans the 'n_probes' lists with the closest centroids. The recall and the
+    latency grow with 'n_probes', which can be changed on a built index.
+    """
+    def __init__(self, data, labels, metric="euclidean", n_lists=None, n_probes=None, iterations=10, seed=0) -> None:
+        """
+        Initializing class variables.
+
+        :param data: (np.ndarray)The reference records.
+        :param labels: (np.ndarray)The cluster label of each reference record.
+        :param metric: (str)The distance metric, "euclidean" or "l1".
+        :param n_lists: (int)The number of inverted lists. Defaults to the KNN_IVF_LISTS setting.
+        :param n_probes: (int)The number of lists scanned per query. Defaults to the KNN_IVF_PROBES setting.
+        :param iterations: (int)The number of k-means iterations of the coarse quantizer.
+        :param seed: (int)The random seed of the coarse quantizer.
+        """
+        if metric not in _TREE_METRICS:
+            raise ValueError("Metric should be: {euclidean/l1}")
+
+        self.data = data
+        self.labels = np.asarray(labels)
+        self.metric = metric
+        self.size = len(data)
+        n_lists = n_lists or _IVF_LISTS or int(np.sqrt(self.size))
+        self.n_lists = max(1, min(n_lists, self.size))
+        self.n_probes = n_probes or _IVF_PROBES
+
+        self._train(iterations, np.random.default_rng(seed))
+        assignment = self._assign(data)
+        # The rows of every list are stored contiguously: list i holds members[offsets[i]:offsets[i + 1]].
+        self.members = np.argsort(assignment, kind="stable")
+        self.offsets = np.searchsorted(assignment[self.members], np.arange(self.n_lists + 1))
+
+    def _assign(self, records) -> np.ndarray:
+        """
+        :param records: (np.ndarray)The records, one per row.
+        :return: (np.ndarray)The index of the closest centroid of each record.
+        """
+        step = max(1, _CHUNK_SIZE * 16 // self.n_lists)
+        return np.concatenate([np.argmin(batch_distances(records[start:start + step], self.centroids, self.metric),
+                                         axis=1) for start in range(0, len(records), step)])
+
+    def _train(self, iterations, rng) -> None:
+        """
+        Trains the coarse quantizer on a sample of the reference records with Lloyd's k-means: the centroids are the
+        means of their records for "euclidean" and the coordinate-wise medians for "l1". Emptied lists are re-seeded
+        with a random sample record.
+
+        :param iterations: (int)The number of k-means iterations.
+        :param rng: (np.random.Generator)The random generator.
+        """
+        sample_size = min(self.size, self.n_lists * _IVF_TRAINING_ROWS)
+        sample = np.asarray(self.data[np.sort(rng.choice(self.size, sample_size, replace=False))], dtype=np.float32)
+        self.centroids = sample[rng.choice(sample_size, self.n_lists, replace=False)]
+        reduce = np.mean if self.metric == "euclidean" else np.median
+        for _ in range(iterations):
+            assignment = self._assign(sample)
+            for index in range(self.n_lists):
+                members = sample[assignment == index]
+                self.centroids[index] = reduce(members, axis=0) if len(members) else sample[rng.integers(sample_size)]
+
+    def candidates(self, record, n_probes) -> np.ndarray:
+        """
+        :param record: (np.ndarray)The central record.
+        :param n_probes: (int)The number of scanned lists.
+        :return: (np.ndarray)The indices of the reference records in the lists with the closest centroids.
+        """
+        n_probes = min(n_probes, self.n_lists)
+        order = distances(record, self.centroids, self.metric)
+        closest = np.argpartition(order, n_probes - 1)[:n_probes] if n_probes < self.n_lists else range(self.n_lists)
+        return np.concatenate([self.members[self.offsets[index]:self.offsets[index + 1]] for index in closest])
+
+    def query(self, record, k) -> tuple:
+        """
+        Finds (approximately) the k reference records closest to the given one, scanning more lists while the scanned
+        ones hold fewer than k records. Records at distance 0 (i.e. the record itself) are skipped.
+
+        :param record: (np.ndarray)The central record.
+        :param k: (int)The number of neighbors to be calculated.
+        :return: (tuple)The distances and the labels of the neighbors in ascending distance order.
+        """
+        n_probes = self.n_probes
+        while True:
+            rows = self.candidates(record, n_probes)
+            dist = distances(record, self.data[rows], self.metric)
+            dist[dist == 0] = np.inf
+            if np.isfinite(dist).sum() >= k or n_probes >= self.n_lists:
+                break
+            n_probes *= 2
+
+        count = min(k, len(dist))
+        nearest = np.argpartition(dist, count - 1)[:count] if count < len(dist) else np.arange(len(dist))
+        nearest = nearest[np.argsort(dist[nearest], kind="stable")]
+        nearest = nearest[np.isfinite(dist[nearest])]
+        return dist[nearest], self.labels[rows[nearest]]
+
+    def query_batch(self, records, k) -> tuple:
+        """
+        Finds (approximately) the k reference records closest to each of the given records.
+
+        :param records: (np.ndarray)The central records, one per row.
+        :param k: (int)The number of neighbors to be calculated.
+        :return: (tuple)Two matrices with the distances and the labels of the neighbors of each record in ascending
+        distance order; missing neighbors have an infinite distance.
+        """
+        best_dist = np.full((len(records), k), np.inf)
+        best_labels = np.zeros((len(records), k), dtype=self.labels.dtype)
+        for row, record in enumerate(records):
+            row_dist, row_labels = self.query(record, k)
+            best_dist[row, :len(row_dist)] = row_dist
+            best_labels[row, :len(row_labels)] = row_labels
+        return best_dist, best_labels
+
+
+def make_engine(data, labels, metric="euclidean", engine=None):
+    """
+    Creates a neighbour search engine over the given reference records.
+
+    :param data: (np.ndarray)The reference records.
+    :param labels: (np.ndarray)The cluster label of each reference record.
+    :param metric: (str)The distance metric, "euclidean" or "l1".
+    :param engine: (str)The engine type: "brute", "sharded" (brute force over a process pool, see parallel),
+    "kd_tree", "ball_tree" or the approximate "ivf". Defaults to the KNN_ENGINE setting.
+    :return: (BruteForceSearch | TreeSearch | IVFSearch | parallel.ShardedSearch)The search engine.
+    """
+    engine = engine or _DEFAULT_ENGINE
+    if engine == "brute":
+        return BruteForceSearch(data, labels, metric)
+    elif engine in ("kd_tree", "ball_tree"):
+        return TreeSearch(data, labels, metric, kind=engine)
+    elif engine == "ivf":
+        return IVFSearch(data, labels, metric)
+    elif engine == "sharded":
+        from parallel import ShardedSearch
+        return ShardedSearch(data, labels, metric)
+    raise ValueError("Engine should be: {brute/sharded/kd_tree/ball_tree/ivf}")
+
+
+def Knn(record, k, data=None, labels=None, metric="euclidean", engine=None):
+    """
+    K-nearest-neighbors for calculating the k-closest records to the given one and the most frequent cluster label
+    among them. Records at distance 0 from the given record are skipped.
+
+    :param record: (np.ndarray) The central record.
+    :param k: (int) The number of neighbors to be calculated.
+    :param data: (np.ndarray) All the records. Not needed when a prebuilt 'engine' is given.
+    :param labels: (list) The cluster label of each 'data' record. Not needed when a prebuilt 'engine' is given.
+    :param metric: (str) The distance metric, "euclidean" or "l1".
+    :param engine: (BruteForceSearch | TreeSearch | IVFSearch) A prebuilt search engine over the records.
+    :return: (int) The most frequent cluster label among the nearest records.
+    """
+    if engine is None:
+        engine = BruteForceSearch(data, labels, metric)
+
+    _, neighbor_labels = engine.query(record, k)
+    return vote(neighbor_labels)
+
+
+def heap_Knn(record, k, data, labels):
+    """
+    The original row-by-row version of K-nearest-neighbors, kept as a reference for the benchmarks.
     It is based ona min heap that always keeps the records with the minimum distance from the given
     record at the top, eliminating the need for sorting.
 
@@ -28,12 +450,7 @@ def Knn(record, k, data, labels):
         if len(min_heap) > k:
             heappop(min_heap)
 
-    # The different labels and the number each of them appears in the heap.
-    unique_vals, counts = np.unique([idx.index for idx in min_heap], return_counts=True)
-    # The most frequent label in the heap.
-    max_count_idx = np.argmax(counts)
-
-    return unique_vals[max_count_idx]
+    return vote([idx.index for idx in min_heap])
 
 
 @total_ordering
@@ -1,16 +1,191 @@
-import seaborn as sns
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
-import mpld3
+import metrics
 
 
 _dwellings = {1.0: "Family House", 0.7: "Semidetached", 0.4: "Townhome", 0.0: "Apartment"}
 
+"""
+The number of bins and KDE sample points of the similar dwellings plot, and the maximum number of cached plot parts.
+"""
+_HISTOGRAM_BINS = 30
+_KDE_POINTS = 200
+_CACHE_SIZE = int(os.environ.get("PLOT_CACHE_SIZE", 256))
+
+
+class PlotCache:
+    """
+    A thread-safe cache with least-recently-used eviction for the plot parts that only depend on the dataset version.
+    """
+    def __init__(self, size) -> None:
+        """
+        Initializing class variables.
+
+        :param size: (int)The maximum number of cached items.
+        """
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        """
+        Returns the cached item of the key, building and caching it on a miss. Keys without a dataset version (None as
+        their first element) are never cached.
+
+        :param key: (tuple)The cache key.
+        :param build: (callable)A function that builds the item.
+        :return: The cached item.
+        """
+        if key[0] is None:
+            return build()
+
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+            self.misses += 1
+
+        item = build()
+        with self.lock:
+            self.items[key] = item
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+        return item
+
+    def clear(self) -> None:
+        with self.lock:
+            self.items.clear()
+
+
+plot_cache = PlotCache(_CACHE_SIZE)
+
+
+def plotting_modules() -> tuple:
+    """
+    Imports the plotting libraries of the server-rendered plots on first use, since the client-rendered charts and the
+    other pages never need them. Matplotlib is forced to the non-GUI 'Agg' backend (unless MPLBACKEND says otherwise).
+    The figures are built with the object-oriented Figure class rather than pyplot, whose global state is not
+    thread-safe, since the plots of concurrent requests are rendered on different threads.
+
+    :return: (tuple)The seaborn module, the matplotlib.figure.Figure class, and the plotly.graph_objects and mpld3
+    modules.
+    """
+    import matplotlib
+    matplotlib.use(os.environ.get("MPLBACKEND", "Agg"))
+    from matplotlib.figure import Figure
+    import mpld3
+    import plotly.graph_objects as go
+    import seaborn as sns
+    return sns, Figure, go, mpld3
+
+
+def distribution_base(distribution) -> dict:
+    """
+    Calculates the static part of the similar dwellings plot: a 30-bin histogram spanning from the minimum
+    consumption up to the maximum consumption increased by 10%, and a Gaussian KDE curve (Scott's bandwidth) scaled to
+    the histogram counts, as drawn by seaborn.
+
+    :param distribution: (np.ndarray)The consumption of the dwellings of the same type.
+    :return: (dict)The bin edges and counts, and the KDE sample points.
+    """
+    low, high = float(np.min(distribution)), float(np.max(distribution))
+    high = high + 0.10 * high
+    if high <= low:
+        high = low + 1.0
+    counts, edges = np.histogram(distribution, bins=_HISTOGRAM_BINS, range=(low, high))
+
+    kde_x = np.linspace(low, high, _KDE_POINTS)
+    kde_y = np.zeros(_KDE_POINTS)
+    bandwidth = float(np.std(distribution, ddof=1)) * len(distribution) ** (-1 / 5) if len(distribution) > 1 else 0.0
+    if bandwidth > 0:
+        for start in range(0, len(distribution), 4096):
+            chunk = distribution[start:start + 4096, np.newaxis]
+            kde_y += np.exp(-0.5 * ((kde_x - chunk) / bandwidth) ** 2).sum(axis=0)
+        kde_y *= (edges[1] - edges[0]) / (bandwidth * np.sqrt(2 * np.pi))
+
+    return {"edges": edges, "counts": counts, "kde_x": kde_x, "kde_y": kde_y}
+
+
+def similar_dwellings_distribution(data_frame, grade) -> dict:
+    """
+    Returns the histogram and KDE of the dwellings of the given type, cached per dataset version.
+
+    :param data_frame: (pandas.DataFrame)All the records from the 'Active_data' database collection.
+    :param grade: (float)The dwelling grade.
+    :return: (dict)The bin edges and counts, and the KDE sample points (see distribution_base).
+    """
+    def build() -> dict:
+        with metrics.timed("plot_distribution"):
+            distribution = data_frame.loc[data_frame['Dwelling Grade'] == grade]["Kwh/day/m2"]
+            return distribution_base(distribution.to_numpy(dtype=np.float64))
+
+    return plot_cache.get((data_frame.attrs.get("version"), "distribution", grade), build)
+
+
+def covering_distribution(base, value) -> dict:
+    """
+    Extends the histogram of the similar dwellings plot with empty bins of the same width until it covers a value
+    outside of it (e.g. the actual consumption of the user's dwelling, which is not part of the cached histogram), so
+    that the value is not counted in an edge bin. A value more than _HISTOGRAM_BINS bins away gets a single wider bin.
+
+    :param base: (dict)The histogram and KDE of the dwellings of the same type (see distribution_base).
+    :param value: (float)The value to be covered.
+    :return: (dict)The same histogram and KDE, with the extended bin edges and counts.
+    """
+    edges = base["edges"]
+    width = edges[1] - edges[0]
+    if edges[0] <= value <= edges[-1] or not np.isfinite(value):
+        return base
+
+    gap = edges[0] - value if value < edges[0] else value - edges[-1]
+    steps = int(np.ceil(gap / width))
+    extension = width * np.arange(1, steps + 1) if steps <= _HISTOGRAM_BINS else np.array([gap])
+    if value < edges[0]:
+        edges = np.concatenate([edges[0] - extension[::-1], edges])
+        counts = np.concatenate([np.zeros(len(extension), dtype=base["counts"].dtype), base["counts"]])
+    else:
+        edges = np.concatenate([edges, edges[-1] + extension])
+        counts = np.concatenate([base["counts"], np.zeros(len(extension), dtype=base["counts"].dtype)])
+    return {**base, "edges": edges, "counts": counts}
+
+
+def highlight_state(edges, prediction, actual) -> tuple:
+    """
+    Calculates which bins of the similar dwellings plot are highlighted:
+    -> the bin of the actual consumption is yellow, if it is within 10% above the prediction or below it, and
+    orange otherwise.
+    -> when the actual consumption is orange, the bin of the prediction is yellow.
+
+    :param edges: (np.ndarray)The bin edges, which cover the actual consumption (see covering_distribution).
+    :param prediction: (float)The predicted energy consumption value.
+    :param actual: (float)The actual energy consumption value.
+    :return: (tuple)The bin of the actual consumption, the highlighted bin of the prediction (or None), and whether
+    the actual consumption is within the acceptable limits.
+    """
+    def bin_of(value) -> int:
+        return int(np.clip(np.searchsorted(edges, value, side="right") - 1, 0, len(edges) - 2))
+
+    in_same_bin = actual <= prediction + ((prediction * 10) / 100)
+    actual_bin = bin_of(actual)
+    prediction_bin = None
+    if not in_same_bin and edges[0] <= prediction <= edges[-1] and bin_of(prediction) != actual_bin:
+        prediction_bin = bin_of(prediction)
+    return actual_bin, prediction_bin, in_same_bin
+
 
 class PlotGenerator:
     """
     A class that calculates dynamic plots for the results HTML page based on the user's input data.
+    The parts that only depend on the dataset (the all dwellings plot and the histogram of every dwelling type) and
+    the rendered histograms of every highlighting state are cached per dataset version, which is read from the
+    'version' entry of the data frame attrs.
     """
     def __init__(self, df, pred, actual_value, record) -> None:
         """
@@ -21,16 +196,16 @@ class PlotGenerator:
         :param actual_value: (float)The actual energy consumption value of the given record.
         :param record: (dict)The user input from HTML forms.
         """
-        sns.set_palette(sns.color_palette("Spectral"))
         self.data_frame = df
         self.prediction = pred
         self.actual = actual_value
         self.record = record
+        self.version = df.attrs.get("version")
 
         self.dtype = _dwellings[record['Dwelling Grade']]
 
         self.plot_slot1, self.patches = self.similar_dwellings_plot()
-        self.plot_slot3 = self.all_dwellings_plot()
+        self.plot_slot3 = plot_cache.get((self.version, "all_dwellings"), self.all_dwellings_plot)
 
     def all_dwellings_plot(self) -> str:
         """
@@ -39,80 +214,147 @@ class PlotGenerator:
 
         :return: (str)A string that contains HTML code.
         """
-        kwhs = pd.DataFrame(self.data_frame.groupby('Dwelling Grade').mean(numeric_only=True))["Kwh/day/m2"]
-        Dwellings = ["Apartment", "Townhome", "Semidetached", "Family House"]
+        go = plotting_modules()[2]
+        with metrics.timed("plot_all_dwellings"):
+            kwhs = pd.DataFrame(self.data_frame.groupby('Dwelling Grade').mean(numeric_only=True))["Kwh/day/m2"]
+            Dwellings = ["Apartment", "Townhome", "Semidetached", "Family House"]
 
-        fig = go.Figure()
-        fig.add_trace(go.Bar(x=Dwellings, y=kwhs, marker=dict(color=["#9b0f00", "#c16434", "#dfa669", "#edc986"])))
-        fig.update_layout(
-            autosize=True,
-            height=300,
-            width=450,
-            plot_bgcolor='rgba(0,0,0,0)',
-            paper_bgcolor='rgba(0,0,0,0)',
-            margin=dict(l=0, r=0, t=0, b=0),
-            xaxis=dict(showgrid=False),
-            yaxis=dict(showgrid=False, anchor='x', title={"text": "Kwhs"}),
-        )
+            fig = go.Figure()
+            fig.add_trace(go.Bar(x=Dwellings, y=kwhs,
+                                 marker=dict(color=["#9b0f00", "#c16434", "#dfa669", "#edc986"])))
+            fig.update_layout(
+                autosize=True,
+                height=300,
+                width=450,
+                plot_bgcolor='rgba(0,0,0,0)',
+                paper_bgcolor='rgba(0,0,0,0)',
+                margin=dict(l=0, r=0, t=0, b=0),
+                xaxis=dict(showgrid=False),
+                yaxis=dict(showgrid=False, anchor='x', title={"text": "Kwhs"}),
+            )
 
-        return fig.to_html(full_html=False, config={'displayModeBar': False})
+            return fig.to_html(full_html=False, config={'displayModeBar': False})
+
+    def distribution(self) -> dict:
+        """
+        :return: (dict)The cached histogram and KDE of the dwellings of the same type (see distribution_base).
+        """
+        return similar_dwellings_distribution(self.data_frame, self.record['Dwelling Grade'])
 
     def similar_dwellings_plot(self) -> tuple:
         """
         Plots a dynamic distribution plot that presents the user input energy consumption in contrast to similar type
-        dwelling consumptions. Uses matplotlib, seaborn and mpld3 libraries.
+        dwelling consumptions. Uses matplotlib and mpld3 libraries.
 
         :return: (tuple)A tuple containing a string with HTML code and a bool value that informs the HTML page what
         coloring system to use.
         """
-        self.data_frame = pd.concat([self.data_frame, pd.DataFrame(self.record, index=[0])], ignore_index=True)
-        distribution = \
-            self.data_frame.loc[self.data_frame['Dwelling Grade'] == self.record['Dwelling Grade']][
-                "Kwh/day/m2"]
+        base = covering_distribution(self.distribution(), self.actual)
+        state = highlight_state(base["edges"], self.prediction, self.actual)
 
-        print(len(self.data_frame.loc[self.data_frame['Dwelling Grade'] == self.record['Dwelling Grade']]))
+        key = (self.version, "similar_dwellings", self.record['Dwelling Grade'], float(base["edges"][0]),
+               float(base["edges"][-1])) + state
+        return plot_cache.get(key, lambda: (self.render_similar_dwellings(base, *state), state[2]))
 
-        x_range = (max(distribution) + 0.10*max(distribution)) - min(distribution)
-        bin_size = x_range / 30
+    @staticmethod
+    @metrics.timed("plot_similar_dwellings")
+    def render_similar_dwellings(base, actual_bin, prediction_bin, in_same_bin) -> str:
+        """
+        Renders the similar dwellings histogram with the given highlighting state and releases the figure.
 
-        fig, ax = plt.subplots(figsize=(4, 3))
-        hist = sns.histplot(distribution, kde=True, binwidth=bin_size)
+        :param base: (dict)The histogram and KDE of the dwellings of the same type.
+        :param actual_bin: (int)The bin of the actual consumption, which also contains the user's dwelling.
+        :param prediction_bin: (int)The highlighted bin of the prediction, or None.
+        :param in_same_bin: (bool)Whether the actual consumption is within the acceptable limits.
+        :return: (str)A string that contains HTML code.
+        """
+        edges = base["edges"]
+        counts = base["counts"].astype(np.float64)
+        counts[actual_bin] += 1
+        colors = ['#9b0f00'] * len(counts)
+        colors[actual_bin] = '#FEFEB4' if in_same_bin else '#ffa600'
+        if prediction_bin is not None:
+            counts[prediction_bin] = max(counts[prediction_bin], 1)
+            colors[prediction_bin] = '#FEFEB4'
+
+        sns, Figure, _, mpld3 = plotting_modules()
+        # The figure is not registered with pyplot, so it is released with its last reference.
+        fig = Figure(figsize=(4, 3))
+        ax = fig.subplots()
+        ax.bar(edges[:-1], counts, width=np.diff(edges), align="edge", color=colors, edgecolor="white")
+        ax.plot(base["kde_x"], base["kde_y"], color=sns.color_palette("Spectral")[0])
         ax.set_title("Distribution of electrical consumption of similar Dwellings")
 
-        patches = hist.patches
+        ax.set_ylabel("No of Dwellings")
+        ax.set_xlabel(None)
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+        ax.spines['bottom'].set_visible(False)
+        ax.spines['left'].set_visible(False)
+        ax.set_facecolor((0., 0., 0., 0.))
+
+        return mpld3.fig_to_html(fig)
+
+
+class ChartData:
+    """
+    The compact data of the results page charts, drawn in the browser (see static/Javascript/charts.js) instead of
+    shipping server-rendered figures. It exposes the same 'dtype' and 'patches' attributes as PlotGenerator, with
+    empty plot slots.
+    """
+    plot_slot1 = None
+    plot_slot3 = None
 
-        real_cons = self.actual
+    def __init__(self, df, pred, actual_value, record) -> None:
+        """
+        Initializing class variables.
 
-        in_same_bin = False
-        for patch in patches:
+        :param df: (pandas.DataFrame)All the records from the 'Active_data' database collection.
+        :param pred: (float)The predicted energy consumption value of the given record.
+        :param actual_value: (float)The actual energy consumption value of the given record.
+        :param record: (dict)The user input from HTML forms.
+        """
+        self.data_frame = df
+        self.version = df.attrs.get("version")
+        self.grade = record['Dwelling Grade']
+        self.dtype = _dwellings[self.grade]
 
-            patch.set_fc('#9b0f00')
-            if patch.get_x() <= real_cons <= patch.get_x() + patch.get_width():
-                if patch.get_height() == 0:
-                    patch.set_height(1)
+        self.base = covering_distribution(similar_dwellings_distribution(df, self.grade), actual_value)
+        self.state = highlight_state(self.base["edges"], pred, actual_value)
+        self.patches = self.state[2]
 
-                if self.prediction > real_cons:
-                    patch.set_fc('#FEFEB4')
-                    in_same_bin = True
-                elif self.prediction <= real_cons <= self.prediction + ((self.prediction * 10) / 100):
-                    patch.set_fc('#FEFEB4')
-                    in_same_bin = True
-                elif real_cons > self.prediction + ((self.prediction * 10) / 100):
+    def dwelling_means(self) -> list:
+        """
+        :return: (list)The mean energy consumption per Dwelling type, in ascending Dwelling Grade order.
+        """
+        def build() -> list:
+            kwhs = self.data_frame.groupby('Dwelling Grade')["Kwh/day/m2"].mean()
+            return [{"dwelling": _dwellings[grade], "kwhs": float(kwh)} for grade, kwh in kwhs.items()]
 
-                    patch.set_fc('#ffa600')
+        return plot_cache.get((self.version, "dwelling_means"), build)
 
-            elif patch.get_x() <= self.prediction <= patch.get_x() + patch.get_width() and \
-                    real_cons > self.prediction + ((self.prediction * 10) / 100) and not in_same_bin:
-                if patch.get_height() == 0:
-                    patch.set_height(1)
-                patch.set_fc('#FEFEB4')
+    def etag(self) -> str:
+        """
+        :return: (str)An entity tag that changes with the dataset version, the dwelling type, the bins and the
+        highlighting state.
+        """
+        edges = self.base["edges"]
+        return "-".join(str(part) for part in (self.version, self.grade, len(edges), float(edges[0]),
+                                               float(edges[-1])) + self.state)
 
-        plt.ylabel("No of Dwellings")
-        plt.xlabel(None)
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-        ax.spines['bottom'].set_visible(False)
-        ax.spines['left'].set_visible(False)
-        ax.set_facecolor((0., 0., 0., 0.))
+    def to_json(self) -> dict:
+        """
+        :return: (dict)The histogram bin edges and counts, the KDE sample points, the highlighting state and the mean
+        consumption per dwelling type.
+        """
+        actual_bin, prediction_bin, in_same_bin = self.state
+        counts = self.base["counts"].copy()
+        counts[actual_bin] += 1
+        if prediction_bin is not None:
+            counts[prediction_bin] = max(counts[prediction_bin], 1)
 
-        return mpld3.fig_to_html(fig), in_same_bin
+        return {"dwelling": self.dtype,
+                "histogram": {"edges": self.base["edges"].tolist(), "counts": counts.tolist()},
+                "kde": {"x": np.round(self.base["kde_x"], 6).tolist(), "y": np.round(self.base["kde_y"], 6).tolist()},
+                "highlight": {"actual_bin": actual_bin, "prediction_bin": prediction_bin, "in_same_bin": in_same_bin},
+                "dwelling_means": self.dwelling_means()}
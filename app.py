@@ -1,16 +1,200 @@
+import hashlib
+import importlib
+import importlib.util
+import io
+import os
+import sys
+import time
+import types
 from datetime import timedelta
-from flask import Flask, redirect, url_for, render_template, request, session, json
+from flask import Flask, redirect, url_for, render_template, request, session, json, jsonify, stream_with_context, g, \
+    make_response
 from werkzeug import Response
 
-import Clusters
-import Plot_generator
-import lavoro_api_calls
-import data_manipulation
-import database
+import metrics
+import static_assets
+
+# Imports the modules of the scientific stack on first use (1), or at startup (0), e.g. in a gunicorn master that
+# preloads the application (see gunicorn.conf.py).
+_LAZY_IMPORTS = os.environ.get("LAZY_IMPORTS", "1") == "1"
+
+
+def lazy_import(name):
+    """
+    Imports a module that is executed on the first access to one of its attributes (see importlib.util.LazyLoader),
+    so that the pages that do not need it never pay for its import. With LAZY_IMPORTS=0 it is imported right away.
+
+    :param name: (str)The module name.
+    :return: (module)The module.
+    """
+    if not _LAZY_IMPORTS or name in sys.modules:
+        return importlib.import_module(name)
+
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def loaded_module(name):
+    """
+    :param name: (str)The module name.
+    :return: (module | None)The module, if it has been executed, e.g. not a lazily imported module that has never been
+    accessed (see lazy_import).
+    """
+    module = sys.modules.get(name)
+    # A lazily imported module turns into a plain module once it is executed.
+    return module if type(module) is types.ModuleType else None
+
+
+batch_scoring = lazy_import("batch_scoring")
+Clusters = lazy_import("Clusters")
+Plot_generator = lazy_import("Plot_generator")
+database = lazy_import("database")
+ingestion = lazy_import("ingestion")
+prediction = lazy_import("prediction")
+prediction_table = lazy_import("prediction_table")
+reference_cache = lazy_import("reference_cache")
 
 app = Flask(__name__)
 app.secret_key = 'energy_key'
 app.permanent_session_lifetime = timedelta(minutes=10)
+# "client" draws the results charts in the browser from the /api/charts data, "server" renders them with
+# Plot_generator.PlotGenerator.
+app.config["CHART_RENDERING"] = os.environ.get("CHART_RENDERING", "client")
+app.config["CHART_MAX_AGE"] = int(os.environ.get("CHART_MAX_AGE", 300))
+# Serves the fingerprinted and precompressed assets of 'python static_assets.py', if they were built.
+static_assets.init_app(app)
+
+# The rendered HTML of the pages without any session data, by template name, with its ETag.
+_page_cache = {}
+
+# Promotes the queued form submissions into the reference set every PROMOTION_INTERVAL seconds (disabled when 0).
+_PROMOTION_INTERVAL = float(os.environ.get("PROMOTION_INTERVAL", 0))
+# The promotion scheduler thread by process.
+_schedulers = {}
+
+
+def start_promotion() -> None:
+    """
+    Starts the promotion scheduler of the current process, once. It is started in every serving process, e.g. by the
+    post_worker_init hook of gunicorn (see gunicorn.conf.py), and not at import, since the thread would not survive
+    the fork of the workers from a master that preloads the application.
+    """
+    if _PROMOTION_INTERVAL > 0 and os.getpid() not in _schedulers:
+        _schedulers[os.getpid()] = ingestion.start_scheduler(
+            lambda: Clusters.promote_new_entries(database.get_database()), _PROMOTION_INTERVAL,
+            name="promote-new-entries")
+
+
+def collect_gauges() -> list:
+    """
+    Collects the gauges of the '/metrics' endpoint: the size of every cached reference set, the plot cache and
+    prediction table statistics, the MongoDB pool wait times and the write-behind queues of the current worker.
+    The gauges of a module are only read once it has been used, so that a scrape never imports the scientific stack.
+
+    :return: (list)The (name, labels, value) tuples.
+    """
+    gauges = []
+    if loaded_module("reference_cache") is not None:
+        for name, entry in list(reference_cache._cache.items()):
+            reference = entry["reference"]
+            gauges += [("reference_rows", {"dataset": name}, len(reference)),
+                       ("reference_version", {"dataset": name}, reference.version),
+                       ("reference_features_bytes", {"dataset": name}, reference.features.nbytes),
+                       ("reference_shared", {"dataset": name}, int(reference.shared)),
+                       ("reference_data_frame_bytes", {"dataset": name},
+                        int(reference.data_frame.memory_usage(index=True).sum()))]
+
+    if loaded_module("Plot_generator") is not None:
+        cache = Plot_generator.plot_cache
+        gauges += [("plot_cache_hits", {}, cache.hits), ("plot_cache_misses", {}, cache.misses),
+                   ("plot_cache_entries", {}, len(cache.items))]
+    if loaded_module("prediction_table") is not None:
+        gauges += [(f"prediction_cache_{key}", {}, value) for key, value in prediction_table.stats().items()]
+    if loaded_module("database") is not None:
+        gauges += [(f"mongo_pool_{key}", {}, value) for key, value in database.pool_listener.stats().items()]
+    if loaded_module("ingestion") is not None:
+        for (pid, collection), queue in list(ingestion._queues.items()):
+            if pid == os.getpid():
+                gauges += [(f"ingestion_{key}", {"collection": collection}, value)
+                           for key, value in queue.stats().items()]
+    return gauges
+
+
+metrics.register_collector(collect_gauges)
+
+
+def preload() -> None:
+    """
+    Imports every module of the scientific stack (pandas, scikit-learn, and the plotting libraries when the charts are
+    rendered on the server), e.g. once in a gunicorn master before the workers are forked, so that the workers share
+    the imported modules and start serving right away.
+    """
+    # Any attribute access executes a lazily imported module.
+    for module in (batch_scoring, Clusters, database, ingestion, Plot_generator, prediction, prediction_table,
+                   reference_cache):
+        getattr(module, "__file__")
+    importlib.import_module("sklearn.cluster")
+    importlib.import_module("sklearn.neighbors")
+    if app.config["CHART_RENDERING"] == "server":
+        Plot_generator.plotting_modules()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+
+def render_page(template_name, cached=False, **context) -> Response:
+    """
+    Renders a page whose HTML only depends on the session, with an ETag of its content, so that revisits are answered
+    with '304 Not Modified'. The responses are private, since they depend on the session, and are revalidated on every
+    visit.
+
+    :param template_name: (str)The template name.
+    :param cached: (bool)Whether the page has no session data, so its HTML is rendered once and reused.
+    :param context: The template variables.
+    :return: (Response)The page.
+    """
+    page = _page_cache.get(template_name) if cached else None
+    if page is None:
+        html = render_template(template_name, **context)
+        page = (html, hashlib.sha1(html.encode("utf-8")).hexdigest())
+        if cached:
+            _page_cache[template_name] = page
+
+    response = make_response(page[0])
+    response.set_etag(page[1])
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.before_request
+def start_request() -> None:
+    """
+    Starts timing the request and, for the sampled requests, profiling it (see metrics.start_profile).
+    """
+    g.request_start = time.perf_counter()
+    g.profiler = metrics.start_profile()
+
+
+@app.after_request
+def finish_request(response) -> Response:
+    """
+    Records the request latency by endpoint and status code, and dumps the profile of the sampled requests.
+
+    :param response: (Response)The response.
+    :return: (Response)The same response.
+    """
+    endpoint = request.endpoint or "unknown"
+    if g.get("profiler") is not None:
+        metrics.stop_profile(g.profiler, endpoint)
+    if "request_start" in g:
+        metrics.observe("request_seconds", time.perf_counter() - g.request_start, endpoint=endpoint)
+    metrics.inc("requests_total", endpoint=endpoint, status=response.status_code)
+    return response
 
 
 @app.route('/', methods=["POST", "GET"])
@@ -35,7 +219,7 @@ def home() -> Response | str:
         if "message" in session:
             message = session["message"]
             session.pop("message", None)
-        return render_template("index.html", message=message)
+        return render_page("index.html", cached=message == "None", message=message)
 
 
 @app.route("/form_page1", methods=["POST", "GET"])
@@ -56,6 +240,7 @@ def form_page1() -> Response | str:
         form_data = request.form
         serialized_form_data = json.dumps(form_data)
         session["form1_data"] = serialized_form_data
+        session.pop("submission_saved", None)
 
         return redirect(url_for('form_page2'))
 
@@ -69,9 +254,9 @@ def form_page1() -> Response | str:
 
         if serialized_form_data is not None:
             form_data = json.loads(serialized_form_data)
-            return render_template("Form1.html", form_data=form_data)
+            return render_page("Form1.html", form_data=form_data)
         else:
-            return render_template("Form1.html", form_data="")
+            return render_page("Form1.html", cached=True, form_data="")
 
 
 @app.route("/form_page2", methods=["POST", "GET"])
@@ -91,6 +276,7 @@ def form_page2() -> Response | str:
         form_data = request.form
         serialized_form_data = json.dumps(form_data)
         session["form2_data"] = serialized_form_data
+        session.pop("submission_saved", None)
 
         return redirect(url_for('results'))
 
@@ -100,9 +286,9 @@ def form_page2() -> Response | str:
 
         if serialized_form_data is not None:
             form_data = json.loads(serialized_form_data)
-            return render_template("Form2.html", form_data=form_data)
+            return render_page("Form2.html", form_data=form_data)
         else:
-            return render_template("Form2.html", form_data="")
+            return render_page("Form2.html", cached=True, form_data="")
 
 
 def home_redirection_error(message) -> Response:
@@ -117,6 +303,191 @@ def home_redirection_error(message) -> Response:
     return redirect(url_for('home'))
 
 
+def results_payload(storage) -> dict:
+    """
+    Builds the prediction payload of the results page from the session storage: the lavoro dwelling ID, or the data
+    of both forms. If only one of the forms is stored, it is dropped.
+
+    :param storage: (dict)The session storage.
+    :return: (dict)The prediction payload (see prediction.build_record).
+    :raises prediction.PredictionError: If the required information is missing.
+    """
+    # When lavoro API is called.
+    if "ID" in storage:
+        return {"id": storage["ID"]}
+
+    # If both of the forms are stored into the session storage, then it redirects to results page.
+    if "form1_data" in storage and "form2_data" in storage:
+        return {"form1": json.loads(storage["form1_data"]), "form2": json.loads(storage["form2_data"])}
+
+    storage.pop("form1_data", None)
+    storage.pop("form2_data", None)
+    raise prediction.PredictionError("Please, fill the required fields again")
+
+
+def unsaved_submission(storage, payload) -> bool:
+    """
+    The record of every forms submission is saved to the 'New_entries' database collection once, by the first results
+    page that is not answered with '304 Not Modified', so that revisits do not feed duplicates into the promotion of
+    the new entries. The lavoro dwellings are never saved.
+
+    :param storage: (dict)The session storage.
+    :param payload: (dict)The prediction payload of the results page (see results_payload).
+    :return: (bool)Whether the payload is a forms submission that has not been saved yet.
+    """
+    return "id" not in payload and not storage.get("submission_saved")
+
+
+def results_etag(db, record) -> str | None:
+    """
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param record: (dict)The record to be classified.
+    :return: (str | None)An entity tag of the results page that changes with the versions of the reference sets, the
+    record, the chart rendering and the static assets build, or None if the record has no valid heating source.
+    """
+    heating_source = record.get("Heating Source")
+    if heating_source not in Clusters._PARTITIONS:
+        return None
+    versions = [reference_cache.get_reference_set(db, source).version for source in (heating_source, None)]
+    state = json.dumps([versions, record, app.config["CHART_RENDERING"], app.config["STATIC_BUILD_ID"]],
+                       sort_keys=True, default=str)
+    return hashlib.sha1(state.encode("utf-8")).hexdigest()
+
+
+def generate_plots(data_frame, prediction, actual_value, record):
+    """
+    Prepares the results page charts based on the CHART_RENDERING setting.
+
+    :param data_frame: (pandas.DataFrame)All the records from the 'Active_data' database collection.
+    :param prediction: (float)The predicted energy consumption value of the given record.
+    :param actual_value: (float)The actual energy consumption value of the given record.
+    :param record: (dict)The user input.
+    :return: (Plot_generator.PlotGenerator | Plot_generator.ChartData)The server-rendered plots or the chart data.
+    """
+    if app.config["CHART_RENDERING"] == "server":
+        return Plot_generator.PlotGenerator(data_frame, prediction, actual_value, record)
+    return Plot_generator.ChartData(data_frame, prediction, actual_value, record)
+
+
+@app.route("/api/charts", methods=["GET"])
+def chart_data() -> Response:
+    """
+    Creates an API endpoint that returns the data of the results page charts as JSON: the histogram bin edges and
+    counts and the KDE sample points of the dwellings of the same type, the highlighted bins, and the mean consumption
+    per dwelling type.
+    The responses are cacheable and carry an ETag derived from the dataset version and the highlighting state, so
+    repeated requests are answered with '304 Not Modified'.
+
+    Query arguments: 'grade' (the Dwelling Grade), 'prediction' and 'actual' (the consumption values).
+
+    :return: (Response)The JSON chart data.
+    """
+    try:
+        grade = float(request.args["grade"])
+        prediction = float(request.args["prediction"])
+        actual = float(request.args["actual"])
+        if grade not in Plot_generator._dwellings:
+            raise ValueError(grade)
+    except (KeyError, ValueError):
+        return jsonify(error="The 'grade', 'prediction' and 'actual' arguments are required."), 400
+
+    data_frame = reference_cache.get_reference_set(database.get_database()).data_frame
+    charts = Plot_generator.ChartData(data_frame, prediction, actual, {"Dwelling Grade": grade})
+
+    response = jsonify(charts.to_json())
+    response.set_etag(charts.etag())
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config["CHART_MAX_AGE"]
+    return response.make_conditional(request)
+
+
+def prediction_json(result) -> dict:
+    """
+    :param result: (dict)The result of prediction.run_prediction.
+    :return: (dict)The predicted and actual consumption, the cluster label, the heating source, whether the actual
+    consumption is more than 10% above the prediction, and the chart data of the results page.
+    """
+    charts = Plot_generator.ChartData(result["data_frame"], result["prediction"], result["actual"], result["record"])
+    return {"prediction": result["prediction"], "actual": result["actual"], "label": result["label"],
+            "heating_source": result["heating_source"],
+            "high_consumption": result["actual"] > result["prediction"] + (result["prediction"] * 10) / 100,
+            "charts": charts.to_json()}
+
+
+@app.route("/api/predict", methods=["POST"])
+def predict() -> Response:
+    """
+    Creates a stateless API endpoint that runs the whole prediction pipeline in a single round trip. Nothing is written
+    to the database, so API clients and load tests do not add records to the 'New_entries' collection.
+    The JSON body contains either a lavoro dwelling 'id', or the data of both HTML forms, nested under 'form1' and
+    'form2' or combined in a single object. The response contains the predicted and actual consumption, the cluster
+    label and the chart data of the results page.
+
+    :return: (Response)The JSON prediction, or a JSON error with a 4xx/5xx status code.
+    """
+    payload = request.get_json(silent=True)
+    try:
+        result = prediction.run_prediction(database.get_database(), payload)
+        reply = prediction_json(result)
+    except prediction.PredictionError as error:
+        metrics.inc("prediction_errors_total", endpoint="predict", error="PredictionError", status=error.status)
+        return jsonify(error=error.message), error.status
+    except Exception as error:
+        metrics.inc("prediction_errors_total", endpoint="predict", error=type(error).__name__, status=500)
+        app.logger.exception("The prediction of the JSON API failed.")
+        return jsonify(error="An error occurred during the calculations, please try again later."), 500
+
+    return jsonify(reply)
+
+
+@app.route("/api/predict/cache", methods=["GET"])
+def prediction_cache() -> Response:
+    """
+    Creates an API endpoint that reports the hit rate and the memory footprint of the prediction table and memo of
+    the current worker (see prediction_table.stats).
+
+    :return: (Response)The JSON statistics.
+    """
+    return jsonify(prediction_table.stats())
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint() -> Response:
+    """
+    Creates an API endpoint that exposes the metrics of the current worker in the Prometheus text format: the latency
+    histograms of the requests and of the prediction stages, the cache and error counters, the reference set sizes
+    and the resident memory (see metrics.render).
+
+    :return: (Response)The metrics.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/predict/batch", methods=["POST"])
+def predict_batch() -> Response:
+    """
+    Creates an API endpoint that scores many dwellings at once. The request body is streamed as CSV ('text/csv') or
+    JSON Lines (any other content type), and the predictions are streamed back in the same format, chunk by chunk, so
+    the memory stays bounded regardless of the input size (see batch_scoring). JSON Lines responses end with a
+    summary line that reports the throughput.
+
+    :return: (Response)The streamed predictions.
+    """
+    file_format = "csv" if request.mimetype == "text/csv" else "jsonl"
+    stream = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+    summary = {}
+
+    def generate():
+        records = batch_scoring.read_records(stream, file_format)
+        yield from batch_scoring.write_results(batch_scoring.score(database.get_database(), records, report=summary),
+                                               file_format)
+        if file_format == "jsonl":
+            yield json.dumps({"summary": summary}) + "\n"
+
+    mimetype = "text/csv" if file_format == "csv" else "application/x-ndjson"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
 @app.route("/results", methods=["GET"])
 def results() -> Response | str:
     """
@@ -125,53 +496,50 @@ def results() -> Response | str:
     messages to the user based on their consumption.
     It supports the GET method that either redirects to the home page and displays a message on the screen if there is
     missing information, or returns a rendering of the results.html template file when the user gets redirected to it.
+    The page carries an ETag of the dataset version and the input record (see results_etag), so that revisits with the
+    same data are answered with '304 Not Modified' before the prediction and the plots are computed.
 
     :return: (Response | str)The rendered HTML file or a Response for redirection to the home.html page.
     """
     if request.method == "GET":
 
-        # When lavoro API is called.
-        if "ID" in session:
-            db = database.get_database()
-
-            api_reply, consumption = lavoro_api_calls.get_element(session["ID"])
-            if api_reply is None and consumption is None:
-                return home_redirection_error("Wrong ID, please enter a valid one.")
-
-            try:
-                record = data_manipulation.transform_data_API(api_reply, consumption)
-
-                prediction, data_frame = Clusters.apply_algorithm(db, record)
-
-                plots = Plot_generator.PlotGenerator(data_frame, prediction, consumption, record)
-            except (BaseException,):
-                return home_redirection_error("An error occurred during the calculations, please try again later.")
-            else:
-                return render_template("results.html", pred=prediction, actual=consumption, plots=plots)
-
-        # If both of the forms are stored into the session storage, then it redirects to results page.
-        if not ("form1_data" in session):
-            if not ("form2_data" in session):
-                return home_redirection_error("Please, fill the required fields again")
-            else:
-                session.pop("form2_data", None)
-                return home_redirection_error("Please, fill the required fields again")
-
-        elif "form2_data" in session:
+        try:
+            payload = results_payload(session)
+        except prediction.PredictionError as error:
+            return home_redirection_error(error.message)
 
+        try:
             db = database.get_database()
-
-            record = database.save_data(db, json.loads(session["form1_data"]), json.loads(session["form2_data"]))
-            prediction, data_frame = Clusters.apply_algorithm(db, record)
-            actual_value = record["Kwh/day/m2"]
-
-            plots = Plot_generator.PlotGenerator(data_frame, prediction, actual_value, record)
-
-            return render_template("results.html", pred=prediction, actual=actual_value, plots=plots)
+            record, _ = prediction.build_record(payload)
+            etag = results_etag(db, record)
+            if etag is not None and etag in request.if_none_match:
+                response = make_response("", 304)
+                response.set_etag(etag)
+                return response
+            if unsaved_submission(session, payload):
+                database.save_data_record(db, record)
+                session["submission_saved"] = True
+            result = prediction.predict_record(db, record)
+            plots = generate_plots(result["data_frame"], result["prediction"], result["actual"], result["record"])
+        except prediction.PredictionError as error:
+            metrics.inc("prediction_errors_total", endpoint="results", error="PredictionError", status=error.status)
+            return home_redirection_error(error.message)
+        except Exception as error:
+            metrics.inc("prediction_errors_total", endpoint="results", error=type(error).__name__, status=500)
+            app.logger.exception("The prediction of the results page failed.")
+            return home_redirection_error("An error occurred during the calculations, please try again later.")
         else:
-            session.pop("form1_data", None)
-            return home_redirection_error("Please, fill the required fields again")
+            response = make_response(render_template("results.html", pred=result["prediction"],
+                                                     actual=result["actual"], plots=plots))
+            if etag is not None:
+                response.set_etag(etag)
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+            return response
 
 
 if __name__ == "__main__":
+    # The reloader serves from a child process, which runs this module again.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_promotion()
     app.run(debug=True)
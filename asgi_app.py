@@ -0,0 +1,237 @@
+"""
+The asynchronous serving mode of the application. The prediction pipeline ('/results' and '/api/predict') runs on an
+event loop: the lavoro calls, the dataset version checks and the reference set reloads are awaited, and the CPU-bound
+steps (the neighbor search and the chart preparation) run on a bounded thread pool, so a single worker keeps serving
+requests while others wait on I/O. Every other route is served by the Flask application of app.py.
+
+It requires the optional 'quart', 'asgiref', 'httpx' and 'motor' packages. Run from the repository root with an ASGI
+server, e.g.:
+    uvicorn asgi_app:application --workers 4
+    hypercorn asgi_app:application --workers 4
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.wsgi import WsgiToAsgi
+from pymongo.errors import PyMongoError
+from quart import Quart, redirect, url_for, render_template, request, session, jsonify, g, make_response
+
+import app as wsgi
+import Clusters
+import database
+import lavoro_api_calls
+import metrics
+import prediction
+import reference_cache
+import static_assets
+
+"""
+The number of threads that run the CPU-bound steps of every worker, and how often (in seconds) the dataset versions
+are polled.
+"""
+_CPU_WORKERS = int(os.environ.get("ASYNC_CPU_WORKERS", os.cpu_count() or 1))
+_VERSION_POLL_INTERVAL = float(os.environ.get("ASYNC_VERSION_POLL_INTERVAL",
+                                              reference_cache._VERSION_CHECK_INTERVAL / 2))
+
+"""
+The paths served by the asynchronous application, and whether the database has an asynchronous driver (the
+in-process fake has none, so its queries run on the thread pool).
+"""
+_ASYNC_PATHS = {"/results", "/api/predict"}
+_ASYNC_DRIVER = not database._CONNECTION_STRING.startswith("mongomock://")
+
+async_app = Quart(__name__, static_folder=wsgi.app.static_folder, template_folder=wsgi.app.template_folder)
+# The session cookies are signed with the same key, so they are shared with the Flask routes.
+async_app.secret_key = wsgi.app.secret_key
+async_app.permanent_session_lifetime = wsgi.app.permanent_session_lifetime
+# Links the fingerprinted static assets, as the Flask templates do (see static_assets).
+async_app.url_defaults(static_assets.fingerprint)
+
+# Registers the remaining Flask routes without views, so that url_for builds their URLs in the templates.
+for rule in wsgi.app.url_map.iter_rules():
+    if rule.rule not in _ASYNC_PATHS and rule.endpoint != "static":
+        async_app.add_url_rule(rule.rule, endpoint=rule.endpoint, methods=rule.methods)
+
+_cpu_pool = ThreadPoolExecutor(max_workers=_CPU_WORKERS, thread_name_prefix="cpu")
+_background = {}
+
+
+async def run_cpu(function, *args):
+    """
+    Runs a CPU-bound function on the bounded thread pool.
+
+    :param function: (callable)The function.
+    :param args: The function arguments.
+    :return: The function result.
+    """
+    return await asyncio.get_running_loop().run_in_executor(_cpu_pool, function, *args)
+
+
+async def poll_versions() -> None:
+    """
+    Refreshes the cached reference sets from the dataset versions every _VERSION_POLL_INTERVAL seconds, through the
+    asynchronous database driver (see reference_cache.refresh_versions).
+    """
+    async_db = database.get_async_database()
+    while True:
+        try:
+            await reference_cache.refresh_versions(async_db)
+        except PyMongoError:
+            pass
+        await asyncio.sleep(_VERSION_POLL_INTERVAL)
+
+
+async def load_reference_sets(record) -> None:
+    """
+    Loads the reference sets a record is classified and charted against (its heating source partition and the whole
+    collection) through the asynchronous driver, so that the CPU-bound steps find them cached.
+
+    :param record: (dict)The record to be classified.
+    """
+    if not _ASYNC_DRIVER or record.get("Heating Source") not in Clusters._PARTITIONS:
+        return
+    async_db = database.get_async_database()
+    for heating_source in (record["Heating Source"], None):
+        await reference_cache.get_reference_set_async(async_db, heating_source)
+
+
+async def predict(payload, db) -> dict:
+    """
+    Runs the whole prediction pipeline for a payload, awaiting the I/O and offloading the classification.
+
+    :param payload: (dict)The prediction payload (see prediction.build_record).
+    :param db: (pymongo.database)The MongoDB database connection.
+    :return: (dict)The result of prediction.predict_record.
+    """
+    record, _ = await prediction.build_record_async(payload)
+    await load_reference_sets(record)
+    return await run_cpu(prediction.predict_record, db, record)
+
+
+@async_app.before_serving
+async def startup() -> None:
+    wsgi.start_promotion()
+    if _ASYNC_DRIVER:
+        _background["versions"] = asyncio.get_running_loop().create_task(poll_versions())
+
+
+@async_app.after_serving
+async def shutdown() -> None:
+    task = _background.pop("versions", None)
+    if task is not None:
+        task.cancel()
+    await lavoro_api_calls.close_async_client()
+    database.close_async_client()
+
+
+@async_app.before_request
+async def start_request() -> None:
+    g.request_start = time.perf_counter()
+
+
+@async_app.after_request
+async def finish_request(response):
+    """
+    Records the request latency by endpoint and status code, as app.finish_request. The cProfile hook is not applied,
+    since the requests of the event loop interleave.
+
+    :param response: (Response)The response.
+    :return: (Response)The same response.
+    """
+    endpoint = request.endpoint or "unknown"
+    metrics.observe("request_seconds", time.perf_counter() - g.request_start, endpoint=endpoint)
+    metrics.inc("requests_total", endpoint=endpoint, status=response.status_code)
+    return response
+
+
+def home_redirection_error(message):
+    """
+    Stores a message into the session storage and redirects to the home page, as app.home_redirection_error.
+
+    :param message: (str) The notification message.
+    :return: (Response) A Response for redirection to the home.html page.
+    """
+    session["message"] = message
+    return redirect(url_for('home'))
+
+
+@async_app.route("/results", methods=["GET"])
+async def results():
+    """
+    The asynchronous version of app.results.
+
+    :return: (Response | str)The rendered HTML file or a Response for redirection to the home.html page.
+    """
+    try:
+        payload = wsgi.results_payload(session)
+    except prediction.PredictionError as error:
+        return home_redirection_error(error.message)
+
+    try:
+        db = database.get_database()
+        record, _ = await prediction.build_record_async(payload)
+        await load_reference_sets(record)
+        etag = await run_cpu(wsgi.results_etag, db, record)
+        if etag is not None and etag in request.if_none_match:
+            response = await make_response("", 304)
+            response.set_etag(etag)
+            return response
+        if wsgi.unsaved_submission(session, payload):
+            # A full write-behind queue blocks (see ingestion.enqueue), so the record is queued off the event loop.
+            await asyncio.to_thread(database.save_data_record, db, record)
+            session["submission_saved"] = True
+        result = await run_cpu(prediction.predict_record, db, record)
+        plots = await run_cpu(wsgi.generate_plots, result["data_frame"], result["prediction"], result["actual"],
+                              result["record"])
+    except prediction.PredictionError as error:
+        metrics.inc("prediction_errors_total", endpoint="results", error="PredictionError", status=error.status)
+        return home_redirection_error(error.message)
+    except Exception as error:
+        metrics.inc("prediction_errors_total", endpoint="results", error=type(error).__name__, status=500)
+        async_app.logger.exception("The prediction of the results page failed.")
+        return home_redirection_error("An error occurred during the calculations, please try again later.")
+    else:
+        response = await make_response(await render_template("results.html", pred=result["prediction"],
+                                                             actual=result["actual"], plots=plots))
+        if etag is not None:
+            response.set_etag(etag)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+        return response
+
+
+@async_app.route("/api/predict", methods=["POST"])
+async def predict_json():
+    """
+    The asynchronous version of app.predict.
+
+    :return: (Response)The JSON prediction, or a JSON error with a 4xx/5xx status code.
+    """
+    payload = await request.get_json(silent=True)
+    try:
+        result = await predict(payload, database.get_database())
+        reply = await run_cpu(wsgi.prediction_json, result)
+    except prediction.PredictionError as error:
+        metrics.inc("prediction_errors_total", endpoint="predict", error="PredictionError", status=error.status)
+        return jsonify(error=error.message), error.status
+    except Exception as error:
+        metrics.inc("prediction_errors_total", endpoint="predict", error=type(error).__name__, status=500)
+        async_app.logger.exception("The prediction of the JSON API failed.")
+        return jsonify(error="An error occurred during the calculations, please try again later."), 500
+
+    return jsonify(reply)
+
+
+_wsgi_application = WsgiToAsgi(wsgi.app)
+
+
+async def application(scope, receive, send) -> None:
+    """
+    The ASGI entry point: the prediction pipeline and the lifespan events go to the asynchronous application, and
+    every other request to the Flask application.
+    """
+    if scope["type"] == "lifespan" or (scope["type"] == "http" and scope["path"] in _ASYNC_PATHS):
+        await async_app(scope, receive, send)
+    else:
+        await _wsgi_application(scope, receive, send)
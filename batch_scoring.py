@@ -0,0 +1,237 @@
+"""
+Scores large sets of dwellings in bulk. The records follow the schema built by data_manipulation.transform_data
+(the _COLUMNS attributes and the 'Heating Source'), optionally with an 'id' and the actual 'Kwh/day/m2', and are read
+from CSV or JSON Lines.
+
+Run from the repository root:
+    python batch_scoring.py dwellings.csv -o predictions.jsonl
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import time
+from itertools import islice
+import numpy as np
+import Clusters
+import data_manipulation
+import database
+import Knn
+import reference_cache
+
+"""
+The number of records encoded and searched at once.
+"""
+_CHUNK_SIZE = int(os.environ.get("BATCH_CHUNK_SIZE", 2000))
+
+_OUTPUT_FIELDS = ["id", "Heating Source", "label", "prediction", "Kwh/day/m2", "error"]
+# The key of the parsing error of an input record that could not be read (see read_records).
+_READ_ERROR = "_read_error"
+
+_logger = logging.getLogger(__name__)
+
+
+def _csv_rows(stream) -> iter:
+    """
+    :param stream: (io.TextIOBase)The input stream.
+    :return: (iter)The rows of the CSV, with a _READ_ERROR record in place of every malformed one.
+    """
+    rows = csv.DictReader(stream)
+    while True:
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        except csv.Error as error:
+            row = {_READ_ERROR: f"Invalid CSV row: {error}"}
+        yield row
+
+
+def _jsonl_rows(stream) -> iter:
+    """
+    :param stream: (io.TextIOBase)The input stream.
+    :return: (iter)The objects of the JSON Lines, with a _READ_ERROR record in place of every malformed line.
+    """
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            row = {_READ_ERROR: f"Invalid JSON line: {error}"}
+        if not isinstance(row, dict):
+            row = {_READ_ERROR: "Invalid JSON line: a record should be a JSON object"}
+        yield row
+
+
+def read_records(stream, file_format) -> iter:
+    """
+    Parses the records of a text stream one at a time, casting the numerical attributes to float. A line or row that
+    cannot be parsed does not stop the stream: it is read as a record with the parsing error, which is reported in its
+    result (see score_chunk).
+
+    :param stream: (io.TextIOBase)The input stream.
+    :param file_format: (str)The input format, "csv" or "jsonl".
+    :return: (iter)The records.
+    """
+    if file_format == "csv":
+        rows = _csv_rows(stream)
+    elif file_format == "jsonl":
+        rows = _jsonl_rows(stream)
+    else:
+        raise ValueError("Format should be: {csv/jsonl}")
+
+    for row in rows:
+        try:
+            for attribute in data_manipulation._NUMERICAL_LABELS + ["Kwh/day/m2"]:
+                if row.get(attribute) not in (None, ""):
+                    row[attribute] = float(row[attribute])
+        except (TypeError, ValueError) as error:
+            row = {"id": row.get("id"), _READ_ERROR: f"Invalid record: {error}"}
+        yield row
+
+
+def score_chunk(db, records, engine=None) -> list:
+    """
+    Scores a chunk of records: the records of each heating source partition are encoded into a single matrix and
+    searched with one batched neighbor query.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param records: (list)The records.
+    :param engine: (str)The search engine type, see Knn.make_engine (e.g. "sharded" to spread the search over every
+    core). Defaults to the KNN_ENGINE setting.
+    :return: (list)A result per record, in the input order.
+    """
+    results = [{"id": record.get("id"), "Heating Source": record.get("Heating Source"),
+                "Kwh/day/m2": record.get("Kwh/day/m2")} for record in records]
+    for result, record in zip(results, records):
+        if _READ_ERROR in record:
+            result["error"] = record[_READ_ERROR]
+
+    for heating_source, partition in Clusters._PARTITIONS.items():
+        rows = [i for i, record in enumerate(records)
+                if record.get("Heating Source") == heating_source and _READ_ERROR not in record]
+        if not rows:
+            continue
+
+        reference = reference_cache.get_reference_set(db, heating_source)
+        encoder = reference_cache.get_feature_encoder(db, reference)
+        try:
+            matrix = encoder.encode_batch([records[i] for i in rows])
+        except (KeyError, TypeError, ValueError):
+            # Encodes the records one at a time to isolate the invalid ones.
+            valid, vectors = [], []
+            for i in rows:
+                try:
+                    vectors.append(encoder.encode(records[i]))
+                    valid.append(i)
+                except (KeyError, TypeError, ValueError) as error:
+                    results[i]["error"] = f"Invalid record: {error}"
+            rows = valid
+            if not rows:
+                continue
+            matrix = np.vstack(vectors)
+
+        search = reference.search_engine(partition["metric"], engine)
+        _, labels = search.query_batch(matrix, Clusters._NUMBER_OF_NEIGHBORS)
+        for i, neighbor_labels in zip(rows, labels):
+            label = Knn.vote(neighbor_labels)
+            results[i]["label"] = int(label)
+            results[i]["prediction"] = reference.stats.mean(label)
+
+    for result in results:
+        if "label" not in result and "error" not in result:
+            result["error"] = "Heating source should be: {Yes/No}"
+    return results
+
+
+def score(db, records, chunk_size=_CHUNK_SIZE, report=None, engine=None) -> iter:
+    """
+    Scores a stream of records chunk by chunk, so that the memory stays bounded regardless of the input size.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param records: (iter)The records.
+    :param chunk_size: (int)The number of records per chunk.
+    :param report: (dict)Filled with the number of records, the elapsed seconds and the records/sec when the stream
+    is exhausted.
+    :param engine: (str)The search engine type, see score_chunk.
+    :return: (iter)A result per record, in the input order.
+    """
+    records = iter(records)
+    start = time.perf_counter()
+    total = 0
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            break
+        yield from score_chunk(db, chunk, engine)
+        total += len(chunk)
+
+    elapsed = time.perf_counter() - start
+    summary = {"records": total, "seconds": elapsed, "records_per_sec": total / elapsed if elapsed else 0.0}
+    _logger.info("Scored %(records)d records in %(seconds).2fs (%(records_per_sec).0f records/sec)", summary)
+    if report is not None:
+        report.update(summary)
+
+
+def write_results(results, file_format) -> iter:
+    """
+    Serializes the results one line at a time.
+
+    :param results: (iter)The results.
+    :param file_format: (str)The output format, "csv" or "jsonl".
+    :return: (iter)The lines of the output.
+    """
+    if file_format == "jsonl":
+        for result in results:
+            yield json.dumps(result) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=_OUTPUT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for result in results:
+        writer.writerow(result)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _format_of(path, default="jsonl") -> str:
+    """
+    :param path: (str)A file path.
+    :param default: (str)The format of paths without a known extension (e.g. "-" for the standard streams).
+    :return: (str)The file format, "csv" or "jsonl".
+    """
+    extension = os.path.splitext(path)[1].lower()
+    return {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}.get(extension, default)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="A .csv or .jsonl file, or - for the standard input.")
+    parser.add_argument("-o", "--output", default="-", help="A .csv or .jsonl file, or - for the standard output.")
+    parser.add_argument("--input-format", choices=["csv", "jsonl"])
+    parser.add_argument("--output-format", choices=["csv", "jsonl"])
+    parser.add_argument("--chunk-size", type=int, default=_CHUNK_SIZE)
+    parser.add_argument("--engine", choices=["brute", "sharded", "kd_tree", "ball_tree", "ivf"],
+                        help="The search engine, KNN_ENGINE by default. 'sharded' uses PARALLEL_WORKERS processes.")
+    args = parser.parse_args()
+
+    input_format = args.input_format or _format_of(args.input)
+    output_format = args.output_format or _format_of(args.output)
+    source = sys.stdin if args.input == "-" else open(args.input, newline="", encoding="utf-8")
+    target = sys.stdout if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+
+    summary = {}
+    with source, target:
+        results = score(database.get_database(), read_records(source, input_format), args.chunk_size, summary,
+                        args.engine)
+        for line in write_results(results, output_format):
+            target.write(line)
+
+    print(f"Scored {summary['records']} records in {summary['seconds']:.2f}s "
+          f"({summary['records_per_sec']:.0f} records/sec)", file=sys.stderr)
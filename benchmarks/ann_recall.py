@@ -0,0 +1,111 @@
+"""
+Validates the approximate "ivf" engine (see Knn.IVFSearch) against the exact 1-Nearest-Neighbors search over the
+reference sets of both heating source partitions: for every number of scanned lists, the recall@1 (the share of
+queries whose approximate nearest neighbor is at the exact nearest distance), the agreement with the exact labels of
+Clusters.classify, and the query latency of both searches.
+
+Run from the repository root, on a synthetic dataset of the given size:
+    python -m benchmarks.ann_recall --rows 1000000 --probes 1 4 8 16 32
+"""
+import argparse
+import time
+import numpy as np
+import Clusters
+import database
+import Knn
+import prediction
+import reference_cache
+from benchmarks import synthetic_data
+
+
+def _latency(samples) -> dict:
+    """
+    :param samples: (list)The durations in seconds.
+    :return: (dict)The number of queries and the mean, median, 95th and 99th percentile duration in milliseconds.
+    """
+    samples = np.asarray(samples) * 1000
+    return {"runs": len(samples), "mean_ms": float(np.mean(samples)), "p50_ms": float(np.percentile(samples, 50)),
+            "p95_ms": float(np.percentile(samples, 95)), "p99_ms": float(np.percentile(samples, 99))}
+
+
+def evaluate(reference, vectors, metric, probes, n_lists=None) -> list:
+    """
+    :param reference: (reference_cache.ReferenceSet)The reference set.
+    :param vectors: (list)The encoded query records.
+    :param metric: (str)The distance metric, "euclidean" or "l1".
+    :param probes: (list)The numbers of scanned lists.
+    :param n_lists: (int)The number of inverted lists, see Knn.IVFSearch.
+    :return: (list)A result per number of scanned lists, preceded by the exact search.
+    """
+    exact = reference.search_engine(metric, "brute")
+    exact_dist, exact_labels, samples = [], [], []
+    for vector in vectors:
+        start = time.perf_counter()
+        label, _ = Clusters.classify(reference, vector, "exact", metric)
+        samples.append(time.perf_counter() - start)
+        dist, _ = exact.query(vector, 1)
+        exact_dist.append(dist[0] if len(dist) else np.inf)
+        exact_labels.append(label)
+    results = [dict(_latency(samples), engine="brute", probes=None, recall_at_1=1.0, agreement=1.0, build_ms=0.0)]
+
+    start = time.perf_counter()
+    engine = Knn.IVFSearch(reference.features, reference.labels, metric, n_lists)
+    build = (time.perf_counter() - start) * 1000
+    for n_probes in probes:
+        engine.n_probes = n_probes
+        hits = agreements = 0
+        samples = []
+        for vector, true_dist, true_label in zip(vectors, exact_dist, exact_labels):
+            start = time.perf_counter()
+            dist, labels = engine.query(vector, 1)
+            samples.append(time.perf_counter() - start)
+            hits += int(len(dist) > 0 and np.isclose(dist[0], true_dist))
+            agreements += int(len(labels) > 0 and labels[0] == true_label)
+        results.append(dict(_latency(samples), engine="ivf", lists=engine.n_lists, probes=n_probes,
+                            recall_at_1=hits / len(vectors), agreement=agreements / len(vectors), build_ms=build))
+    return results
+
+
+def run(db, queries=200, probes=(1, 4, 8, 16, 32), seed=0, n_lists=None) -> list:
+    """
+    Evaluates the approximate search on the reference sets of both heating source partitions.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param queries: (int)The number of query records.
+    :param probes: (list)The numbers of scanned lists.
+    :param seed: (int)The random seed of the query records.
+    :param n_lists: (int)The number of inverted lists, see Knn.IVFSearch.
+    :return: (list)The results of evaluate, with the heating source partition and the reference set size.
+    """
+    records = [prediction.form_record(payload) for payload in synthetic_data.form_payloads(queries, seed)]
+    results = []
+    for heating_source, partition in Clusters._PARTITIONS.items():
+        reference = reference_cache.get_reference_set(db, heating_source)
+        encoder = reference_cache.get_feature_encoder(db, reference)
+        vectors = [encoder.encode(record) for record in records]
+        for result in evaluate(reference, vectors, partition["metric"], probes, n_lists):
+            result.update({"heating_source": heating_source, "rows": len(reference)})
+            results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, help="Generates a synthetic collection of this size first.")
+    parser.add_argument("--mongo-uri", default="mongomock://")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--lists", type=int, help="The number of inverted lists (default: square root of the rows).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    database.set_client(database._create_client(args.mongo_uri))
+    db = database.get_database()
+    if args.rows is not None:
+        synthetic_data.populate(db, args.rows, args.seed)
+
+    print(f"{'source':>6} {'rows':>9} {'engine':>6} {'probes':>6} {'recall@1':>9} {'agreement':>9} "
+          f"{'p50 ms':>8} {'p99 ms':>8}")
+    for row in run(db, args.queries, args.probes, args.seed + 1, args.lists):
+        print(f"{row['heating_source']:>6} {row['rows']:>9} {row['engine']:>6} {row['probes'] or '-':>6} "
+              f"{row['recall_at_1']:9.2%} {row['agreement']:9.2%} {row['p50_ms']:8.3f} {row['p99_ms']:8.3f}")
@@ -0,0 +1,21 @@
+"""
+Reports how often the "centroid", "hybrid" and "approximate" classification modes agree with the exact
+1-Nearest-Neighbors mode, by replaying the records of the 'New_entries' database collection.
+
+Run from the repository root:
+    python -m benchmarks.centroid_agreement --limit 1000
+"""
+import argparse
+import Clusters
+import database
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limit", type=int, default=1000)
+    args = parser.parse_args()
+
+    db = database.get_database()
+    for mode in ("centroid", "hybrid", "approximate"):
+        report = Clusters.agreement_rate(db, mode, args.limit)
+        print(f"{mode:>11}: {report['records']} records, {report['agreement']:.2%} agreement, "
+              f"{report['fallback']:.2%} exact fallbacks")
@@ -0,0 +1,71 @@
+"""
+Compares the neighbour search engines of Knn.py against the original row-by-row heap implementation.
+
+Run from the repository root:
+    python -m benchmarks.knn_benchmark --sizes 1000 100000 1000000
+"""
+import argparse
+import time
+import numpy as np
+import Knn
+
+_FEATURES = 40
+_CLUSTERS = 4
+
+
+def _time_queries(function, queries, repeat) -> float:
+    """
+    :param function: (callable)A function that classifies a single query record.
+    :param queries: (np.ndarray)The query records.
+    :param repeat: (int)The number of queries to be timed.
+    :return: (float)The mean time per query in milliseconds.
+    """
+    start = time.perf_counter()
+    for query in queries[:repeat]:
+        function(query)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def run(sizes, metric="euclidean", repeat=20, legacy_limit=100000, seed=0) -> list:
+    """
+    Times every engine for each reference set size.
+
+    :param sizes: (list)The number of reference rows to be benchmarked.
+    :param metric: (str)The distance metric, "euclidean" or "l1".
+    :param repeat: (int)The number of queries per engine.
+    :param legacy_limit: (int)The largest size the original heap implementation runs on.
+    :param seed: (int)The random seed.
+    :return: (list)A dictionary per size and engine with the build time and mean query time in milliseconds.
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+    for size in sizes:
+        data = rng.random((size, _FEATURES), dtype=np.float32)
+        labels = rng.integers(0, _CLUSTERS, size)
+        queries = rng.random((repeat, _FEATURES), dtype=np.float32)
+
+        if size <= legacy_limit and metric == "euclidean":
+            query_time = _time_queries(lambda q: Knn.heap_Knn(q, 1, data, labels), queries, max(1, repeat // 10))
+            results.append({"rows": size, "engine": "heap", "build_ms": 0.0, "query_ms": query_time})
+
+        for name in ("brute", "kd_tree", "ball_tree"):
+            start = time.perf_counter()
+            engine = Knn.make_engine(data, labels, metric, name)
+            build_time = (time.perf_counter() - start) * 1000
+            query_time = _time_queries(lambda q: Knn.Knn(q, 1, engine=engine), queries, repeat)
+            results.append({"rows": size, "engine": name, "build_ms": build_time, "query_ms": query_time})
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--metric", choices=["euclidean", "l1"], default="euclidean")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--legacy-limit", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'engine':>10} {'build ms':>10} {'query ms':>10}")
+    for row in run(args.sizes, args.metric, args.repeat, args.legacy_limit):
+        print(f"{row['rows']:>9} {row['engine']:>10} {row['build_ms']:>10.1f} {row['query_ms']:>10.3f}")
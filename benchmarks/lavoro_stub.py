@@ -0,0 +1,79 @@
+"""
+A local stub of the lavoro HTTP API, which needs no network access. It is used by the tests of lavoro_api_calls
+(tests/test_lavoro_api_calls.py), and can serve the load tests through LAVORO_URL (see benchmarks.load_test).
+
+Run from the repository root:
+    python -m benchmarks.lavoro_stub --port 8001
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_META = {"Dwelling": "Apartment", "Bedrooms": 2, "built": 1990, "Heating Source": True, "Occupants": 3,
+         "Children": 1, "Teenagers": 0, "Adults": 2, "Elders": 0, "Fulltimers": 2, "Parttimers": 0, "Grads": 1,
+         "PostGrads": 1, "Income": 25000, "Recycling": "Occasionally", "Energy Class": "Frequently",
+         "Thermostats": "Occasionally", "Water Heater": False, "Smart Plugs": "Never or seldom",
+         "Awareness": "Occasionally"}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Replies to '/dev_id/<ID>/meta/' and '/dev_id/<ID>/json/...'. The ID selects the behaviour: "missing" replies 404,
+    "broken" replies 500, "garbage" replies 200 with a body that is not JSON, and "slow" waits for 'delay' seconds;
+    every other ID replies after 'latency' seconds.
+    """
+    latency = 0.2
+    delay = 5.0
+    calls = {"meta": 0, "consumption": 0}
+
+    def do_GET(self) -> None:
+        parts = self.path.strip("/").split("/")
+        ID, kind = parts[1], "meta" if parts[2] == "meta" else "consumption"
+        StubHandler.calls[kind] += 1
+
+        time.sleep(self.delay if ID == "slow" else self.latency)
+        if ID == "missing":
+            self._reply(404, {"detail": "Not found"})
+        elif ID == "broken":
+            self._reply(500, {"detail": "Server error"})
+        elif ID == "garbage":
+            self._reply(200, "<html>Maintenance</html>", encode=False)
+        else:
+            self._reply(200, _META if kind == "meta" else 0.042)
+
+    def _reply(self, status, body, encode=True) -> None:
+        payload = (json.dumps(body) if encode else body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def start_stub(port=0) -> ThreadingHTTPServer:
+    """
+    Starts the stub server in a daemon thread.
+
+    :param port: (int)The port, 0 for a free one.
+    :return: (ThreadingHTTPServer)The running server.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=StubHandler.latency)
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), StubHandler)
+    print(f"Serving the lavoro stub on http://127.0.0.1:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,93 @@
+"""
+A load test of the '/api/predict' endpoint, to compare the synchronous (WSGI) and asynchronous (ASGI, see asgi_app)
+serving modes. It keeps a fixed number of requests in flight and reports the requests/sec and the latency percentiles
+of every server. It only needs the standard library.
+
+Start both servers from the repository root with the same number of workers, e.g.:
+    gunicorn app:app --workers 4 --bind 127.0.0.1:8000
+    uvicorn asgi_app:application --workers 4 --port 8001
+and run:
+    python -m benchmarks.load_test http://127.0.0.1:8000 http://127.0.0.1:8001 --concurrency 64 --requests 2000
+
+Pass '--lavoro-id' to send lavoro dwelling IDs instead of form data, which adds the lavoro calls to every request
+(e.g. against the stub of benchmarks.lavoro_stub, through LAVORO_URL).
+"""
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+_FORM = {"dtype": "Apartment", "age": "16 - 30", "heating": "Yes", "meters": "85", "bedrooms": "2",
+         "occupants": "3", "children": "1", "teens": "0", "adults": "2", "elders": "0", "full": "2", "part": "0",
+         "graduated": "1", "post": "1", "income": "10.001€ - 20.000€", "recycling": "Occasionally",
+         "energy": "Frequently", "thermo": "Occasionally", "water": "Yes", "plugs": "Never or seldom",
+         "awareness": "Occasionally", "kwhs": "350", "start": "2023-01-01", "end": "2023-01-31"}
+
+
+def _request(url, body, timeout) -> tuple:
+    """
+    :param url: (str)The endpoint URL.
+    :param body: (bytes)The JSON body.
+    :param timeout: (float)The request timeout in seconds.
+    :return: (tuple)The latency in seconds and the HTTP status code (0 for connection errors).
+    """
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as reply:
+            reply.read()
+            status = reply.status
+    except urllib.error.HTTPError as error:
+        status = error.code
+    except (urllib.error.URLError, OSError):
+        status = 0
+    return time.perf_counter() - start, status
+
+
+def run(base_url, requests, concurrency, lavoro_id=None, timeout=30.0) -> dict:
+    """
+    Sends the requests to a server, keeping 'concurrency' of them in flight.
+
+    :param base_url: (str)The server URL.
+    :param requests: (int)The number of requests.
+    :param concurrency: (int)The number of concurrent requests.
+    :param lavoro_id: (str)A lavoro dwelling ID, or None to send form data.
+    :param timeout: (float)The request timeout in seconds.
+    :return: (dict)The requests/sec, the latency percentiles in milliseconds and the number of failed requests.
+    """
+    url = base_url.rstrip("/") + "/api/predict"
+    body = json.dumps({"id": lavoro_id} if lavoro_id else _FORM).encode("utf-8")
+
+    # Warms up the reference set and the connection pools of the server.
+    for _ in range(concurrency):
+        _request(url, body, timeout)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        replies = list(pool.map(lambda _: _request(url, body, timeout), range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for latency, _ in replies]) * 1000
+    return {"server": base_url, "requests": requests, "concurrency": concurrency,
+            "requests_per_sec": requests / elapsed,
+            "p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99)),
+            "failed": sum(1 for _, status in replies if status != 200)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("servers", nargs="+", help="The base URLs of the servers to be compared.")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--lavoro-id")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    print(f"{'server':>30} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'failed':>8}")
+    for server in args.servers:
+        result = run(server, args.requests, args.concurrency, args.lavoro_id, args.timeout)
+        print(f"{result['server']:>30} {result['requests_per_sec']:>10.1f} {result['p50_ms']:>10.1f} "
+              f"{result['p99_ms']:>10.1f} {result['failed']:>8}")
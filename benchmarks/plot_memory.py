@@ -0,0 +1,65 @@
+"""
+Memory-growth regression check for Plot_generator: renders the plots many times and fails when the resident memory
+keeps growing, e.g. because figures are not released.
+
+Run from the repository root:
+    python -m benchmarks.plot_memory --renders 10000
+"""
+import argparse
+import resource
+import sys
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import pandas as pd
+import Plot_generator
+
+
+def _rss_mb() -> float:
+    """
+    :return: (float)The peak resident memory of the process in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(renders, rows=5000, cached=True, seed=0) -> dict:
+    """
+    Renders the plots for random predictions and records the memory after a warm-up and at the end.
+
+    :param renders: (int)The number of PlotGenerator instances.
+    :param rows: (int)The number of synthetic 'Active_data' records.
+    :param cached: (bool)Whether the data frame carries a dataset version, which enables the plot cache.
+    :param seed: (int)The random seed.
+    :return: (dict)The memory after the warm-up and at the end in MB.
+    """
+    rng = np.random.default_rng(seed)
+    data_frame = pd.DataFrame({"Dwelling Grade": rng.choice(list(Plot_generator._dwellings), rows),
+                               "Kwh/day/m2": rng.gamma(2.0, 0.05, rows)})
+    if cached:
+        data_frame.attrs["version"] = ("Active_data", 1)
+
+    warm_up = max(1, renders // 10)
+    baseline = None
+    for i in range(renders):
+        grade = float(rng.choice(list(Plot_generator._dwellings)))
+        actual, prediction = rng.gamma(2.0, 0.05, 2)
+        Plot_generator.PlotGenerator(data_frame, prediction, actual, {"Dwelling Grade": grade,
+                                                                      "Kwh/day/m2": actual})
+        if i + 1 == warm_up:
+            baseline = _rss_mb()
+
+    return {"baseline_mb": baseline, "final_mb": _rss_mb()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--renders", type=int, default=10000)
+    parser.add_argument("--uncached", action="store_true", help="Render every plot, bypassing the plot cache.")
+    parser.add_argument("--max-growth-mb", type=float, default=50.0)
+    args = parser.parse_args()
+
+    report = run(args.renders, cached=not args.uncached)
+    growth = report["final_mb"] - report["baseline_mb"]
+    print(f"{args.renders} renders: {report['baseline_mb']:.1f}MB after warm-up, {report['final_mb']:.1f}MB at the end "
+          f"({growth:+.1f}MB)")
+    sys.exit(0 if growth <= args.max_growth_mb else 1)
@@ -0,0 +1,83 @@
+"""
+Compares database.retrieve_data against the original list-of-documents decoding, with and without field projections:
+the transferred BSON bytes, the wall time and the peak traced memory of each variant.
+
+Run from the repository root, against a local 'mongod' (the transfer of the in-process fake is estimated by encoding
+the documents):
+    python -m benchmarks.retrieve_data_benchmark --rows 1000000 --mongo-uri mongodb://localhost:27017
+"""
+import argparse
+import time
+import tracemalloc
+import bson
+import pandas as pd
+from pymongo.collection import Collection
+import database
+import reference_cache
+from benchmarks import synthetic_data
+
+"""
+The variants: the fetched fields, and whether the documents are decoded into a list of dictionaries first.
+"""
+_VARIANTS = [("list of documents (whole documents)", None, True),
+             ("columnar (whole documents)", None, False),
+             ("columnar (reference set, no _id)", {"_id": 0}, False),
+             ("columnar (cluster statistics)", reference_cache._STATS_PROJECTION, False),
+             ("columnar (plots)", {"_id": 0, "Dwelling Grade": 1, "Kwh/day/m2": 1}, False)]
+
+
+def transfer_bytes(collection, projection) -> int:
+    """
+    :param collection: (pymongo.collection.Collection)The collection.
+    :param projection: (dict)The fetched fields, or None for whole documents.
+    :return: (int)The size of the BSON batches the server replies with.
+    """
+    if isinstance(collection, Collection):
+        return sum(len(batch) for batch in collection.find_raw_batches({}, projection))
+    return sum(len(bson.encode(document)) for document in collection.find({}, projection))
+
+
+def run(db, rows=None, seed=0, batch_size=database._BATCH_SIZE) -> list:
+    """
+    Times every variant on the 'Active_data' collection, generating a synthetic one first if 'rows' is given.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param rows: (int)The number of synthetic records, or None to use the existing collection.
+    :param seed: (int)The random seed.
+    :param batch_size: (int)The number of documents per batch.
+    :return: (list)The transferred bytes, the seconds and the peak memory in MB of each variant.
+    """
+    if rows is not None:
+        synthetic_data.populate(db, rows, seed)
+
+    results = []
+    for name, projection, as_list in _VARIANTS:
+        tracemalloc.start()
+        start = time.perf_counter()
+        if as_list:
+            data_frame = pd.DataFrame(list(db["Active_data"].find({}, projection, batch_size=batch_size)))
+        else:
+            data_frame = database.retrieve_data(db, "Active_data", projection=projection, batch_size=batch_size)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+        results.append({"variant": name, "rows": len(data_frame), "columns": len(data_frame.columns),
+                        "transfer_mb": transfer_bytes(db["Active_data"], projection) / 2 ** 20,
+                        "seconds": seconds, "peak_mb": peak})
+        del data_frame
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, help="Generates a synthetic collection of this size first.")
+    parser.add_argument("--mongo-uri", default="mongomock://")
+    parser.add_argument("--batch-size", type=int, default=database._BATCH_SIZE)
+    args = parser.parse_args()
+
+    database.set_client(database._create_client(args.mongo_uri))
+    print(f"{'variant':>38} {'transfer MB':>12} {'seconds':>9} {'peak MB':>9}")
+    for result in run(database.get_database(), args.rows, batch_size=args.batch_size):
+        print(f"{result['variant']:>38} {result['transfer_mb']:12.1f} {result['seconds']:9.2f} "
+              f"{result['peak_mb']:9.1f}")
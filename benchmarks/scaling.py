@@ -0,0 +1,142 @@
+"""
+Measures how the parallel execution layer (see parallel) scales from 1 to N worker processes: the batched sharded
+search (parallel.ShardedSearch.query_batch), the assignment of the records to their representatives of the scalable
+training mode (parallel.nearest) and, against a real MongoDB server, the concurrent retraining of both heating source
+partitions (Clusters.train_partitions; against the in-process fake, the default, the partitions are trained one after
+the other, since the fake is not shared with the worker processes).
+
+Run from the repository root:
+    python -m benchmarks.scaling --rows 1000000 --cores 1 2 4 8
+    python -m benchmarks.scaling --train-rows 200000 --mongo-uri mongodb://localhost:27017
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+import Clusters
+import database
+import parallel
+from benchmarks import synthetic_data
+
+_FEATURES = 40
+_CLUSTERS = 4
+_REPRESENTATIVES = 2000
+
+
+def _best_of(function, repeat) -> float:
+    """
+    :param function: (callable)The timed function.
+    :param repeat: (int)The number of runs.
+    :return: (float)The shortest run in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run(rows, cores, batch=1000, metric="euclidean", repeat=3, seed=0) -> list:
+    """
+    Times the sharded search and the representative assignment with every number of worker processes.
+
+    :param rows: (int)The number of reference rows.
+    :param cores: (list)The numbers of worker processes.
+    :param batch: (int)The number of records per batched query.
+    :param metric: (str)The distance metric, "euclidean" or "l1".
+    :param repeat: (int)The number of runs per measurement, of which the fastest is kept.
+    :param seed: (int)The random seed.
+    :return: (list)A result per workload and number of processes, with the speedup over the first one.
+    """
+    rng = np.random.default_rng(seed)
+    data = rng.random((rows, _FEATURES), dtype=np.float32)
+    labels = rng.integers(0, _CLUSTERS, rows)
+    queries = rng.random((batch, _FEATURES), dtype=np.float32)
+    points = rng.random((_REPRESENTATIVES, _FEATURES))
+
+    # Shards every matrix regardless of its size, so that small runs show the overhead of the pool too.
+    min_rows, parallel._MIN_ROWS = parallel._MIN_ROWS, 0
+    results = []
+    try:
+        for count in cores:
+            engine = parallel.ShardedSearch(data, labels, metric, count)
+            # Starts the worker processes and attaches the matrix before timing.
+            engine.query_batch(queries[:1], 1)
+            search = _best_of(lambda: engine.query_batch(queries, 1), repeat)
+            results.append({"workload": "sharded search", "workers": count, "seconds": search,
+                            "throughput": batch / search})
+            if engine.shared is not None:
+                engine.shared.release()
+
+            assign = _best_of(lambda: parallel.nearest(data, points, "euclidean", count), repeat)
+            results.append({"workload": "representative assignment", "workers": count, "seconds": assign,
+                            "throughput": rows / assign})
+    finally:
+        parallel._MIN_ROWS = min_rows
+    return _with_speedup(results)
+
+
+def run_training(db, rows, cores, seed=0) -> list:
+    """
+    Times the retraining of both heating source partitions with every number of worker processes.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param rows: (int)The number of synthetic 'Active_data' records.
+    :param cores: (list)The numbers of worker processes.
+    :param seed: (int)The random seed.
+    :return: (list)A result per number of processes, with the speedup over the first one.
+    """
+    synthetic_data.populate(db, rows, seed)
+    results = []
+    for count in cores:
+        start = time.perf_counter()
+        Clusters.train_partitions(db, mode="scalable", workers=count, profile_memory=False)
+        seconds = time.perf_counter() - start
+        results.append({"workload": "training", "workers": count, "seconds": seconds, "throughput": rows / seconds})
+    return _with_speedup(results)
+
+
+def _with_speedup(results) -> list:
+    """
+    :param results: (list)The results of every workload, with the baseline number of processes first.
+    :return: (list)The results with the speedup over the baseline of their workload.
+    """
+    baseline = {}
+    for result in results:
+        baseline.setdefault(result["workload"], result["seconds"])
+        result["speedup"] = baseline[result["workload"]] / result["seconds"]
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--cores", type=int, nargs="+",
+                        default=sorted({1, 2, 4, 8, os.cpu_count() or 1} & set(range(1, (os.cpu_count() or 1) + 1))))
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--metric", choices=["euclidean", "l1"], default="euclidean")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--train-rows", type=int, help="Also times the retraining on a synthetic collection.")
+    parser.add_argument("--mongo-uri", default="mongomock://")
+    parser.add_argument("--i-know", action="store_true",
+                        help="Allow a remote server, whose collections are replaced by the synthetic ones.")
+    parser.add_argument("--output", help="A .json file for the results.")
+    args = parser.parse_args()
+    if args.train_rows and not args.i_know and not synthetic_data.is_local(args.mongo_uri):
+        parser.error("the training workload replaces the collections of the database; refusing a remote server "
+                     "without --i-know")
+
+    report = run(args.rows, args.cores, args.batch, args.metric, args.repeat)
+    if args.train_rows:
+        database.set_client(database._create_client(args.mongo_uri), args.mongo_uri)
+        report += run_training(database.get_database(), args.train_rows, args.cores)
+
+    print(f"{'workload':>26} {'workers':>7} {'seconds':>9} {'items/s':>12} {'speedup':>7}")
+    for row in report:
+        print(f"{row['workload']:>26} {row['workers']:>7} {row['seconds']:9.3f} {row['throughput']:12.0f} "
+              f"{row['speedup']:7.2f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as target:
+            json.dump(report, target, indent=2)
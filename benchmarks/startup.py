@@ -0,0 +1,86 @@
+"""
+Measures the startup of the application: the wall time of 'import app' in a fresh interpreter and the cumulative
+import time of every module, as reported by 'python -X importtime', with the heavy modules imported lazily
+(LAZY_IMPORTS=1) and eagerly (LAZY_IMPORTS=0). The import time of the first request is measured too, since lazily
+imported modules are executed on first use.
+
+Run from the repository root:
+    python -m benchmarks.startup --top 15
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+"""
+The statements executed at startup, and on the first prediction (which executes the lazily imported modules).
+"""
+_STARTUP = "import app"
+_FIRST_USE = "import app; app.preload()"
+
+
+def import_times(statement, lazy) -> dict:
+    """
+    Executes a statement in a fresh interpreter with '-X importtime'.
+
+    :param statement: (str)The executed statement.
+    :param lazy: (bool)Whether the heavy modules are imported lazily.
+    :return: (dict)The wall time in milliseconds, and the cumulative import time in milliseconds and the nesting depth
+    of every module.
+    """
+    environment = dict(os.environ, LAZY_IMPORTS="1" if lazy else "0", MPLBACKEND="Agg")
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], capture_output=True, text=True,
+                               env=environment)
+    wall = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+
+    modules = {}
+    for line in completed.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        if cumulative.strip().isdigit():
+            # The nested imports are indented by two spaces per level.
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            modules[name.strip()] = {"cumulative_ms": int(cumulative) / 1000, "depth": depth}
+    return {"wall_ms": wall * 1000, "modules": modules}
+
+
+def summary(times, top=15) -> dict:
+    """
+    :param times: (dict)The output of import_times.
+    :param top: (int)The number of reported modules.
+    :return: (dict)The wall time, the number of imported modules, the total import time and the slowest top-level
+    imports.
+    """
+    slowest = sorted(((name, module["cumulative_ms"]) for name, module in times["modules"].items()
+                      if module["depth"] == 0), key=lambda item: item[1], reverse=True)[:top]
+    return {"wall_ms": times["wall_ms"], "modules": len(times["modules"]),
+            "import_ms": sum(module["cumulative_ms"] for module in times["modules"].values() if module["depth"] == 0),
+            "slowest": [{"module": name, "cumulative_ms": value} for name, value in slowest]}
+
+
+def run(top=15) -> list:
+    """
+    :param top: (int)The number of reported modules per run.
+    :return: (list)A result per import mode, at startup and after the first use.
+    """
+    results = []
+    for lazy in (True, False):
+        for stage, statement in (("startup", _STARTUP), ("first use", _FIRST_USE)):
+            result = summary(import_times(statement, lazy), top)
+            result.update({"mode": "lazy" if lazy else "eager", "stage": stage})
+            results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=15, help="The number of reported modules per run.")
+    args = parser.parse_args()
+    print(json.dumps(run(args.top), indent=2))
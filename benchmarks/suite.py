@@ -0,0 +1,233 @@
+"""
+Times every subsystem of the application on synthetic data (see benchmarks.synthetic_data) and writes the results as
+JSON, so that runs of different versions can be compared: retrieve_data, Knn.Knn, the approximate search (recall@1
+and latency, see benchmarks.ann_recall), Clusters.apply_algorithm, Clusters.train_clustering_algorithm, the
+multi-process scaling (see benchmarks.scaling), Plot_generator.PlotGenerator, the end-to-end '/results' page and the
+startup import times (see benchmarks.startup).
+
+Run from the repository root, against the in-process fake (requires 'mongomock') or a local 'mongod':
+    python -m benchmarks.suite --sizes 1000 10000 --output results.json
+    python -m benchmarks.suite --sizes 1000000 --mongo-uri mongodb://localhost:27017 --compare results.json
+"""
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import time
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import Clusters
+import database
+import Knn
+import Plot_generator
+import prediction
+import prediction_table
+import reference_cache
+import parallel
+from benchmarks import ann_recall, scaling, startup, synthetic_data
+
+_SUBSYSTEMS = ["retrieve_data", "knn", "ann", "apply_algorithm", "train", "parallel", "plots", "results", "startup"]
+
+
+def summary(samples) -> dict:
+    """
+    :param samples: (list)The durations in seconds.
+    :return: (dict)The number of runs and the mean, median, 95th percentile and maximum duration in milliseconds.
+    """
+    samples = np.asarray(samples) * 1000
+    return {"runs": len(samples), "mean_ms": float(np.mean(samples)), "p50_ms": float(np.percentile(samples, 50)),
+            "p95_ms": float(np.percentile(samples, 95)), "max_ms": float(np.max(samples))}
+
+
+def timed(function, items) -> dict:
+    """
+    :param function: (callable)The timed function, called once per item.
+    :param items: (list)The function arguments.
+    :return: (dict)The summary of the durations.
+    """
+    samples = []
+    for item in items:
+        start = time.perf_counter()
+        function(item)
+        samples.append(time.perf_counter() - start)
+    return summary(samples)
+
+
+def run(db, size, queries=50, subsystems=None, seed=0, train_limit=1000000) -> list:
+    """
+    Generates a dataset of the given size and times the selected subsystems on it.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param size: (int)The number of 'Active_data' records.
+    :param queries: (int)The number of timed queries per subsystem.
+    :param subsystems: (list)The subsystems to be timed, all of them by default.
+    :param seed: (int)The random seed.
+    :param train_limit: (int)The largest size the training is timed on.
+    :return: (list)A result per subsystem.
+    """
+    subsystems = subsystems or _SUBSYSTEMS
+    results = []
+
+    def add(subsystem, result) -> None:
+        result.update({"size": size, "subsystem": subsystem})
+        results.append(result)
+        print(f"{size:>9} {subsystem:>28}: {result['mean_ms']:10.2f}ms mean {result['p95_ms']:10.2f}ms p95",
+              file=sys.stderr)
+
+    start = time.perf_counter()
+    synthetic_data.populate(db, size, seed)
+    add("populate", summary([time.perf_counter() - start]))
+    reference_cache.invalidate()
+    prediction_table.memo.clear()
+    Plot_generator.plot_cache.clear()
+
+    payloads = synthetic_data.form_payloads(queries, seed + 1)
+    records = [prediction.form_record(payload) for payload in payloads]
+
+    if "retrieve_data" in subsystems:
+        add("retrieve_data", timed(lambda _: database.retrieve_data(db, "Active_data"), range(3)))
+
+    if "knn" in subsystems:
+        for heating_source, partition in Clusters._PARTITIONS.items():
+            reference = reference_cache.get_reference_set(db, heating_source)
+            encoder = reference_cache.get_feature_encoder(db, reference)
+            engine = reference.search_engine(partition["metric"])
+            vectors = [encoder.encode(record) for record in records]
+            add(f"knn ({heating_source})",
+                timed(lambda vector: Knn.Knn(record=vector, k=Clusters._NUMBER_OF_NEIGHBORS, engine=engine), vectors))
+
+    if "ann" in subsystems:
+        for result in ann_recall.run(db, queries, seed=seed + 1):
+            probes = f"{result['probes']} probes" if result["engine"] == "ivf" else "exact"
+            add(f"ann ({result.pop('heating_source')}, {probes})", result)
+
+    if "apply_algorithm" in subsystems:
+        add("apply_algorithm", timed(lambda record: Clusters.apply_algorithm(db, record, "exact"), records))
+        add("apply_algorithm (memoized)", timed(lambda record: Clusters.apply_algorithm(db, record, "exact"), records))
+
+    if "train" in subsystems and size <= train_limit:
+        for heating_source in Clusters._PARTITIONS:
+            start = time.perf_counter()
+            stages = Clusters.train_clustering_algorithm(db, heating_source, profile_memory=False)
+            result = summary([time.perf_counter() - start])
+            result["stages"] = stages
+            add(f"train ({heating_source})", result)
+
+    if "parallel" in subsystems:
+        for result in scaling.run(size, sorted({1, parallel.workers()}), batch=queries, seed=seed):
+            timings = summary([result["seconds"]])
+            timings.update(speedup=result["speedup"], throughput=result["throughput"])
+            add(f"{result['workload']} ({result['workers']} workers)", timings)
+
+    if "plots" in subsystems:
+        data_frame = reference_cache.get_reference_set(db).data_frame
+        predictions = [Clusters.apply_algorithm(db, record)[0] for record in records]
+        cases = list(zip(predictions, records))
+        Plot_generator.plot_cache.clear()
+        for label in ("PlotGenerator (cold)", "PlotGenerator (cached)"):
+            add(label, timed(lambda case: Plot_generator.PlotGenerator(data_frame, case[0], case[1]["Kwh/day/m2"],
+                                                                       case[1]), cases))
+        add("ChartData", timed(lambda case: Plot_generator.ChartData(data_frame, case[0], case[1]["Kwh/day/m2"],
+                                                                     case[1]).to_json(), cases))
+
+    if "results" in subsystems:
+        import app
+        client = app.app.test_client()
+
+        etags = {}
+
+        def request(payload, revalidate=False) -> None:
+            with client.session_transaction() as session:
+                session["form1_data"] = json.dumps(payload["form1"])
+                session["form2_data"] = json.dumps(payload["form2"])
+            key = json.dumps(payload, sort_keys=True)
+            headers = {"If-None-Match": etags[key]} if revalidate and key in etags else {}
+            response = client.get("/results", headers=headers)
+            if response.status_code not in ((304, 200) if headers else (200,)):
+                raise RuntimeError(f"/results replied with status {response.status_code}")
+            if response.headers.get("ETag"):
+                etags[key] = response.headers["ETag"]
+
+        rendering = app.app.config["CHART_RENDERING"]
+        for mode in ("client", "server"):
+            app.app.config["CHART_RENDERING"] = mode
+            add(f"/results ({mode} charts)", timed(request, payloads))
+            add(f"/results ({mode} charts, revalidated)", timed(lambda payload: request(payload, True), payloads))
+        app.app.config["CHART_RENDERING"] = rendering
+
+    if "startup" in subsystems:
+        for result in startup.run():
+            imports = summary([result["wall_ms"] / 1000])
+            imports.update({"modules": result["modules"], "import_ms": result["import_ms"],
+                            "slowest": result["slowest"]})
+            add(f"startup ({result['mode']} imports, {result['stage']})", imports)
+
+    return results
+
+
+def environment(mongo_uri) -> dict:
+    """
+    :param mongo_uri: (str)The MongoDB connection string.
+    :return: (dict)The commit, the Python and NumPy versions, the platform, the database kind and the timestamp.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "numpy": np.__version__,
+            "platform": platform.platform(), "database": mongo_uri.split("://")[0],
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat()}
+
+
+def compare(results, baseline, tolerance) -> list:
+    """
+    :param results: (list)The current results.
+    :param baseline: (list)The results of a previous run.
+    :param tolerance: (float)The allowed relative slowdown of the mean duration.
+    :return: (list)The subsystems that got slower than the tolerance, with their baseline and current mean.
+    """
+    previous = {(result["size"], result["subsystem"]): result["mean_ms"] for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result["size"], result["subsystem"]))
+        if before is not None and result["mean_ms"] > before * (1 + tolerance):
+            regressions.append({"size": result["size"], "subsystem": result["subsystem"], "baseline_ms": before,
+                                "current_ms": result["mean_ms"]})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--only", nargs="+", choices=_SUBSYSTEMS)
+    parser.add_argument("--mongo-uri", default="mongomock://")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--train-limit", type=int, default=1000000, help="The largest size the training is timed on.")
+    parser.add_argument("--output", default="-", help="A .json file, or - for the standard output.")
+    parser.add_argument("--compare", help="The .json output of a previous run.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    database.set_client(database._create_client(args.mongo_uri))
+    db = database.get_database()
+    report = {"environment": environment(args.mongo_uri), "results": []}
+    for size in args.sizes:
+        report["results"] += run(db, size, args.queries, args.only, args.seed, args.train_limit)
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline:
+            report["regressions"] = compare(report["results"], json.load(baseline)["results"], args.tolerance)
+        exit_code = 1 if report["regressions"] else 0
+
+    output = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w", encoding="utf-8") as target:
+            target.write(output)
+    sys.exit(exit_code)
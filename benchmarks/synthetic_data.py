@@ -0,0 +1,215 @@
+"""
+Generates synthetic 'Active_data' and 'attributes_info' collections with the schema of the real ones: the records are
+drawn like the HTML forms would fill them (see data_manipulation.transform_data), and stored preprocessed like
+data_manipulation.preprocess_pipeline stores them (scaled numerical attributes, ordinal 'Water Heater' and one-hot
+columns). The same seed always generates the same data, in chunks, so millions of rows never sit in memory at once.
+
+Run from the repository root, against the in-process fake (the default) or a local 'mongod':
+    python -m benchmarks.synthetic_data 100000 --mongo-uri mongodb://localhost:27017
+Since populate replaces the collections of the database, any other server is refused unless --i-know is given.
+"""
+import argparse
+import numpy as np
+import data_manipulation
+import database
+
+_DWELLINGS = list(data_manipulation._MAP_DWELLING.values())
+_AGES = list(data_manipulation._MAP_AGE.values())
+_INCOMES = ["0€ - 10.000€", "10.001€ - 20.000€", "20.001€ - 40.000€", "40.001€ - 60.000€", "60.000€"]
+_FREQUENCIES = ["Never or seldom", "Occasionally", "Frequently"]
+_CATEGORIES = {"Income": _INCOMES, "Recycling": _FREQUENCIES, "Energy Class": _FREQUENCIES,
+               "Thermostats": _FREQUENCIES, "Smart Plugs": _FREQUENCIES, "Awareness": _FREQUENCIES}
+
+"""
+The number of records generated and inserted at once, and the collections replaced by populate.
+"""
+_CHUNK_SIZE = 50000
+_COLLECTIONS = ["Active_data", "attributes_info", "New_entries", "dataset_version", "cluster_stats",
+                "prediction_table"]
+_LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+
+def is_local(connection_string) -> bool:
+    """
+    :param connection_string: (str)A MongoDB connection string.
+    :return: (bool)Whether it points to the in-process fake, or only to servers of the local host.
+    """
+    if connection_string.startswith("mongomock://"):
+        return True
+    # The "mongodb+srv://" scheme always resolves to remote servers.
+    if not connection_string.startswith("mongodb://"):
+        return False
+
+    hosts = connection_string[len("mongodb://"):].split("/", 1)[0].split("?", 1)[0].rsplit("@", 1)[-1]
+    for host in hosts.split(","):
+        name = host[1:host.find("]")] if host.startswith("[") else host.split(":", 1)[0]
+        # A percent-encoded path is a UNIX domain socket.
+        if name not in _LOCAL_HOSTS and not name.startswith("%2F"):
+            return False
+    return True
+
+
+def generate_columns(rows, rng) -> dict:
+    """
+    Draws the attributes of the given number of records, as data_manipulation.transform_data builds them.
+
+    :param rows: (int)The number of records.
+    :param rng: (np.random.Generator)The random generator.
+    :return: (dict)An array per attribute, including the 'Heating Source' and the 'Kwh/day/m2'.
+    """
+    children, teens = rng.integers(0, 3, rows), rng.integers(0, 2, rows)
+    adults, elders = rng.integers(1, 4, rows), rng.integers(0, 2, rows)
+    fulltimers = rng.integers(0, adults + 1)
+    grads = rng.integers(0, adults + 1)
+    columns = {"Dwelling Grade": rng.choice(_DWELLINGS, rows), "Bedrooms": rng.integers(1, 6, rows),
+               "Old": rng.choice(_AGES, rows), "Heating Source": rng.choice(["Yes", "No"], rows),
+               "Occupants": children + teens + adults + elders, "Children": children, "Teenagers": teens,
+               "Adults": adults, "Elders": elders,
+               "Ainc": data_manipulation._calculate_Ainc(children, teens, adults, elders),
+               "Adec": data_manipulation._calculate_Adec(children, teens, adults, elders),
+               "Agauge": data_manipulation._calculate_Agauge(children, teens, adults, elders),
+               "Fulltimers": fulltimers, "Parttimers": rng.integers(0, adults - fulltimers + 1),
+               "Grads": grads, "PostGrads": rng.integers(0, grads + 1),
+               "Water Heater": rng.choice(["Yes", "No"], rows)}
+    columns["Education Index"] = data_manipulation._calculate_Education_Index(columns["Grads"], columns["PostGrads"])
+    for attribute, values in _CATEGORIES.items():
+        columns[attribute] = rng.choice(values, rows)
+
+    # The consumption grows with the dwelling size and the occupants, and drops without a central heating source.
+    columns["Kwh/day/m2"] = rng.gamma(2.0, 0.04, rows) * (1 + 0.5 * columns["Dwelling Grade"]) * \
+        (1 + 0.1 * columns["Occupants"]) * np.where(columns["Heating Source"] == "Yes", 1.3, 1.0)
+    return columns
+
+
+def _chunks(rows, seed, chunk_size=_CHUNK_SIZE) -> iter:
+    """
+    :param rows: (int)The total number of records.
+    :param seed: (int)The random seed.
+    :param chunk_size: (int)The number of records per chunk.
+    :return: (iter)The columns of every chunk (see generate_columns). The chunk sequence only depends on the seed.
+    """
+    for index, start in enumerate(range(0, rows, chunk_size)):
+        yield generate_columns(min(chunk_size, rows - start), np.random.default_rng([seed, index]))
+
+
+def records(columns) -> list:
+    """
+    :param columns: (dict)The columns of generate_columns.
+    :return: (list)The raw records, as data_manipulation.transform_data builds them.
+    """
+    lists = {attribute: values.tolist() for attribute, values in columns.items()}
+    return [dict(zip(lists, row)) for row in zip(*lists.values())]
+
+
+def attributes_info(rows, seed) -> dict:
+    """
+    :param rows: (int)The number of records.
+    :param seed: (int)The random seed.
+    :return: (dict)The 'attributes_info' document: the min and max value of every scaled numerical attribute.
+    """
+    scaled = [label for label in data_manipulation._NUMERICAL_LABELS
+              if label not in data_manipulation._UNSCALED_LABELS]
+    info = {label: {"min": float("inf"), "max": float("-inf")} for label in scaled}
+    for columns in _chunks(rows, seed):
+        for label in scaled:
+            info[label]["min"] = min(info[label]["min"], float(columns[label].min()))
+            info[label]["max"] = max(info[label]["max"], float(columns[label].max()))
+    for label in scaled:
+        if info[label]["max"] <= info[label]["min"]:
+            info[label]["max"] = info[label]["min"] + 1.0
+    return info
+
+
+def preprocess(columns, info, rng) -> list:
+    """
+    Preprocesses the records like data_manipulation.preprocess_pipeline and assigns them a random cluster label of
+    their heating source partition.
+
+    :param columns: (dict)The columns of generate_columns.
+    :param info: (dict)The 'attributes_info' document.
+    :param rng: (np.random.Generator)The random generator of the labels.
+    :return: (list)The 'Active_data' documents.
+    """
+    processed = {}
+    for label in data_manipulation._NUMERICAL_LABELS:
+        if label in data_manipulation._UNSCALED_LABELS:
+            processed[label] = columns[label].astype(np.float64)
+        else:
+            processed[label] = data_manipulation.min_max_scaler(columns[label],
+                                                                (info[label]["min"], info[label]["max"]))
+    processed["Water Heater"] = np.where(columns["Water Heater"] == "No", 1, 0)
+    processed["Heating Source"] = columns["Heating Source"]
+    processed["Kwh/day/m2"] = columns["Kwh/day/m2"]
+    processed["label"] = np.where(columns["Heating Source"] == "Yes", rng.integers(0, 3, len(columns["Bedrooms"])),
+                                  rng.integers(0, 4, len(columns["Bedrooms"])))
+
+    documents = records(processed)
+    onehots = {attribute: columns[attribute].tolist() for attribute in _CATEGORIES}
+    for row, document in enumerate(documents):
+        for attribute, values in onehots.items():
+            document[f"{attribute}_{values[row]}"] = 1
+    return documents
+
+
+def populate(db, rows, seed=0) -> dict:
+    """
+    Replaces the collections of the database with a synthetic dataset.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param rows: (int)The number of 'Active_data' records.
+    :param seed: (int)The random seed.
+    :return: (dict)The 'attributes_info' document.
+    """
+    for collection in _COLLECTIONS:
+        db[collection].drop()
+
+    info = attributes_info(rows, seed)
+    db["attributes_info"].insert_one(dict(info))
+    rng = np.random.default_rng([seed, rows])
+    for columns in _chunks(rows, seed):
+        db["Active_data"].insert_many(preprocess(columns, info, rng), ordered=False)
+    db["Active_data"].create_index("Heating Source")
+    return info
+
+
+def form_payloads(count, seed=0) -> list:
+    """
+    :param count: (int)The number of payloads.
+    :param seed: (int)The random seed.
+    :return: (list)Random payloads with the data of both HTML forms, as the results page and '/api/predict' take them.
+    """
+    rng = np.random.default_rng(seed)
+    dwellings = {value: key for key, value in data_manipulation._MAP_DWELLING.items()}
+    ages = {value: key for key, value in data_manipulation._MAP_AGE.items()}
+    payloads = []
+    for record in records(generate_columns(count, rng)):
+        meters = int(rng.integers(40, 250))
+        form1 = {"dtype": dwellings[record["Dwelling Grade"]], "age": ages[record["Old"]],
+                 "heating": record["Heating Source"], "meters": str(meters), "bedrooms": str(record["Bedrooms"]),
+                 "occupants": str(record["Occupants"]), "children": str(record["Children"]),
+                 "teens": str(record["Teenagers"]), "adults": str(record["Adults"]), "elders": str(record["Elders"]),
+                 "full": str(record["Fulltimers"]), "part": str(record["Parttimers"]),
+                 "graduated": str(record["Grads"]), "post": str(record["PostGrads"]), "income": record["Income"]}
+        form2 = {"recycling": record["Recycling"], "energy": record["Energy Class"],
+                 "thermo": record["Thermostats"], "water": record["Water Heater"], "plugs": record["Smart Plugs"],
+                 "awareness": record["Awareness"], "kwhs": str(round(record["Kwh/day/m2"] * 30 * meters, 2)),
+                 "start": "2023-01-01", "end": "2023-01-31"}
+        payloads.append({"form1": form1, "form2": form2})
+    return payloads
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("rows", type=int)
+    parser.add_argument("--mongo-uri", default="mongomock://")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--i-know", action="store_true",
+                        help="Allow a remote server, whose collections are replaced by the synthetic ones.")
+    args = parser.parse_args()
+    if not args.i_know and not is_local(args.mongo_uri):
+        parser.error("the synthetic data replaces the collections of the database; refusing a remote server "
+                     "without --i-know")
+
+    database.set_client(database._create_client(args.mongo_uri))
+    populate(database.get_database(), args.rows, args.seed)
+    print(f"Generated {args.rows} records.")
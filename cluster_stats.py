@@ -0,0 +1,169 @@
+import numpy as np
+
+"""
+The collection that keeps the precomputed consumption aggregates, the quantiles stored for every group, and the number
+of histogram bins (the same as the similar dwellings plot of Plot_generator).
+"""
+_STATS_COLLECTION = "cluster_stats"
+_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+_HISTOGRAM_BINS = 30
+
+
+def histogram(values) -> dict:
+    """
+    Calculates the consumption histogram of a group of records, with 30 bins spanning from the minimum value up to
+    the maximum value increased by 10%.
+
+    :param values: (np.ndarray)The consumption values.
+    :return: (dict)The bin edges and the number of records in each bin.
+    """
+    low, high = float(np.min(values)), float(np.max(values))
+    high = high + 0.10 * high
+    if high <= low:
+        high = low + 1.0
+    counts, edges = np.histogram(values, bins=_HISTOGRAM_BINS, range=(low, high))
+    return {"edges": edges.tolist(), "counts": counts.tolist()}
+
+
+def _describe(values) -> dict:
+    """
+    :param values: (np.ndarray)The consumption values of a group of records.
+    :return: (dict)The count, mean, variance and quantiles of the values.
+    """
+    return {"count": int(len(values)), "mean": float(np.mean(values)), "var": float(np.var(values)),
+            "quantiles": np.quantile(values, _QUANTILES).tolist()}
+
+
+def compute(data_frame, version, dataset="Active_data") -> list:
+    """
+    Calculates the consumption aggregates of every cluster (per heating source partition and across both of them)
+    and of every dwelling type.
+
+    :param data_frame: (pandas.DataFrame)The records of the dataset.
+    :param version: (int)The dataset version the records belong to.
+    :param dataset: (str)The dataset name, "Active_data" or a heating source partition (e.g. "Active_data:Yes").
+    :return: (list)The statistics documents.
+    """
+    documents = []
+    groups = [("All", data_frame)] + list(data_frame.groupby("Heating Source"))
+    for heating_source, partition in groups:
+        for label, cluster in partition.groupby("label"):
+            document = {"_id": f"{dataset}/{version}/cluster:{heating_source}:{int(label)}", "dataset": dataset,
+                        "kind": "cluster", "version": version, "Heating Source": heating_source, "label": int(label)}
+            document.update(_describe(cluster["Kwh/day/m2"].to_numpy(dtype=np.float64)))
+            document["histograms"] = [dict({"Dwelling Grade": float(grade)},
+                                           **histogram(dwellings["Kwh/day/m2"].to_numpy(dtype=np.float64)))
+                                      for grade, dwellings in cluster.groupby("Dwelling Grade")]
+            documents.append(document)
+
+    for grade, dwellings in data_frame.groupby("Dwelling Grade"):
+        values = dwellings["Kwh/day/m2"].to_numpy(dtype=np.float64)
+        document = {"_id": f"{dataset}/{version}/dwelling:{float(grade)}", "dataset": dataset, "kind": "dwelling",
+                    "version": version, "Dwelling Grade": float(grade)}
+        document.update(_describe(values))
+        document["histogram"] = histogram(values)
+        documents.append(document)
+
+    return documents
+
+
+def save(db, documents, dataset="Active_data") -> None:
+    """
+    Replaces the statistics of a dataset in the 'cluster_stats' database collection with the given documents, which
+    all belong to the same dataset version. The documents are written next to the ones of the previous versions, and
+    the version is only switched to once all of them are written, by a manifest document with their number (see
+    load). The previous versions are deleted afterwards, so that a reader never sees a partial set of statistics.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param documents: (list)The statistics documents.
+    :param dataset: (str)The dataset name.
+    """
+    if not documents:
+        return
+    version = documents[0]["version"]
+
+    # Clears what an interrupted save of the same version left behind.
+    db[_STATS_COLLECTION].delete_many({"dataset": dataset, "version": version})
+    db[_STATS_COLLECTION].insert_many(documents)
+    db[_STATS_COLLECTION].replace_one({"_id": f"{dataset}/{version}"},
+                                      {"dataset": dataset, "kind": "manifest", "version": version,
+                                       "count": len(documents)}, upsert=True)
+    db[_STATS_COLLECTION].delete_many({"dataset": dataset, "version": {"$lt": version}})
+
+
+def _complete(documents) -> list | None:
+    """
+    :param documents: (list)The statistics and manifest documents of a dataset version.
+    :return: (list | None)The statistics documents, or None if their manifest is missing or they are incomplete.
+    """
+    manifest = next((document for document in documents if document["kind"] == "manifest"), None)
+    documents = [document for document in documents if document["kind"] != "manifest"]
+    if manifest is None or len(documents) != manifest["count"]:
+        return None
+    return documents
+
+
+def load(db, version, dataset="Active_data") -> list | None:
+    """
+    Fetches the statistics documents of the given dataset version.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param version: (int)The dataset version.
+    :param dataset: (str)The dataset name.
+    :return: (list | None)The statistics documents, or None if they have not been computed for this version, or their
+    save has not completed yet.
+    """
+    return _complete(list(db[_STATS_COLLECTION].find({"dataset": dataset, "version": version})))
+
+
+async def load_async(async_db, version, dataset="Active_data") -> list | None:
+    """
+    The asynchronous version of load.
+
+    :param async_db: (motor.motor_asyncio.AsyncIOMotorDatabase)The asynchronous MongoDB database connection.
+    :param version: (int)The dataset version.
+    :param dataset: (str)The dataset name.
+    :return: (list | None)The statistics documents, or None if they have not been computed for this version, or their
+    save has not completed yet.
+    """
+    return _complete(await async_db[_STATS_COLLECTION].find({"dataset": dataset, "version": version}).to_list(None))
+
+
+class ClusterStats:
+    """
+    Lookup tables over the statistics documents, so that the expected consumption of a cluster is an O(1) lookup.
+    """
+    def __init__(self, documents) -> None:
+        """
+        Initializing class variables.
+
+        :param documents: (list)The statistics documents.
+        """
+        self.documents = documents
+        self.clusters = {(document["Heating Source"], document["label"]): document
+                         for document in documents if document["kind"] == "cluster"}
+        self.dwellings = {document["Dwelling Grade"]: document
+                          for document in documents if document["kind"] == "dwelling"}
+
+    def cluster(self, label, heating_source="All") -> dict:
+        """
+        :param label: (int)The cluster label.
+        :param heating_source: (str)The heating source partition, "Yes", "No" or "All".
+        :return: (dict)The statistics of the cluster.
+        """
+        return self.clusters[(heating_source, int(label))]
+
+    def mean(self, label, heating_source="All") -> float:
+        """
+        :param label: (int)The cluster label.
+        :param heating_source: (str)The heating source partition, "Yes", "No" or "All".
+        :return: (float)The mean consumption of the records within the cluster.
+        """
+        return self.cluster(label, heating_source)["mean"]
+
+    def dwelling(self, grade) -> dict:
+        """
+        :param grade: (float)The dwelling grade.
+        :return: (dict)The statistics of the dwelling type.
+        """
+        return self.dwellings[float(grade)]
@@ -1,5 +1,7 @@
 import datetime as dt
 from datetime import datetime
+import numpy as np
+import metrics
 
 """
 Dictionaries used to map categorical attributes to numeric values.
@@ -16,6 +18,39 @@ _NUMERICAL_LABELS = ['Dwelling Grade', 'Bedrooms', 'Old', 'Occupants',
 _ONEHOT_LABELS = ['Income', 'Recycling', 'Energy Class', 'Thermostats', 'Smart Plugs', 'Awareness']
 _ORDINAL_LABELS = ['Water Heater']
 _COLUMNS = _NUMERICAL_LABELS + _ONEHOT_LABELS + _ORDINAL_LABELS
+_UNSCALED_LABELS = ['Dwelling Grade', 'Old']
+
+"""
+The fields of the HTML forms that transform_data needs.
+"""
+_FORM1_FIELDS = ['dtype', 'age', 'heating', 'meters', 'bedrooms', 'occupants', 'children', 'teens', 'adults',
+                 'elders', 'full', 'part', 'graduated', 'post', 'income']
+_FORM2_FIELDS = ['recycling', 'energy', 'thermo', 'water', 'plugs', 'awareness', 'kwhs', 'start', 'end']
+
+
+def validate_record(record) -> list:
+    """
+    Validates a record built by transform_data or transform_data_API against the schema implied by _COLUMNS: every
+    attribute is present, the numerical ones and the actual 'Kwh/day/m2' consumption are finite numbers and the
+    categorical ones are strings.
+
+    :param record: (dict)The record.
+    :return: (list)The validation errors, empty if the record is valid.
+    """
+    errors = []
+    for attribute in _COLUMNS + ["Kwh/day/m2"]:
+        if attribute not in record or record[attribute] is None:
+            errors.append(f"'{attribute}' is missing.")
+        elif attribute in _NUMERICAL_LABELS or attribute == "Kwh/day/m2":
+            if isinstance(record[attribute], bool) or not isinstance(record[attribute], (int, float)) or \
+                    record[attribute] != record[attribute] or abs(record[attribute]) == float("inf"):
+                errors.append(f"'{attribute}' should be a number.")
+        elif not isinstance(record[attribute], str):
+            errors.append(f"'{attribute}' should be a string.")
+
+    if record.get("Heating Source") not in ("Yes", "No"):
+        errors.append("'Heating Source' should be: {Yes/No}.")
+    return errors
 
 
 def min_max_scaler(value, min_max_tuple, min_max_range=(0, 1)) -> float:
@@ -25,8 +60,10 @@ def min_max_scaler(value, min_max_tuple, min_max_range=(0, 1)) -> float:
     :param value: (float) The value to be scaled.
     :param min_max_tuple: (tuple) The min and max values of the attribute that the value is part of.
     :param min_max_range: (tuple) The scale range.
-    :return: (float) The processed value.
+    :return: (float) The processed value, the lower bound of the scale range if the attribute has a single value.
     """
+    if min_max_tuple[1] == min_max_tuple[0]:
+        return min_max_range[0]
     x_std = (value - min_max_tuple[0]) / (min_max_tuple[1] - min_max_tuple[0])
     x_scaled = x_std * (min_max_range[1] - min_max_range[0]) + min_max_range[0]
     return x_scaled
@@ -44,11 +81,22 @@ def preprocess_pipeline(db, record) -> None:
     :param record: (dict)A dictionary with the data from the filled HTML forms.
     :return: (None)
     """
-    min_max_info = db["attributes_info"].find_one()
+    with metrics.timed("preprocess_pipeline"):
+        preprocess_record(record, db["attributes_info"].find_one())
+
+
+def preprocess_record(record, attributes_info) -> None:
+    """
+    Applies the transformations of preprocess_pipeline with an already fetched 'attributes_info' document, e.g. to a
+    batch of records.
 
-    for attribute in [element for element in _NUMERICAL_LABELS if element not in ['Dwelling Grade', 'Old']]:
+    :param record: (dict)A dictionary with the data from the filled HTML forms.
+    :param attributes_info: (dict)The min and max values of the numerical attributes.
+    :return: (None)
+    """
+    for attribute in [element for element in _NUMERICAL_LABELS if element not in _UNSCALED_LABELS]:
         record[attribute] = min_max_scaler(record[attribute], min_max_tuple=(
-            min_max_info[attribute]['min'], min_max_info[attribute]['max']))
+            attributes_info[attribute]['min'], attributes_info[attribute]['max']))
 
     for ordinal in _ORDINAL_LABELS:
         record[ordinal] = 1 if record[ordinal] == "No" else 0
@@ -58,6 +106,79 @@ def preprocess_pipeline(db, record) -> None:
         del record[onehot]
 
 
+class FeatureEncoder:
+    """
+    A compiled version of preprocess_pipeline, built once from the 'attributes_info' document and the columns of the
+    reference feature matrix, that encodes records straight into NumPy rows aligned with these columns.
+    """
+    def __init__(self, attributes_info, columns) -> None:
+        """
+        Initializing class variables.
+
+        :param attributes_info: (dict)The min and max values of the numerical attributes.
+        :param columns: (list)The columns of the reference feature matrix.
+        """
+        self.attributes_info = attributes_info
+        self.columns = list(columns)
+        column_index = {column: i for i, column in enumerate(self.columns)}
+
+        # The numerical attributes are scaled as (value - low) / span, with low = 0 and span = 1 for the unscaled ones.
+        # The attributes with a single value (min == max) are encoded as 0, as min_max_scaler does.
+        self.numerical = [attribute for attribute in _NUMERICAL_LABELS if attribute in column_index]
+        self.numerical_index = np.array([column_index[attribute] for attribute in self.numerical], dtype=np.intp)
+        self.low = np.array([0.0 if attribute in _UNSCALED_LABELS else attributes_info[attribute]['min']
+                             for attribute in self.numerical], dtype=np.float64)
+        self.span = np.array([1.0 if attribute in _UNSCALED_LABELS else
+                              attributes_info[attribute]['max'] - attributes_info[attribute]['min']
+                              for attribute in self.numerical], dtype=np.float64)
+        self.constant = self.span == 0
+        self.span[self.constant] = 1.0
+
+        self.ordinal = [(attribute, column_index[attribute]) for attribute in _ORDINAL_LABELS
+                        if attribute in column_index]
+
+        # (attribute, value) -> the column of the one-hot encoded value.
+        self.onehot = {}
+        for onehot in _ONEHOT_LABELS:
+            for column, i in column_index.items():
+                if column.startswith(f"{onehot}_"):
+                    self.onehot[(onehot, column[len(onehot) + 1:])] = i
+
+    def encode(self, record) -> np.ndarray:
+        """
+        :param record: (dict)A record built by transform_data or transform_data_API.
+        :return: (np.ndarray)The encoded record.
+        """
+        return self.encode_batch([record])[0]
+
+    def encode_batch(self, records) -> np.ndarray:
+        """
+        Encodes a batch of records. One-hot values that are unknown to the reference columns are ignored, since they
+        add the same constant to the distance from every reference record.
+
+        :param records: (list)The records built by transform_data or transform_data_API.
+        :return: (np.ndarray)A float32 matrix with a row per record.
+        """
+        matrix = np.zeros((len(records), len(self.columns)), dtype=np.float32)
+
+        values = np.array([[record[attribute] for attribute in self.numerical] for record in records],
+                          dtype=np.float64).reshape(len(records), len(self.numerical))
+        scaled = (values - self.low) / self.span
+        scaled[:, self.constant] = 0
+        matrix[:, self.numerical_index] = scaled
+
+        for ordinal, i in self.ordinal:
+            matrix[:, i] = [1 if record[ordinal] == "No" else 0 for record in records]
+
+        for row, record in enumerate(records):
+            for onehot in _ONEHOT_LABELS:
+                i = self.onehot.get((onehot, record[onehot]))
+                if i is not None:
+                    matrix[row, i] = 1
+
+        return matrix
+
+
 def _map_size(size) -> float:
     """
     Maps the size of a dwelling to a value between 0 and 1.
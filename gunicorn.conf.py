@@ -0,0 +1,34 @@
+"""
+Gunicorn settings of the WSGI application (gunicorn -c gunicorn.conf.py app:app).
+
+With PRELOAD_APP=1 the application is imported once in the master, which also imports the whole scientific stack (see
+app.preload), and the workers are forked from it: they share the imported modules copy-on-write and start serving
+right away, so booting and autoscaling workers no longer pays for the imports. Otherwise every worker imports the
+application itself, and the heavy modules are imported lazily on first use (see app.lazy_import).
+"""
+import os
+
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", 4))
+threads = int(os.environ.get("GUNICORN_THREADS", 1))
+preload_app = os.environ.get("PRELOAD_APP", "0") == "1"
+
+
+def when_ready(server) -> None:
+    """
+    Imports the scientific stack in the master before the workers are forked, when the application is preloaded.
+    """
+    if preload_app:
+        import app
+        app.preload()
+        server.log.info("Preloaded the scientific stack.")
+
+
+def post_worker_init(worker) -> None:
+    """
+    Starts the promotion scheduler in every worker (see app.start_promotion), since threads do not survive the fork.
+    """
+    import app
+    app.start_promotion()
@@ -0,0 +1,187 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+"""
+Write-behind settings: the maximum number of records per 'insert_many', how long (in seconds) the worker waits for
+a batch to fill, the queue capacity, how long a request waits for room in a full queue before writing its record
+synchronously, and the number of attempts per batch.
+"""
+_BATCH_SIZE = int(os.environ.get("INGESTION_BATCH_SIZE", 100))
+_FLUSH_INTERVAL = float(os.environ.get("INGESTION_FLUSH_INTERVAL", 1.0))
+_MAX_QUEUE = int(os.environ.get("INGESTION_MAX_QUEUE", 10000))
+_ENQUEUE_TIMEOUT = float(os.environ.get("INGESTION_ENQUEUE_TIMEOUT", 0.05))
+_RETRIES = int(os.environ.get("INGESTION_RETRIES", 5))
+
+_logger = logging.getLogger(__name__)
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+class WriteBehindQueue:
+    """
+    A bounded queue of records that a background thread writes to a database collection in batches.
+    """
+    def __init__(self, db, collection="New_entries") -> None:
+        """
+        Initializing class variables.
+
+        :param db: (pymongo.database)The MongoDB database connection.
+        :param collection: (str)The name of the collection the records are written to.
+        """
+        self.collection = db[collection]
+        self.queue = queue.Queue(maxsize=_MAX_QUEUE)
+        self.written = 0
+        self.failed = 0
+        self.synchronous = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"write-behind-{collection}", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, record) -> None:
+        """
+        Queues a copy of the record. When the queue stays full, the record is written synchronously instead, which
+        slows the request down rather than dropping data or growing the queue without bound.
+
+        :param record: (dict)The record to be written.
+        """
+        record = dict(record)
+        try:
+            self.queue.put(record, timeout=_ENQUEUE_TIMEOUT)
+        except queue.Full:
+            self.synchronous += 1
+            self._write([record])
+
+    def _write(self, batch) -> None:
+        """
+        Writes a batch with 'insert_many', retrying with exponential backoff.
+
+        :param batch: (list)The records to be written.
+        """
+        for attempt in range(_RETRIES):
+            try:
+                self.collection.insert_many(batch, ordered=False)
+            except Exception as error:
+                # Records that were written before the failure keep their '_id' and are rejected as duplicates. An
+                # error without write errors (e.g. only write concern errors) is not a duplicate and is retried.
+                details = getattr(error, "details", None) or {}
+                write_errors = details.get("writeErrors", [])
+                if write_errors and not details.get("writeConcernErrors") and \
+                        all(write_error.get("code") == 11000 for write_error in write_errors):
+                    break
+                if attempt == _RETRIES - 1:
+                    self.failed += len(batch)
+                    _logger.error("Dropped %d records after %d attempts: %s", len(batch), _RETRIES, error)
+                    return
+                time.sleep(min(0.1 * 2 ** attempt, 5.0))
+            else:
+                break
+        self.written += len(batch)
+
+    def _run(self) -> None:
+        """
+        The background worker that collects up to _BATCH_SIZE records, or whatever arrived within _FLUSH_INTERVAL
+        seconds, and writes them.
+        """
+        while not (self._stopped.is_set() and self.queue.empty()):
+            try:
+                batch = [self.queue.get(timeout=_FLUSH_INTERVAL)]
+            except queue.Empty:
+                continue
+
+            deadline = time.monotonic() + _FLUSH_INTERVAL
+            while len(batch) < _BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            self._write(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    def flush(self) -> None:
+        """
+        Blocks until every queued record has been written.
+        """
+        self.queue.join()
+
+    def close(self, timeout=10.0) -> None:
+        """
+        Writes the remaining records and stops the background worker.
+
+        :param timeout: (float)The maximum number of seconds to wait for the worker.
+        """
+        self._stopped.set()
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        """
+        :return: (dict)The number of queued, written, failed and synchronously written records.
+        """
+        return {"queued": self.queue.qsize(), "written": self.written, "failed": self.failed,
+                "synchronous": self.synchronous}
+
+
+def get_queue(db, collection="New_entries") -> WriteBehindQueue:
+    """
+    Returns the write-behind queue of the current process for a collection, starting it on first use.
+    Threads do not survive a fork, so every worker process starts its own queue.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param collection: (str)The name of the collection the records are written to.
+    :return: (WriteBehindQueue)The queue.
+    """
+    key = (os.getpid(), collection)
+    if key not in _queues:
+        with _queues_lock:
+            if key not in _queues:
+                _queues[key] = WriteBehindQueue(db, collection)
+    return _queues[key]
+
+
+def enqueue(db, record, collection="New_entries") -> None:
+    """
+    Queues a record to be written to a database collection in the background.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param record: (dict)The record to be written.
+    :param collection: (str)The name of the collection.
+    """
+    get_queue(db, collection).enqueue(record)
+
+
+@atexit.register
+def close_all() -> None:
+    """
+    Writes the remaining records of every queue of the current process before it exits.
+    """
+    for (pid, _), write_queue in list(_queues.items()):
+        if pid == os.getpid():
+            write_queue.close()
+
+
+def start_scheduler(function, interval, name="scheduler") -> threading.Thread:
+    """
+    Runs a job periodically in a daemon thread. Failures are logged and the job runs again after the interval.
+
+    :param function: (callable)The job.
+    :param interval: (float)The number of seconds between two runs.
+    :param name: (str)The thread name.
+    :return: (threading.Thread)The scheduler thread.
+    """
+    def run() -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                function()
+            except Exception:
+                _logger.exception("Scheduled job %s failed", name)
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    return thread
@@ -1,19 +1,347 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+"""
+Client settings: the lavoro server URL, the connect/read timeouts in seconds, the number of retries of failed
+connections and 5xx replies, the keep-alive pool size, the failures that open the circuit breaker and how long it
+stays open, and the lifetime and maximum number of the cached meta replies.
+"""
+_BASE_URL = os.environ.get("LAVORO_URL", "http://lavoro.csd.auth.gr:8000")
+_TIMEOUT = (float(os.environ.get("LAVORO_CONNECT_TIMEOUT", 3.05)), float(os.environ.get("LAVORO_READ_TIMEOUT", 10)))
+_RETRIES = int(os.environ.get("LAVORO_RETRIES", 2))
+_POOL_SIZE = int(os.environ.get("LAVORO_POOL_SIZE", 20))
+_FAILURE_THRESHOLD = int(os.environ.get("LAVORO_FAILURE_THRESHOLD", 5))
+_RESET_TIMEOUT = float(os.environ.get("LAVORO_RESET_TIMEOUT", 30))
+_META_TTL = float(os.environ.get("LAVORO_META_TTL", 3600))
+_META_CACHE_SIZE = int(os.environ.get("LAVORO_META_CACHE_SIZE", 10000))
+
+
+class LavoroUnavailable(Exception):
+    """
+    Raised when the lavoro API does not reply in time, fails, or the circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops calling the lavoro API after consecutive failed requests. After the reset timeout a single trial request
+    (i.e. both calls of get_element) is let through: the circuit closes if it succeeds and opens again if it fails.
+    """
+    def __init__(self, failure_threshold, reset_timeout) -> None:
+        """
+        Initializing class variables.
+
+        :param failure_threshold: (int)The consecutive failures that open the circuit.
+        :param reset_timeout: (float)The seconds the circuit stays open before a trial request.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        :return: (bool)Whether a request can be made.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if not self.trial and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.trial = True
+                return True
+            return False
+
+    def success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+    @property
+    def state(self) -> str:
+        """
+        :return: (str)"closed", "open" or "half-open".
+        """
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.trial else "open"
+
+
+class TTLCache:
+    """
+    A thread-safe cache whose items expire after a fixed lifetime. The oldest item is evicted when it is full.
+    """
+    def __init__(self, ttl, size) -> None:
+        """
+        Initializing class variables.
+
+        :param ttl: (float)The lifetime of an item in seconds.
+        :param size: (int)The maximum number of items.
+        """
+        self.ttl = ttl
+        self.size = size
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param key: The item key.
+        :return: The cached item, or None if it is missing or has expired.
+        """
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            if time.monotonic() - item[0] >= self.ttl:
+                del self.items[key]
+                return None
+            return item[1]
+
+    def set(self, key, value) -> None:
+        with self.lock:
+            self.items.pop(key, None)
+            if len(self.items) >= self.size:
+                del self.items[next(iter(self.items))]
+            self.items[key] = (time.monotonic(), value)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.items.clear()
+
+
+breaker = CircuitBreaker(_FAILURE_THRESHOLD, _RESET_TIMEOUT)
+meta_cache = TTLCache(_META_TTL, _META_CACHE_SIZE)
+
+_clients = {}
+_clients_lock = threading.Lock()
+_async_clients = {}
+
+
+def _client() -> tuple:
+    """
+    Returns the keep-alive session and the thread pool of the current process, creating them on first use, since
+    neither of them survives a fork.
+
+    :return: (tuple)The requests session and the thread pool that runs the concurrent calls.
+    """
+    pid = os.getpid()
+    if pid not in _clients:
+        with _clients_lock:
+            if pid not in _clients:
+                session = requests.Session()
+                retry = Retry(total=_RETRIES, connect=_RETRIES, read=_RETRIES, backoff_factor=0.2,
+                              status_forcelist=[502, 503, 504], allowed_methods=["GET"], raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=_POOL_SIZE, pool_maxsize=_POOL_SIZE, max_retries=retry)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _clients[pid] = (session, ThreadPoolExecutor(max_workers=_POOL_SIZE,
+                                                             thread_name_prefix="lavoro"))
+    return _clients[pid]
+
+
+def _admit() -> None:
+    """
+    :raises LavoroUnavailable: If the circuit breaker rejects the request.
+    """
+    if not breaker.allow():
+        raise LavoroUnavailable("The lavoro API circuit breaker is open.")
+
+
+def _json(reply):
+    """
+    :param reply: (requests.Response | httpx.Response)A reply of the lavoro API.
+    :return: The JSON body of the reply.
+    :raises LavoroUnavailable: If the body is not JSON.
+    """
+    try:
+        return reply.json()
+    except ValueError as error:
+        raise LavoroUnavailable("The lavoro API replied with a body that is not JSON.") from error
+
+
+def _get(url) -> requests.Response:
+    """
+    Performs a GET request. The outcome is recorded by the circuit breaker per request of get_element.
+
+    :param url: (str)The request URL.
+    :return: (requests.Response)The reply.
+    """
+    session, _ = _client()
+    try:
+        reply = session.get(url, timeout=_TIMEOUT)
+    except requests.RequestException as error:
+        raise LavoroUnavailable(str(error)) from error
+
+    if reply.status_code >= 500:
+        raise LavoroUnavailable(f"The lavoro API replied with status {reply.status_code}.")
+    return reply
+
+
+def _get_meta(ID) -> dict | None:
+    """
+    :param ID: (ID) The dwelling ID.
+    :return: (dict | None) The cached or fetched energy information of the dwelling, None if the ID is not valid.
+    """
+    meta = meta_cache.get(ID)
+    if meta is not None:
+        return meta
+
+    reply = _get(f"{_BASE_URL}/dev_id/{ID}/meta/")
+    if reply.status_code in [400, 404, 405]:
+        return None
+    meta = _json(reply)
+    meta_cache.set(ID, meta)
+    return meta
+
+
+def _get_consumption(ID):
+    """
+    :param ID: (ID) The dwelling ID.
+    :return: The energy consumption of the dwelling.
+    """
+    reply = _get(f"{_BASE_URL}/dev_id/{ID}/json/30days/average_consumption_div_home_size?from_cache=false")
+    if reply.status_code in [400, 404, 405]:
+        return None
+    return _json(reply)
 
 
 def get_element(ID) -> tuple[any, any]:
     """
     This function calls the lavoro API and based on the returned status code, returns either None or two JSON files
     containing the energy information and energy consumption of the dwelling with the specific ID.
+    The two calls run concurrently over a keep-alive connection pool, with connect/read timeouts and bounded retries,
+    and the energy information is cached per dwelling. They pass the circuit breaker together, as a single request
+    that fails if either of them fails.
 
     :param ID: (ID) The dwelling ID.
     :return: (tuple) A tuple of Nones or a tuple of JSON files.
+    :raises LavoroUnavailable: If the lavoro API does not reply in time, fails, or the circuit breaker is open.
     """
-    record = requests.get(f"http://lavoro.csd.auth.gr:8000/dev_id/{ID}/meta/")
-    if record.status_code in [400, 404, 405]:
+    _admit()
+    _, pool = _client()
+    meta_future = pool.submit(_get_meta, ID)
+    consumption_future = pool.submit(_get_consumption, ID)
+
+    try:
+        record = meta_future.result()
+        consumption = consumption_future.result()
+    except Exception:
+        breaker.failure()
+        raise
+    breaker.success()
+    if record is None:
         return None, None
 
-    consumption = requests.get(
-        f"http://lavoro.csd.auth.gr:8000/dev_id/{ID}/json/30days/average_consumption_div_home_size?from_cache=false")
+    return record, consumption
+
+
+def _async_client():
+    """
+    Returns the asynchronous keep-alive client of the current process, creating it on first use. It requires the
+    optional 'httpx' package and should only be used from a single event loop (see close_async_client).
+
+    :return: (httpx.AsyncClient)The asynchronous client.
+    """
+    pid = os.getpid()
+    if pid not in _async_clients:
+        import httpx
+        limits = httpx.Limits(max_connections=_POOL_SIZE, max_keepalive_connections=_POOL_SIZE)
+        timeout = httpx.Timeout(_TIMEOUT[1], connect=_TIMEOUT[0])
+        _async_clients[pid] = httpx.AsyncClient(timeout=timeout, limits=limits,
+                                                transport=httpx.AsyncHTTPTransport(retries=_RETRIES, limits=limits))
+    return _async_clients[pid]
+
+
+async def close_async_client() -> None:
+    """
+    Closes the asynchronous client of the current process, if any.
+    """
+    client = _async_clients.pop(os.getpid(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def _get_async(url):
+    """
+    Performs an asynchronous GET request. The outcome is recorded by the circuit breaker per request of
+    get_element_async.
+
+    :param url: (str)The request URL.
+    :return: (httpx.Response)The reply.
+    """
+    import httpx
+
+    try:
+        reply = await _async_client().get(url)
+    except httpx.HTTPError as error:
+        raise LavoroUnavailable(str(error)) from error
+
+    if reply.status_code >= 500:
+        raise LavoroUnavailable(f"The lavoro API replied with status {reply.status_code}.")
+    return reply
+
+
+async def _get_meta_async(ID) -> dict | None:
+    """
+    :param ID: (ID) The dwelling ID.
+    :return: (dict | None) The cached or fetched energy information of the dwelling, None if the ID is not valid.
+    """
+    meta = meta_cache.get(ID)
+    if meta is not None:
+        return meta
+
+    reply = await _get_async(f"{_BASE_URL}/dev_id/{ID}/meta/")
+    if reply.status_code in [400, 404, 405]:
+        return None
+    meta = _json(reply)
+    meta_cache.set(ID, meta)
+    return meta
+
+
+async def _get_consumption_async(ID):
+    """
+    :param ID: (ID) The dwelling ID.
+    :return: The energy consumption of the dwelling.
+    """
+    reply = await _get_async(f"{_BASE_URL}/dev_id/{ID}/json/30days/average_consumption_div_home_size?from_cache=false")
+    if reply.status_code in [400, 404, 405]:
+        return None
+    return _json(reply)
+
+
+async def get_element_async(ID) -> tuple[any, any]:
+    """
+    The asynchronous version of get_element, for the event loop of the ASGI application (see asgi_app). Both calls
+    are awaited concurrently and share the circuit breaker and the meta cache of the synchronous client.
+
+    :param ID: (ID) The dwelling ID.
+    :return: (tuple) A tuple of Nones or a tuple of JSON files.
+    :raises LavoroUnavailable: If the lavoro API does not reply in time, fails, or the circuit breaker is open.
+    """
+    _admit()
+    try:
+        record, consumption = await asyncio.gather(_get_meta_async(ID), _get_consumption_async(ID))
+    except (Exception, asyncio.CancelledError):
+        # A cancelled trial request must not keep the circuit half-open.
+        breaker.failure()
+        raise
+    breaker.success()
+    if record is None:
+        return None, None
 
-    return record.json(), consumption.json()
+    return record, consumption
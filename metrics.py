@@ -0,0 +1,182 @@
+"""
+Hot-path instrumentation of the current worker process: latency histograms of the prediction stages, counters (cache
+hits and misses, errors by class), gauges collected on demand (reference set sizes, cache footprints, RSS), and an
+opt-in cProfile hook for sampled requests.
+The metrics are rendered in the Prometheus text format by the '/metrics' endpoint. Every worker keeps its own metrics,
+so they carry a 'pid' label.
+"""
+import bisect
+import cProfile
+import os
+import random
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+"""
+The upper bounds (in seconds) of the latency histogram buckets.
+"""
+_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+"""
+The fraction of requests profiled with cProfile (0 disables the hook) and the directory of the dumped profiles, which
+can be inspected with pstats or turned into flame graphs (e.g. with flameprof or snakeviz).
+"""
+_PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+_PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_collectors = []
+
+
+def _labels_key(labels) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def observe(name, value, **labels) -> None:
+    """
+    Adds an observation to a histogram.
+
+    :param name: (str)The histogram name.
+    :param value: (float)The observed value, in seconds.
+    :param labels: The histogram labels.
+    """
+    key = (name, _labels_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * (len(_BUCKETS) + 1), "sum": 0.0, "count": 0}
+        histogram["buckets"][bisect.bisect_left(_BUCKETS, value)] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def inc(name, amount=1, **labels) -> None:
+    """
+    Increments a counter.
+
+    :param name: (str)The counter name.
+    :param amount: (float)The increment.
+    :param labels: The counter labels.
+    """
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+@contextmanager
+def timed(stage):
+    """
+    Measures the wall time of a stage into the 'stage_seconds' histogram. Failed stages are counted by error class in
+    'stage_errors_total'.
+
+    :param stage: (str)The stage name.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as error:
+        inc("stage_errors_total", stage=stage, error=type(error).__name__)
+        raise
+    finally:
+        observe("stage_seconds", time.perf_counter() - start, stage=stage)
+
+
+def register_collector(collector) -> None:
+    """
+    Registers a function that is called on every rendering and returns gauges, as (name, labels, value) tuples.
+
+    :param collector: (callable)The collector.
+    """
+    _collectors.append(collector)
+
+
+def rss_bytes() -> int:
+    """
+    :return: (int)The resident set size of the current process, or its peak where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _format(name, labels, suffix="") -> str:
+    labels = labels + (("pid", str(os.getpid())),)
+    return f"{name}{suffix}{{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def render() -> str:
+    """
+    :return: (str)Every metric of the current process in the Prometheus text format.
+    """
+    lines = []
+    with _lock:
+        histograms = {key: {"buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]}
+                      for key, value in _histograms.items()}
+        counters = dict(_counters)
+
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(_BUCKETS + ["+Inf"], histogram["buckets"]):
+                cumulative += count
+                lines.append(f"{_format(name, labels + (('le', str(bound)),), '_bucket')} {cumulative}")
+            lines.append(f"{_format(name, labels, '_sum')} {histogram['sum']}")
+            lines.append(f"{_format(name, labels, '_count')} {histogram['count']}")
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {name} counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{_format(name, labels)} {value}")
+
+    gauges = [("process_resident_memory_bytes", {}, rss_bytes())]
+    for collector in _collectors:
+        gauges.extend(collector())
+    for name in sorted({name for name, _, _ in gauges}):
+        lines.append(f"# TYPE {name} gauge")
+        for metric, labels, value in gauges:
+            if metric == name:
+                lines.append(f"{_format(name, _labels_key(labels))} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def start_profile() -> cProfile.Profile | None:
+    """
+    Starts profiling the current request with a probability of PROFILE_SAMPLE_RATE.
+
+    :return: (cProfile.Profile | None)The running profiler, or None if the request is not sampled.
+    """
+    if _PROFILE_SAMPLE_RATE <= 0 or random.random() >= _PROFILE_SAMPLE_RATE:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active in this thread.
+        return None
+    return profiler
+
+
+def stop_profile(profiler, name) -> str:
+    """
+    Stops a profiler and dumps its statistics into PROFILE_DIR.
+
+    :param profiler: (cProfile.Profile)The running profiler.
+    :param name: (str)The name of the profiled request, e.g. its endpoint.
+    :return: (str)The path of the dumped profile.
+    """
+    profiler.disable()
+    os.makedirs(_PROFILE_DIR, exist_ok=True)
+    path = os.path.join(_PROFILE_DIR, f"{name}-{time.time_ns()}-{os.getpid()}.prof")
+    profiler.dump_stats(path)
+    return path
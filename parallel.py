@@ -0,0 +1,284 @@
+"""
+The multi-process execution layer of the brute-force search and of the offline jobs. The reference matrix is shared
+with a pool of worker processes instead of being pickled into every task: the memory-mapped snapshots (see snapshot)
+are mapped again by the workers from their file, and any other matrix is copied once into a named shared-memory
+segment. Every task searches a shard of contiguous rows, and the partial top-k results are merged by the caller.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import Knn
+
+"""
+The number of worker processes (0 uses every core), the smallest reference matrix that is split into shards (smaller
+ones are searched in the calling process), and the number of shared matrices a worker keeps attached.
+"""
+_WORKERS = int(os.environ.get("PARALLEL_WORKERS", 0))
+_MIN_ROWS = int(os.environ.get("PARALLEL_MIN_ROWS", 100000))
+_ATTACHED = 8
+
+_pools = {}
+_pools_lock = threading.Lock()
+_attached = OrderedDict()
+
+
+def workers(count=None) -> int:
+    """
+    :param count: (int)The requested number of worker processes, the PARALLEL_WORKERS setting by default.
+    :return: (int)The number of worker processes.
+    """
+    return max(1, count or _WORKERS or os.cpu_count() or 1)
+
+
+def get_pool(count=None) -> ProcessPoolExecutor:
+    """
+    Returns the process pool of the current process with the given number of workers, creating it on first use. The
+    workers are spawned rather than forked, so that pools can be used from threaded servers.
+
+    :param count: (int)The number of worker processes, see workers.
+    :return: (ProcessPoolExecutor)The process pool.
+    """
+    key = (os.getpid(), workers(count))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ProcessPoolExecutor(key[1], mp_context=multiprocessing.get_context("spawn"))
+    return pool
+
+
+@atexit.register
+def shutdown() -> None:
+    """
+    Shuts down the process pools of the current process.
+    """
+    with _pools_lock:
+        for (pid, _), pool in list(_pools.items()):
+            if pid == os.getpid():
+                pool.shutdown(cancel_futures=True)
+        _pools.clear()
+
+
+def shards(size, count) -> list:
+    """
+    :param size: (int)The number of rows.
+    :param count: (int)The number of shards.
+    :return: (list)The (start, stop) rows of every non-empty shard.
+    """
+    bounds = np.linspace(0, size, max(1, min(count, size)) + 1).astype(int)
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+class SharedArray:
+    """
+    A read-only matrix shared with the worker processes through a descriptor: a memory-mapped file is described by its
+    path and offset, and any other matrix is copied into a named shared-memory segment, which is unlinked on release.
+    """
+    def __init__(self, array) -> None:
+        """
+        Initializing class variables.
+
+        :param array: (np.ndarray)The shared matrix.
+        """
+        array = np.ascontiguousarray(array)
+        self._segment = None
+        mapped = _mapped_file(array)
+        if mapped is not None:
+            self.descriptor = ("file", mapped.filename, mapped.offset, array.shape, array.dtype.str)
+        else:
+            self._segment = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, array.dtype, buffer=self._segment.buf)[...] = array
+            self.descriptor = ("shm", self._segment.name, 0, array.shape, array.dtype.str)
+            self._finalizer = weakref.finalize(self, _release, self._segment)
+        self.shape = array.shape
+
+    def release(self) -> None:
+        """
+        Unlinks the shared-memory segment. The workers that still have it attached keep their mapping until they drop
+        it.
+        """
+        if self._segment is not None:
+            self._finalizer()
+
+
+def _mapped_file(array) -> np.memmap | None:
+    """
+    :param array: (np.ndarray)A matrix.
+    :return: (np.memmap | None)The memory-mapped file the whole matrix is a view of, if any.
+    """
+    base = array
+    while base is not None:
+        if isinstance(base, np.memmap) and base.filename is not None:
+            if base.shape == array.shape and base.ctypes.data == array.ctypes.data:
+                return base
+            return None
+        base = base.base
+    return None
+
+
+def _release(segment) -> None:
+    segment.close()
+    segment.unlink()
+
+
+def attach(descriptor) -> np.ndarray:
+    """
+    Attaches a shared matrix in a worker process. The last _ATTACHED matrices stay attached, so that the tasks over the
+    same matrix do not map it again.
+
+    :param descriptor: (tuple)The descriptor of a SharedArray.
+    :return: (np.ndarray)The read-only matrix.
+    """
+    entry = _attached.get(descriptor)
+    if entry is None:
+        kind, name, offset, shape, dtype = descriptor
+        if kind == "file":
+            entry = (None, np.memmap(name, dtype=np.dtype(dtype), mode="r", offset=offset, shape=shape))
+        else:
+            # The spawned workers share the resource tracker of the pool owner, so the registration of the segment is
+            # a no-op here and is dropped when the owner unlinks it (see SharedArray.release).
+            segment = shared_memory.SharedMemory(name=name)
+            array = np.ndarray(shape, np.dtype(dtype), buffer=segment.buf)
+            array.flags.writeable = False
+            entry = (segment, array)
+        _attached[descriptor] = entry
+        while len(_attached) > _ATTACHED:
+            segment, _ = _attached.popitem(last=False)[1]
+            if segment is not None:
+                segment.close()
+    _attached.move_to_end(descriptor)
+    return entry[1]
+
+
+def _search_shard(descriptor, start, stop, records, k, metric) -> tuple:
+    """
+    :param descriptor: (tuple)The descriptor of the shared reference matrix.
+    :param start: (int)The first row of the shard.
+    :param stop: (int)The row after the last one of the shard.
+    :param records: (np.ndarray)The central records, one per row.
+    :param k: (int)The number of neighbors to be calculated.
+    :param metric: (str)The distance metric, "euclidean" or "l1".
+    :return: (tuple)The top-k distances and indices (in the whole matrix) of the records within the shard.
+    """
+    return Knn.top_k(records, attach(descriptor)[start:stop], k, metric, offset=start)
+
+
+def _nearest_rows(rows, points, metric) -> np.ndarray:
+    """
+    :param rows: (np.ndarray)The rows to be assigned.
+    :param points: (np.ndarray)The points, one per row.
+    :param metric: (str)The distance metric, "euclidean" or "l1".
+    :return: (np.ndarray)The index of the closest point of every row.
+    """
+    step = max(1, Knn._CHUNK_SIZE * 16 // max(1, len(points)))
+    nearest = np.empty(len(rows), dtype=np.intp)
+    for start in range(0, len(rows), step):
+        nearest[start:start + step] = np.argmin(Knn.batch_distances(rows[start:start + step], points, metric), axis=1)
+    return nearest
+
+
+def _nearest_shard(descriptor, start, stop, points, metric) -> np.ndarray:
+    """
+    :param descriptor: (tuple)The descriptor of the shared matrix.
+    :param start: (int)The first row of the shard.
+    :param stop: (int)The row after the last one of the shard.
+    :param points: (np.ndarray)The points, one per row.
+    :param metric: (str)The distance metric, "euclidean" or "l1".
+    :return: (np.ndarray)The index of the closest point of every row of the shard.
+    """
+    return _nearest_rows(attach(descriptor)[start:stop], points, metric)
+
+
+class ShardedSearch:
+    """
+    An exact neighbour search engine that splits the reference matrix into a shard per worker process and merges the
+    per-shard top-k results. It pays off for batches of records (e.g. batch_scoring) over large reference sets; single
+    records and reference sets under PARALLEL_MIN_ROWS rows are searched in the calling process.
+    """
+    def __init__(self, data, labels, metric="euclidean", count=None) -> None:
+        """
+        Initializing class variables.
+
+        :param data: (np.ndarray)The reference records.
+        :param labels: (np.ndarray)The cluster label of each reference record.
+        :param metric: (str)The distance metric, "euclidean" or "l1".
+        :param count: (int)The number of worker processes, see workers.
+        """
+        self.local = Knn.BruteForceSearch(data, labels, metric)
+        self.labels = np.asarray(labels)
+        self.metric = metric
+        self.workers = workers(count)
+        self.shared = SharedArray(data) if self.workers > 1 and len(data) >= _MIN_ROWS else None
+
+    def query(self, record, k) -> tuple:
+        """
+        Finds the k reference records closest to the given one in the calling process (see Knn.BruteForceSearch).
+        """
+        return self.local.query(record, k)
+
+    def query_batch(self, records, k) -> tuple:
+        """
+        Finds the k reference records closest to each of the given records, searching every shard in a worker process.
+
+        :param records: (np.ndarray)The central records, one per row.
+        :param k: (int)The number of neighbors to be calculated.
+        :return: (tuple)Two matrices with the distances and the labels of the neighbors of each record in ascending
+        distance order; missing neighbors have an infinite distance.
+        """
+        if self.shared is None:
+            return self.local.query_batch(records, k)
+
+        records = np.asarray(records, dtype=np.float32)
+        pool = get_pool(self.workers)
+        futures = [pool.submit(_search_shard, self.shared.descriptor, start, stop, records, k, self.metric)
+                   for start, stop in shards(self.shared.shape[0], self.workers)]
+        results = [future.result() for future in futures]
+        best_dist, best_index = Knn.merge_top_k([dist for dist, _ in results], [index for _, index in results], k)
+        return best_dist, self.labels[best_index]
+
+
+def nearest(data, points, metric="euclidean", count=None) -> np.ndarray:
+    """
+    Assigns every row of a matrix to its closest point (e.g. the training records to their cluster representative),
+    splitting the rows into a shard per worker process.
+
+    :param data: (np.ndarray)The matrix.
+    :param points: (np.ndarray)The points, one per row.
+    :param metric: (str)The distance metric, "euclidean" or "l1".
+    :param count: (int)The number of worker processes, see workers.
+    :return: (np.ndarray)The index of the closest point of every row.
+    """
+    count = workers(count)
+    points = np.asarray(points, dtype=np.float64)
+    if count == 1 or len(data) < _MIN_ROWS:
+        return _nearest_rows(data, points, metric)
+
+    shared = SharedArray(data)
+    try:
+        pool = get_pool(count)
+        futures = [pool.submit(_nearest_shard, shared.descriptor, start, stop, points, metric)
+                   for start, stop in shards(len(data), count)]
+        return np.concatenate([future.result() for future in futures])
+    finally:
+        shared.release()
+
+
+def run_concurrently(function, arguments, count=None) -> list:
+    """
+    Runs independent jobs (e.g. the retraining of every heating source partition) in separate processes.
+
+    :param function: (callable)A module-level function.
+    :param arguments: (list)The argument tuple of every job.
+    :param count: (int)The number of concurrent jobs, one per job by default.
+    :return: (list)The result of every job, in the order of the arguments.
+    """
+    count = min(len(arguments), workers(count or len(arguments)))
+    if count <= 1:
+        return [function(*args) for args in arguments]
+    with ProcessPoolExecutor(count, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return [future.result() for future in [pool.submit(function, *args) for args in arguments]]
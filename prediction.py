@@ -0,0 +1,159 @@
+import Clusters
+import data_manipulation
+import lavoro_api_calls
+import metrics
+import reference_cache
+
+_LAVORO_UNAVAILABLE = "The lavoro service is currently unavailable, please try again later."
+
+
+class PredictionError(Exception):
+    """
+    An error caused by the prediction input, with the message shown to the user and the matching HTTP status code.
+    """
+    def __init__(self, message, status=400) -> None:
+        """
+        Initializing class variables.
+
+        :param message: (str)The notification message.
+        :param status: (int)The HTTP status code.
+        """
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def check_payload(payload) -> None:
+    """
+    :param payload: (dict)The prediction payload.
+    :raises PredictionError: If the payload is not a JSON object.
+    """
+    if not isinstance(payload, dict):
+        raise PredictionError("The payload should be a JSON object.")
+
+
+def lavoro_record(api_reply, consumption) -> dict:
+    """
+    Builds and validates the record of a lavoro dwelling.
+
+    :param api_reply: (json file)The lavoro API reply with the energy information, None if the ID is not valid.
+    :param consumption: (json file)The lavoro API reply with the energy consumption.
+    :return: (dict)The record.
+    """
+    if api_reply is None and consumption is None:
+        raise PredictionError("Wrong ID, please enter a valid one.", 404)
+    try:
+        record = data_manipulation.transform_data_API(api_reply, consumption)
+    except (KeyError, TypeError, ValueError):
+        raise PredictionError("An error occurred during the calculations, please try again later.", 502)
+
+    _validate(record)
+    return record
+
+
+def form_record(payload) -> dict:
+    """
+    Builds and validates the record of the data of both HTML forms, nested under 'form1' and 'form2' or combined in
+    a single object.
+
+    :param payload: (dict)The prediction payload.
+    :return: (dict)The record.
+    """
+    form1, form2 = payload.get("form1", payload), payload.get("form2", payload)
+    missing = [field for field in data_manipulation._FORM1_FIELDS if field not in form1] + \
+              [field for field in data_manipulation._FORM2_FIELDS if field not in form2]
+    if missing:
+        raise PredictionError(f"Missing fields: {', '.join(missing)}.")
+    try:
+        record = data_manipulation.transform_data(form1, form2)
+    except (KeyError, TypeError, ValueError, ZeroDivisionError) as error:
+        raise PredictionError(f"Invalid form data: {error}.")
+
+    _validate(record)
+    return record
+
+
+def _validate(record) -> None:
+    """
+    :param record: (dict)The record.
+    :raises PredictionError: If the record does not match the schema of data_manipulation.validate_record.
+    """
+    errors = data_manipulation.validate_record(record)
+    if errors:
+        raise PredictionError(" ".join(errors))
+
+
+def build_record(payload) -> tuple:
+    """
+    Builds the record to be classified from a prediction payload, which either contains a lavoro dwelling 'id', or the
+    data of both HTML forms (see form_record). Nothing is written to the database: the results page saves the records
+    of the forms submissions itself (see app.results).
+
+    :param payload: (dict)The prediction payload.
+    :return: (tuple)The record and its actual energy consumption.
+    """
+    check_payload(payload)
+
+    if "id" in payload:
+        try:
+            with metrics.timed("lavoro"):
+                api_reply, consumption = lavoro_api_calls.get_element(payload["id"])
+        except lavoro_api_calls.LavoroUnavailable:
+            raise PredictionError(_LAVORO_UNAVAILABLE, 503)
+        record = lavoro_record(api_reply, consumption)
+    else:
+        record = form_record(payload)
+
+    return record, record["Kwh/day/m2"]
+
+
+async def build_record_async(payload) -> tuple:
+    """
+    The asynchronous version of build_record, for the event loop of the ASGI application (see asgi_app): the lavoro
+    calls are awaited.
+
+    :param payload: (dict)The prediction payload.
+    :return: (tuple)The record and its actual energy consumption.
+    """
+    check_payload(payload)
+
+    if "id" in payload:
+        try:
+            with metrics.timed("lavoro"):
+                api_reply, consumption = await lavoro_api_calls.get_element_async(payload["id"])
+        except lavoro_api_calls.LavoroUnavailable:
+            raise PredictionError(_LAVORO_UNAVAILABLE, 503)
+        record = lavoro_record(api_reply, consumption)
+    else:
+        record = form_record(payload)
+
+    return record, record["Kwh/day/m2"]
+
+
+def predict_record(db, record, mode=None) -> dict:
+    """
+    Classifies a built record and collects everything the results page and the JSON API need.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param record: (dict)The record.
+    :param mode: (str)The classification mode (see Clusters.classify).
+    :return: (dict)The record, the predicted and actual consumption, the cluster label, the heating source, and the
+    data frame with all the data.
+    """
+    result = Clusters.predict(db, record, mode)
+    result.update({"record": record, "actual": record["Kwh/day/m2"],
+                   "data_frame": reference_cache.get_reference_set(db).data_frame})
+    return result
+
+
+def run_prediction(db, payload, mode=None) -> dict:
+    """
+    Runs the whole prediction pipeline for a payload (see build_record), independently of the HTTP session.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param payload: (dict)The prediction payload.
+    :param mode: (str)The classification mode (see Clusters.classify).
+    :return: (dict)The result of predict_record.
+    """
+    record, _ = build_record(payload)
+    return predict_record(db, record, mode)
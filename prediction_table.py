@@ -0,0 +1,211 @@
+"""
+Precomputed cluster labels for the household profiles of a dataset version. The form inputs are categorical or small
+integers, so the same encoded feature vectors come back again and again: their labels are looked up in a table
+materialized by the retraining job, and in a memo with least-recently-used eviction, before any neighbor search.
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from bson import Binary
+
+import Knn
+
+"""
+The collection that keeps the materialized tables, the largest number of profiles per table (the most frequent ones
+are kept), and the maximum number of memoized labels.
+"""
+_TABLE_COLLECTION = "prediction_table"
+_TABLE_LIMIT = int(os.environ.get("PREDICTION_TABLE_LIMIT", 100000))
+_MEMO_SIZE = int(os.environ.get("PREDICTION_MEMO_SIZE", 50000))
+
+"""
+How often (in seconds) a missing table is looked up again, e.g. while the retraining job is still saving it.
+"""
+_TABLE_CHECK_INTERVAL = float(os.environ.get("PREDICTION_TABLE_CHECK_INTERVAL", 30))
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def key_of(vector) -> bytes:
+    """
+    The key is the exact float32 vector the record is searched with, so that a record only ever gets the label the
+    exact search returns for it; a record that merely rounds onto a reference row may have another nearest neighbor.
+    The encoder computes the same float32 vector for the same form inputs, so repeated profiles still share a key.
+
+    :param vector: (np.ndarray)An encoded record.
+    :return: (bytes)The lookup key of the record.
+    """
+    # Adding 0 turns -0.0 into 0.0, which compare equal in the search.
+    return (np.asarray(vector, dtype=np.float32) + np.float32(0)).tobytes()
+
+
+class PredictionMemo:
+    """
+    A thread-safe memo with least-recently-used eviction for the labels of the classified profiles, keyed by the
+    dataset, its version, the classification mode and the profile key.
+    """
+    def __init__(self, size) -> None:
+        """
+        Initializing class variables.
+
+        :param size: (int)The maximum number of memoized labels.
+        """
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.table_hits = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build) -> int:
+        """
+        Returns the memoized label of the key, building and memoizing it on a miss.
+
+        :param key: (tuple)The memo key.
+        :param build: (callable)A function that classifies the profile.
+        :return: (int)The cluster label.
+        """
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+            self.misses += 1
+
+        label = build()
+        with self.lock:
+            self.items[key] = label
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+        return label
+
+    def nbytes(self) -> int:
+        """
+        :return: (int)The approximate memory footprint of the memoized labels in bytes.
+        """
+        with self.lock:
+            keys = list(self.items)
+        return sys.getsizeof(self.items) + sum(sys.getsizeof(key) + sys.getsizeof(key[-1]) for key in keys)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.items.clear()
+
+
+memo = PredictionMemo(_MEMO_SIZE)
+
+
+def build(reference, metric="euclidean", k=1, limit=_TABLE_LIMIT) -> dict:
+    """
+    Classifies the distinct profiles of a reference set, up to the 'limit' most frequent ones, with a single batched
+    neighbor query. Every profile is queried with its exact vector, so that its row is skipped as the record itself,
+    like the exact search does for the same record.
+
+    :param reference: (reference_cache.ReferenceSet)The reference set.
+    :param metric: (str)The distance metric, "euclidean" or "l1".
+    :param k: (int)The number of neighbors.
+    :param limit: (int)The largest number of profiles.
+    :return: (dict)The cluster label of every profile key.
+    """
+    if len(reference) == 0:
+        return {}
+
+    keys, counts = np.unique(reference.features + np.float32(0), axis=0, return_counts=True)
+    if len(keys) > limit:
+        keys = keys[np.argsort(-counts, kind="stable")[:limit]]
+
+    _, labels = reference.search_engine(metric).query_batch(keys, k)
+    return {key_of(key): int(Knn.vote(neighbor_labels)) for key, neighbor_labels in zip(keys, labels)}
+
+
+def save(db, table, version, dataset="Active_data") -> None:
+    """
+    Replaces the table of a dataset in the 'prediction_table' database collection.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param table: (dict)The cluster label of every profile key.
+    :param version: (int)The dataset version the table was built for.
+    :param dataset: (str)The dataset name.
+    """
+    db[_TABLE_COLLECTION].delete_many({"dataset": dataset})
+    documents = [{"dataset": dataset, "version": version, "key": Binary(key), "label": label}
+                 for key, label in table.items()]
+    for start in range(0, len(documents), 10000):
+        db[_TABLE_COLLECTION].insert_many(documents[start:start + 10000], ordered=False)
+
+
+def load(db, version, dataset="Active_data") -> dict:
+    """
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param version: (int)The dataset version.
+    :param dataset: (str)The dataset name.
+    :return: (dict)The table of the given dataset version, empty if it has not been built.
+    """
+    cursor = db[_TABLE_COLLECTION].find({"dataset": dataset, "version": version}, {"_id": 0, "key": 1, "label": 1})
+    return {bytes(document["key"]): document["label"] for document in cursor}
+
+
+def get_table(db, reference) -> dict:
+    """
+    Returns the cached table of a reference set, fetched once per dataset version. A missing table is looked up again
+    at most once every _TABLE_CHECK_INTERVAL seconds.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param reference: (reference_cache.ReferenceSet)The reference set.
+    :return: (dict)The cluster label of every profile key.
+    """
+    entry = _tables.get(reference.dataset)
+    if entry is not None and entry["version"] == reference.version and \
+            (entry["table"] or time.monotonic() - entry["checked_at"] < _TABLE_CHECK_INTERVAL):
+        return entry["table"]
+
+    with _tables_lock:
+        entry = _tables.get(reference.dataset)
+        if entry is None or entry["version"] != reference.version or \
+                (not entry["table"] and time.monotonic() - entry["checked_at"] >= _TABLE_CHECK_INTERVAL):
+            entry = {"version": reference.version, "table": load(db, reference.version, reference.dataset),
+                     "checked_at": time.monotonic()}
+            _tables[reference.dataset] = entry
+    return entry["table"]
+
+
+def lookup(db, reference, vector, mode, classify) -> int:
+    """
+    Returns the cluster label of an encoded record: from the materialized table in the exact mode, or else from the
+    memo, classifying the record only when it is missing from both.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param reference: (reference_cache.ReferenceSet)The reference set.
+    :param vector: (np.ndarray)The encoded record.
+    :param mode: (str)The classification mode.
+    :param classify: (callable)A function that classifies the record.
+    :return: (int)The cluster label.
+    """
+    key = key_of(vector)
+    if mode == "exact":
+        label = get_table(db, reference).get(key)
+        if label is not None:
+            with memo.lock:
+                memo.table_hits += 1
+            return label
+
+    return memo.get((reference.dataset, reference.version, mode, key), classify)
+
+
+def stats() -> dict:
+    """
+    :return: (dict)The table and memo hits, the misses, the hit rate, and the number of entries and approximate
+    memory footprint in bytes of the tables and the memo.
+    """
+    tables = [entry["table"] for entry in list(_tables.values())]
+    lookups = memo.table_hits + memo.hits + memo.misses
+    return {"table_hits": memo.table_hits, "memo_hits": memo.hits, "misses": memo.misses,
+            "hit_rate": (memo.table_hits + memo.hits) / lookups if lookups else 0.0,
+            "table_entries": sum(len(table) for table in tables),
+            "table_bytes": sum(sys.getsizeof(table) + sum(sys.getsizeof(key) for key in table) for table in tables),
+            "memo_entries": len(memo.items), "memo_bytes": memo.nbytes()}
@@ -0,0 +1,471 @@
+import asyncio
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from pymongo.errors import PyMongoError
+import cluster_stats
+import data_manipulation
+import database
+import Knn
+import metrics
+import snapshot
+
+"""
+Columns of the 'Active_data' records that are not part of the feature vector.
+"""
+_NON_FEATURE_COLUMNS = ["_id", "Kwh/day/m2", "Heating Source", "label"]
+
+"""
+The collection that keeps the generation stamp of every cached dataset and how often (in seconds) a worker compares
+its cached copy against it.
+"""
+_VERSION_COLLECTION = "dataset_version"
+_VERSION_CHECK_INTERVAL = float(os.environ.get("REFERENCE_VERSION_CHECK_INTERVAL", 5))
+
+"""
+The fields the cluster statistics are computed from.
+"""
+_STATS_PROJECTION = {"_id": 0, "Dwelling Grade": 1, "Heating Source": 1, "label": 1, "Kwh/day/m2": 1}
+
+_cache = {}
+_cache_lock = threading.Lock()
+_async_locks = {}
+_attributes_info = {"document": None, "checked_at": None}
+
+
+class ReferenceSet:
+    """
+    An immutable, in-memory copy of the 'Active_data' reference set (or of one of its heating source partitions)
+    with its precomputed feature matrix and per-cluster consumption statistics.
+    """
+    def __init__(self, data_frame, version, stats_documents=None, dataset="Active_data", features=None,
+                 shared=False) -> None:
+        """
+        Initializing class variables.
+
+        :param data_frame: (pandas.DataFrame)The records of the dataset.
+        :param version: (int)The dataset version the records were fetched at.
+        :param stats_documents: (list)The precomputed statistics of this version. They are computed from the records
+        when missing.
+        :param dataset: (str)The dataset name, see dataset_name.
+        :param features: (np.ndarray)The precomputed feature matrix of the records, if available.
+        :param shared: (bool)Whether the arrays are memory-mapped from a snapshot, i.e. shared with the other workers.
+        """
+        self.dataset = dataset
+        self.version = version
+        self.shared = shared
+        self.data_frame = data_frame
+        # Lets the consumers of the data frame (e.g. the plot cache) key their results by the dataset version.
+        self.data_frame.attrs["version"] = (dataset, version)
+        self.columns = [column for column in data_frame.columns if column not in _NON_FEATURE_COLUMNS]
+        self.column_index = {column: i for i, column in enumerate(self.columns)}
+
+        if features is None:
+            features = data_frame[self.columns].fillna(value=0).to_numpy(dtype=np.float32)
+        self.features = np.ascontiguousarray(features)
+        self.labels = data_frame["label"].to_numpy()
+        self.consumption = data_frame["Kwh/day/m2"].to_numpy(dtype=np.float64)
+        if stats_documents is None:
+            stats_documents = cluster_stats.compute(data_frame, version, dataset)
+        self.stats = cluster_stats.ClusterStats(stats_documents)
+        self.loaded_at = time.monotonic()
+        self._engines = {}
+        self._engines_lock = threading.Lock()
+        self._representatives = {}
+        self._encoder = None
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def search_engine(self, metric="euclidean", engine=None):
+        """
+        Returns the neighbour search engine over the feature matrix, building it on first use.
+
+        :param metric: (str)The distance metric, "euclidean" or "l1".
+        :param engine: (str)The engine type, see Knn.make_engine.
+        :return: (Knn.BruteForceSearch | Knn.TreeSearch)The search engine.
+        """
+        key = (metric, engine)
+        if key not in self._engines:
+            with self._engines_lock:
+                if key not in self._engines:
+                    self._engines[key] = Knn.make_engine(self.features, self.labels, metric, engine)
+        return self._engines[key]
+
+    def representatives(self, metric="euclidean") -> tuple:
+        """
+        Returns one representative per cluster, the point that minimizes the total distance from the cluster records
+        under the given metric: the centroid for "euclidean" and the coordinate-wise median for "l1".
+
+        :param metric: (str)The distance metric, "euclidean" or "l1".
+        :return: (tuple)The cluster labels and a matrix with the representative of each of them.
+        """
+        if metric not in self._representatives:
+            labels = np.unique(self.labels)
+            reduce = np.mean if metric == "euclidean" else np.median
+            points = np.stack([reduce(self.features[self.labels == label], axis=0) for label in labels])
+            self._representatives[metric] = (labels, points.astype(np.float32))
+        return self._representatives[metric]
+
+    def feature_encoder(self, attributes_info) -> data_manipulation.FeatureEncoder:
+        """
+        Returns the feature encoder aligned with the columns of the feature matrix, building it again whenever the
+        'attributes_info' document changes.
+
+        :param attributes_info: (dict)The min and max values of the numerical attributes.
+        :return: (data_manipulation.FeatureEncoder)The feature encoder.
+        """
+        encoder = self._encoder
+        if encoder is None or encoder.attributes_info is not attributes_info:
+            encoder = data_manipulation.FeatureEncoder(attributes_info, self.columns)
+            self._encoder = encoder
+        return encoder
+
+    def extended(self, documents, version, stats_documents=None):
+        """
+        Returns a new reference set with the given records appended. The existing feature matrix is reused, unless
+        the new records introduce attributes that are unknown to it.
+
+        :param documents: (list)The preprocessed and labeled records.
+        :param version: (int)The dataset version after the records were inserted.
+        :param stats_documents: (list)The statistics of the new version, computed from the records when missing.
+        :return: (ReferenceSet)The extended reference set.
+        """
+        data_frame = pd.concat([self.data_frame, pd.DataFrame(documents)], ignore_index=True)
+        features = None
+        if all(column in self.column_index or column in _NON_FEATURE_COLUMNS
+               for document in documents for column in document):
+            features = np.vstack([self.features] + [self.encode(document) for document in documents])
+        return ReferenceSet(data_frame, version, stats_documents, self.dataset, features)
+
+    def encode(self, record) -> np.ndarray:
+        """
+        Aligns a preprocessed record with the columns of the feature matrix. Attributes missing from the record are
+        filled with 0, like the missing values of the reference set; attributes unknown to the reference set are
+        ignored, since they add the same constant to the distance from every reference row.
+
+        :param record: (dict)A record processed by data_manipulation.preprocess_pipeline.
+        :return: (np.ndarray)The feature vector of the record.
+        """
+        vector = np.zeros(len(self.columns), dtype=np.float32)
+        for column, value in record.items():
+            index = self.column_index.get(column)
+            if index is not None and value is not None:
+                vector[index] = value
+        return vector
+
+
+def dataset_name(heating_source=None) -> str:
+    """
+    :param heating_source: (str)The heating source partition, "Yes" or "No". None stands for the whole collection.
+    :return: (str)The name under which the dataset is versioned and cached.
+    """
+    return "Active_data" if heating_source is None else f"Active_data:{heating_source}"
+
+
+def get_version(db, name="Active_data") -> int:
+    """
+    Returns the current generation stamp of a dataset.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param name: (str)The dataset name.
+    :return: (int)The dataset version, 0 if it has never been bumped.
+    """
+    document = db[_VERSION_COLLECTION].find_one({"_id": name})
+    return 0 if document is None else int(document["version"])
+
+
+def bump_version(db, name="Active_data") -> int:
+    """
+    Increases the generation stamp of a dataset, which makes every worker reload its cached copy.
+    It should be called by every job that modifies the dataset (e.g. Clusters.train_clustering_algorithm).
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param name: (str)The dataset name.
+    :return: (int)The new dataset version.
+    """
+    db[_VERSION_COLLECTION].update_one({"_id": name}, {"$inc": {"version": 1}}, upsert=True)
+    return get_version(db, name)
+
+
+def get_reference_set(db, heating_source=None) -> ReferenceSet:
+    """
+    Returns the cached reference set of the current worker, either the whole 'Active_data' collection or one of its
+    heating source partitions. Every dataset is loaded lazily, on its first request, and is refreshed independently:
+    its version is compared against the database at most once every _VERSION_CHECK_INTERVAL seconds, and the records
+    are fetched again only when it has changed. With shared snapshots (see snapshot.shared), the latest published
+    snapshot is served until the new version is published.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param heating_source: (str)The heating source partition, "Yes" or "No". None stands for the whole collection.
+    :return: (ReferenceSet)The cached reference set.
+    """
+    name = dataset_name(heating_source)
+    entry = _cache.get(name)
+    now = time.monotonic()
+    if entry is not None and now - entry["checked_at"] < _VERSION_CHECK_INTERVAL:
+        metrics.inc("reference_cache_total", result="hit")
+        return entry["reference"]
+
+    with _cache_lock:
+        entry = _cache.get(name)
+        if entry is not None and time.monotonic() - entry["checked_at"] < _VERSION_CHECK_INTERVAL:
+            return entry["reference"]
+
+        try:
+            version = get_version(db, name)
+        except PyMongoError:
+            # A cold worker serves the latest snapshot while the database is unreachable.
+            if entry is not None or snapshot.current_version(name) is None:
+                raise
+            version = snapshot.current_version(name)
+        if entry is None or entry["reference"].version != version:
+            reference = _snapshot_of(name, version, entry)
+            if reference is None:
+                metrics.inc("reference_cache_total", result="reload")
+                condition = {} if heating_source is None else {"Heating Source": heating_source}
+                data_frame = database.retrieve_data(db, "Active_data", condition, projection={"_id": 0})
+                reference = ReferenceSet(data_frame, version, cluster_stats.load(db, version, name), name)
+            entry = {"reference": reference}
+        else:
+            metrics.inc("reference_cache_total", result="checked")
+        entry["checked_at"] = time.monotonic()
+        _cache[name] = entry
+
+    return entry["reference"]
+
+
+async def get_reference_set_async(async_db, heating_source=None) -> ReferenceSet:
+    """
+    The asynchronous version of get_reference_set, for the event loop of the ASGI application (see asgi_app): the
+    version, the records and the statistics of a dataset are awaited from the asynchronous driver, and the snapshots are
+    read and the reference set is built on a worker thread, so that a reload neither blocks the event loop nor holds a
+    thread of the CPU-bound pool.
+
+    :param async_db: (motor.motor_asyncio.AsyncIOMotorDatabase)The asynchronous MongoDB database connection.
+    :param heating_source: (str)The heating source partition, "Yes" or "No". None stands for the whole collection.
+    :return: (ReferenceSet)The cached reference set.
+    """
+    name = dataset_name(heating_source)
+    entry = _cache.get(name)
+    if entry is not None and time.monotonic() - entry["checked_at"] < _VERSION_CHECK_INTERVAL:
+        metrics.inc("reference_cache_total", result="hit")
+        return entry["reference"]
+
+    async with _async_locks.setdefault(name, asyncio.Lock()):
+        entry = _cache.get(name)
+        if entry is not None and time.monotonic() - entry["checked_at"] < _VERSION_CHECK_INTERVAL:
+            return entry["reference"]
+
+        document = await async_db[_VERSION_COLLECTION].find_one({"_id": name})
+        version = 0 if document is None else int(document["version"])
+        if entry is not None and entry["reference"].version == version:
+            metrics.inc("reference_cache_total", result="checked")
+            confirm_version(name, version)
+            return entry["reference"]
+
+        reference = await asyncio.to_thread(_snapshot_of, name, version, entry)
+        if reference is None:
+            metrics.inc("reference_cache_total", result="reload")
+            condition = {} if heating_source is None else {"Heating Source": heating_source}
+            data_frame = await database.retrieve_data_async(async_db, "Active_data", condition, projection={"_id": 0})
+            stats_documents = await cluster_stats.load_async(async_db, version, name)
+            reference = await asyncio.to_thread(ReferenceSet, data_frame, version, stats_documents, name)
+        with _cache_lock:
+            _cache[name] = {"reference": reference, "checked_at": time.monotonic()}
+    return reference
+
+
+def _snapshot_of(name, version, entry) -> ReferenceSet | None:
+    """
+    :param name: (str)The dataset name, see dataset_name.
+    :param version: (int)The dataset version.
+    :param entry: (dict)The cache entry of the dataset, if any.
+    :return: (ReferenceSet | None)The reference set of the snapshot of this version or, with shared snapshots, of the
+    latest published one; None if the records have to be fetched from the database.
+    """
+    reference = from_snapshot(name, version)
+    if reference is None and snapshot.shared():
+        reference = _latest_snapshot(name, entry)
+    return reference
+
+
+def from_snapshot(name, version) -> ReferenceSet | None:
+    """
+    Loads a reference set from its memory-mapped snapshot (see snapshot), together with its neighbour indexes. The
+    'attributes_info' document of the snapshot is used until it is fetched from the database.
+
+    :param name: (str)The dataset name, see dataset_name.
+    :param version: (int)The dataset version.
+    :return: (ReferenceSet | None)The reference set, or None if there is no snapshot of this version.
+    """
+    if not snapshot.enabled():
+        return None
+    data = snapshot.read(name, version)
+    if data is None:
+        return None
+
+    reference = ReferenceSet(snapshot.data_frame(data), version, data["stats"], name, data["features"], shared=True)
+    reference._engines.update(data["engines"])
+    if _attributes_info["document"] is None and data["attributes_info"]:
+        _attributes_info["document"] = data["attributes_info"]
+    metrics.inc("reference_cache_total", result="snapshot")
+    return reference
+
+
+def _latest_snapshot(name, entry) -> ReferenceSet | None:
+    """
+    :param name: (str)The dataset name, see dataset_name.
+    :param entry: (dict)The cache entry of the dataset, if any.
+    :return: (ReferenceSet | None)The reference set of the latest published snapshot, the cached one if it is still the
+    latest, or None if the dataset has never been published.
+    """
+    published = snapshot.current_version(name)
+    if published is None:
+        return None
+    metrics.inc("reference_cache_total", result="stale")
+    if entry is not None and entry["reference"].shared and entry["reference"].version == published:
+        return entry["reference"]
+    return from_snapshot(name, published)
+
+
+def export_snapshot(db, heating_source=None, engines=()) -> str | None:
+    """
+    Writes the snapshot of the current version of a dataset.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param heating_source: (str)The heating source partition, "Yes" or "No". None stands for the whole collection.
+    :param engines: (list)The (metric, engine) pairs whose neighbour index is stored, see snapshot.write.
+    :return: (str | None)The snapshot directory, or None if snapshots are disabled.
+    """
+    if not snapshot.enabled():
+        return None
+    return snapshot.write(get_reference_set(db, heating_source), get_attributes_info(db), engines)
+
+
+def get_attributes_info(db) -> dict:
+    """
+    Returns the cached 'attributes_info' document, which is fetched again at most once every _VERSION_CHECK_INTERVAL
+    seconds. The cached object is replaced only when its content changes, so the encoders built from it stay valid.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :return: (dict)The min and max values of the numerical attributes.
+    """
+    checked_at = _attributes_info["checked_at"]
+    if checked_at is None or time.monotonic() - checked_at >= _VERSION_CHECK_INTERVAL:
+        document = db["attributes_info"].find_one()
+        if document != _attributes_info["document"]:
+            _attributes_info["document"] = document
+        _attributes_info["checked_at"] = time.monotonic()
+    return _attributes_info["document"]
+
+
+def get_feature_encoder(db, reference) -> data_manipulation.FeatureEncoder:
+    """
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param reference: (ReferenceSet)The reference set the records are encoded for.
+    :return: (data_manipulation.FeatureEncoder)The feature encoder of the reference set.
+    """
+    return reference.feature_encoder(get_attributes_info(db))
+
+
+def extend(db, heating_source, documents) -> int:
+    """
+    Bumps the version of a dataset after new records were inserted into it and appends them to the cached reference
+    set of the current worker, if there is one, instead of fetching every record again. The statistics of the new
+    version are stored, so that the other workers do not need to compute them.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :param heating_source: (str)The heating source partition, "Yes" or "No". None stands for the whole collection.
+    :param documents: (list)The preprocessed and labeled records that were inserted.
+    :return: (int)The new dataset version.
+    """
+    name = dataset_name(heating_source)
+    with _cache_lock:
+        version = bump_version(db, name)
+        entry = _cache.get(name)
+        if entry is not None:
+            reference = entry["reference"].extended(documents, version)
+            _cache[name] = {"reference": reference, "checked_at": time.monotonic()}
+            stats_documents = [dict(document) for document in reference.stats.documents]
+        else:
+            condition = {} if heating_source is None else {"Heating Source": heating_source}
+            data_frame = database.retrieve_data(db, "Active_data", condition, projection=_STATS_PROJECTION)
+            stats_documents = cluster_stats.compute(data_frame, version, name)
+        cluster_stats.save(db, stats_documents, name)
+    return version
+
+
+def invalidate(name=None) -> None:
+    """
+    Drops a cached reference set, so that the next request fetches its records again.
+
+    :param name: (str)The dataset name, see dataset_name. None drops every cached reference set.
+    """
+    with _cache_lock:
+        _attributes_info["checked_at"] = None
+        if name is None:
+            _cache.clear()
+        else:
+            _cache.pop(name, None)
+
+
+def confirm_version(name, version) -> None:
+    """
+    Records a dataset version read outside of get_reference_set (e.g. by an asynchronous driver): the cached reference
+    set is kept without checking the database again if it has the same version, and dropped otherwise.
+
+    :param name: (str)The dataset name, see dataset_name.
+    :param version: (int)The current dataset version.
+    """
+    with _cache_lock:
+        entry = _cache.get(name)
+        if entry is None:
+            return
+        if entry["reference"].version == version:
+            entry["checked_at"] = time.monotonic()
+        else:
+            del _cache[name]
+
+
+async def refresh_versions(async_db) -> None:
+    """
+    Compares the versions of every cached reference set against the database with a single asynchronous query, and
+    records them through confirm_version, so that the request path does not wait on the database.
+
+    :param async_db: (motor.motor_asyncio.AsyncIOMotorDatabase)The asynchronous MongoDB database connection.
+    """
+    names = list(_cache)
+    if not names:
+        return
+
+    versions = dict.fromkeys(names, 0)
+    async for document in async_db[_VERSION_COLLECTION].find({"_id": {"$in": names}}):
+        versions[document["_id"]] = int(document["version"])
+    for name, version in versions.items():
+        confirm_version(name, version)
+
+
+def start_change_stream_watcher(db) -> threading.Thread:
+    """
+    Starts a daemon thread that invalidates the cache as soon as the 'Active_data' or the version collection changes.
+    Change streams require a replica set; if they are not supported, the thread exits and the cache falls back to
+    polling the dataset version.
+
+    :param db: (pymongo.database)The MongoDB database connection.
+    :return: (threading.Thread)The watcher thread.
+    """
+    def watch() -> None:
+        pipeline = [{"$match": {"ns.coll": {"$in": ["Active_data", _VERSION_COLLECTION]}}}]
+        try:
+            with db.watch(pipeline) as stream:
+                for _ in stream:
+                    invalidate()
+        except Exception:
+            return
+
+    thread = threading.Thread(target=watch, name="reference-cache-watcher", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,171 @@
+"""
+Versioned on-disk snapshots of the reference sets, so that new workers start serving without pulling 'Active_data'
+from MongoDB. A snapshot holds the feature matrix, the labels and the consumption as .npy files, which are
+memory-mapped read-only so that the prefork workers of a host share their pages, together with the cluster statistics,
+the 'attributes_info' document of the feature encoder and the pickled neighbour index of the tree engines.
+
+Pointing SNAPSHOT_DIR to a tmpfs (e.g. /dev/shm/snapshots) keeps the arrays in shared memory. With SNAPSHOT_SHARED=1
+the workers of a host only ever attach to the published snapshots: a single loader process publishes every new dataset
+version (python Clusters.py publish), and the workers keep serving the previous snapshot until it does, instead of
+fetching a private copy of the records. The deleted versions stay mapped until their last reader drops them.
+
+Layout of SNAPSHOT_DIR:
+    <dataset>/v<version>/{features,labels,consumption,grades,heating}.npy, meta.json, index-<metric>-<engine>.pkl
+    <dataset>/current     the version of the latest complete snapshot
+"""
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+"""
+The snapshot directory (snapshots are disabled when empty, the default), the number of versions kept per dataset, and
+whether the workers serve the published snapshots only. The snapshots are keyed by dataset name and version only, so
+every database needs a directory of its own.
+"""
+_SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "")
+_SNAPSHOT_KEEP = int(os.environ.get("SNAPSHOT_KEEP", 2))
+_SNAPSHOT_SHARED = os.environ.get("SNAPSHOT_SHARED", "0") == "1"
+
+_HEATING_SOURCES = ["No", "Yes"]
+
+
+def enabled() -> bool:
+    return bool(_SNAPSHOT_DIR)
+
+
+def shared() -> bool:
+    return enabled() and _SNAPSHOT_SHARED
+
+
+def _dataset_dir(dataset) -> str:
+    return os.path.join(_SNAPSHOT_DIR, dataset.replace(":", "-"))
+
+
+def current_version(dataset) -> int | None:
+    """
+    :param dataset: (str)The dataset name.
+    :return: (int | None)The version of the latest complete snapshot of the dataset, or None if there is none.
+    """
+    try:
+        with open(os.path.join(_dataset_dir(dataset), "current"), encoding="utf-8") as current:
+            return int(current.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def write(reference, attributes_info, engines=()) -> str:
+    """
+    Writes the snapshot of a reference set. The files are written into a temporary directory that is renamed when
+    complete, and the 'current' pointer is replaced atomically, so that readers never see a partial snapshot.
+
+    :param reference: (reference_cache.ReferenceSet)The reference set.
+    :param attributes_info: (dict)The 'attributes_info' document the records are encoded with.
+    :param engines: (list)The (metric, engine) pairs whose neighbour index is stored, with None for the default
+    engine; brute-force engines have no index other than the feature matrix.
+    :return: (str)The snapshot directory.
+    """
+    dataset_dir = _dataset_dir(reference.dataset)
+    os.makedirs(dataset_dir, exist_ok=True)
+    target = os.path.join(dataset_dir, f"v{reference.version}")
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=dataset_dir)
+    try:
+        np.save(os.path.join(staging, "features.npy"), reference.features)
+        np.save(os.path.join(staging, "labels.npy"), np.asarray(reference.labels, dtype=np.int64))
+        np.save(os.path.join(staging, "consumption.npy"), reference.consumption)
+        np.save(os.path.join(staging, "grades.npy"),
+                reference.data_frame["Dwelling Grade"].to_numpy(dtype=np.float64))
+        heating = reference.data_frame["Heating Source"] if "Heating Source" in reference.data_frame else None
+        codes = np.full(len(reference), -1, dtype=np.int8)
+        if heating is not None:
+            for code, value in enumerate(_HEATING_SOURCES):
+                codes[(heating == value).to_numpy()] = code
+        np.save(os.path.join(staging, "heating.npy"), codes)
+
+        indexes = []
+        for metric, engine in engines:
+            search = reference.search_engine(metric, engine)
+            if hasattr(search, "tree"):
+                with open(os.path.join(staging, f"index-{metric}-{engine or 'default'}.pkl"), "wb") as index:
+                    pickle.dump(search, index, protocol=pickle.HIGHEST_PROTOCOL)
+                indexes.append([metric, engine])
+
+        meta = {"dataset": reference.dataset, "version": reference.version, "columns": reference.columns,
+                "stats": reference.stats.documents, "indexes": indexes,
+                "attributes_info": {key: value for key, value in (attributes_info or {}).items() if key != "_id"}}
+        with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as meta_file:
+            json.dump(meta, meta_file, default=str)
+
+        shutil.rmtree(target, ignore_errors=True)
+        os.rename(staging, target)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    pointer = os.path.join(dataset_dir, f".current-{os.getpid()}")
+    with open(pointer, "w", encoding="utf-8") as current:
+        current.write(str(reference.version))
+    os.replace(pointer, os.path.join(dataset_dir, "current"))
+    _prune(dataset_dir, reference.version)
+    return target
+
+
+def _prune(dataset_dir, version) -> None:
+    """
+    Deletes the oldest snapshots of a dataset, keeping the _SNAPSHOT_KEEP most recent ones.
+
+    :param dataset_dir: (str)The dataset directory.
+    :param version: (int)The current version.
+    """
+    versions = sorted(int(name[1:]) for name in os.listdir(dataset_dir) if name.startswith("v") and name[1:].isdigit())
+    for old in versions[:-_SNAPSHOT_KEEP]:
+        if old != version:
+            shutil.rmtree(os.path.join(dataset_dir, f"v{old}"), ignore_errors=True)
+
+
+def read(dataset, version) -> dict | None:
+    """
+    Memory-maps the snapshot of a dataset version.
+
+    :param dataset: (str)The dataset name.
+    :param version: (int)The dataset version.
+    :return: (dict | None)The metadata together with the memory-mapped arrays and the unpickled neighbour indexes, or
+    None if the snapshot does not exist.
+    """
+    directory = os.path.join(_dataset_dir(dataset), f"v{version}")
+    try:
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as meta_file:
+            snapshot = json.load(meta_file)
+        for name in ("features", "labels", "consumption", "grades", "heating"):
+            snapshot[name] = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        snapshot["engines"] = {}
+        for metric, engine in snapshot["indexes"]:
+            with open(os.path.join(directory, f"index-{metric}-{engine or 'default'}.pkl"), "rb") as index:
+                snapshot["engines"][(metric, engine)] = pickle.load(index)
+    except (OSError, ValueError, KeyError, pickle.UnpicklingError):
+        return None
+    return snapshot
+
+
+def data_frame(snapshot) -> pd.DataFrame:
+    """
+    Builds the data frame of a snapshot over its memory-mapped arrays: the feature columns, the 'label', the
+    'Kwh/day/m2', the 'Heating Source' and the 'Dwelling Grade' (in full precision, since the feature matrix is
+    float32). The frame is built in a single constructor call from the column views of the arrays, since adding
+    columns to it afterwards may consolidate its blocks into private copies.
+
+    :param snapshot: (dict)The snapshot of read.
+    :return: (pd.DataFrame)The records.
+    """
+    features = snapshot["features"]
+    columns = {column: features[:, i] for i, column in enumerate(snapshot["columns"])}
+    columns["Dwelling Grade"] = snapshot["grades"]
+    columns["label"] = snapshot["labels"]
+    columns["Kwh/day/m2"] = snapshot["consumption"]
+    codes = np.asarray(snapshot["heating"])
+    columns["Heating Source"] = np.where(codes >= 0, np.array(_HEATING_SOURCES, dtype=object)[np.maximum(codes, 0)],
+                                         None)
+    return pd.DataFrame(columns, copy=False)
@@ -0,0 +1,63 @@
+/*
+Draws the results page charts from the compact data of the /api/charts endpoint.
+*/
+const barColors = ["#9b0f00", "#c16434", "#dfa669", "#edc986"];
+const layoutBase = {
+   plot_bgcolor: "rgba(0,0,0,0)",
+   paper_bgcolor: "rgba(0,0,0,0)",
+   showlegend: false,
+   xaxis: {showgrid: false},
+};
+
+function drawSimilarDwellings(data) {
+   const edges = data.histogram.edges;
+   const counts = data.histogram.counts;
+   const highlight = data.highlight;
+
+   const colors = counts.map(() => "#9b0f00");
+   colors[highlight.actual_bin] = highlight.in_same_bin ? "#FEFEB4" : "#ffa600";
+   if (highlight.prediction_bin !== null) {
+      colors[highlight.prediction_bin] = "#FEFEB4";
+   }
+
+   const bars = {
+      type: "bar",
+      x: counts.map((_, i) => (edges[i] + edges[i + 1]) / 2),
+      y: counts,
+      width: counts.map((_, i) => edges[i + 1] - edges[i]),
+      marker: {color: colors, line: {color: "white", width: 1}},
+      hovertemplate: "%{y} dwellings<extra></extra>",
+   };
+   const kde = {type: "scatter", mode: "lines", x: data.kde.x, y: data.kde.y, line: {color: "#9e0142"},
+                hoverinfo: "skip"};
+
+   Plotly.newPlot("similar-dwellings-plot", [bars, kde], Object.assign({}, layoutBase, {
+      title: {text: "Distribution of electrical consumption of similar Dwellings", font: {size: 11}},
+      margin: {l: 40, r: 0, t: 30, b: 20},
+      bargap: 0,
+      yaxis: {showgrid: false, title: {text: "No of Dwellings"}},
+   }), {displayModeBar: false});
+}
+
+function drawAllDwellings(data) {
+   const bars = {
+      type: "bar",
+      x: data.dwelling_means.map((row) => row.dwelling),
+      y: data.dwelling_means.map((row) => row.kwhs),
+      marker: {color: barColors},
+   };
+
+   Plotly.newPlot("all-dwellings-plot", [bars], Object.assign({}, layoutBase, {
+      margin: {l: 0, r: 0, t: 0, b: 0},
+      yaxis: {showgrid: false, anchor: "x", title: {text: "Kwhs"}},
+   }), {displayModeBar: false});
+}
+
+function drawCharts(url) {
+   fetch(url)
+      .then((response) => response.json())
+      .then((data) => {
+         drawSimilarDwellings(data);
+         drawAllDwellings(data);
+      });
+}
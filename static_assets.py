@@ -0,0 +1,217 @@
+"""
+The build step and the serving of the static assets. The build copies 'static/' into STATIC_BUILD_DIR together with a
+fingerprinted copy of every asset (e.g. Css/base.<hash>.css, whose url() references point to the fingerprinted
+images and fonts) and precompressed .gz (and, if the 'brotli' package is installed, .br) variants of the text assets,
+and writes the manifest of the fingerprinted names.
+When the build exists, url_for('static', ...) links to the fingerprinted names, which are served with a long-lived,
+immutable Cache-Control, and every asset is served precompressed to the clients that accept it.
+
+Run from the repository root, before starting the application:
+    python static_assets.py
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+"""
+The build directory, the max-age (in seconds) of the assets that are not fingerprinted, and the max-age of the
+fingerprinted ones, whose content never changes under the same URL.
+"""
+_STATIC_BUILD_DIR = os.environ.get("STATIC_BUILD_DIR", os.path.join("build", "static"))
+_STATIC_MAX_AGE = int(os.environ.get("STATIC_MAX_AGE", 3600))
+_IMMUTABLE_MAX_AGE = 31536000
+
+"""
+The extensions of the assets that are precompressed (images are already compressed), and the content encodings of the
+precompressed variants in order of preference.
+"""
+_COMPRESSIBLE = (".css", ".js", ".svg", ".otf", ".ttf", ".json", ".txt")
+_ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+_MANIFEST = "manifest.json"
+_CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+_manifest = {}
+
+
+def _fingerprinted(path, content) -> str:
+    """
+    :param path: (str)The relative path of an asset.
+    :param content: (bytes)The content of the asset.
+    :return: (str)The path with the hash of the content before the extension.
+    """
+    root, extension = os.path.splitext(path)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:12]}{extension}"
+
+
+def _rewrite_css(path, content, manifest) -> bytes:
+    """
+    Points the relative url() references of a stylesheet to the fingerprinted assets.
+
+    :param path: (str)The relative path of the stylesheet.
+    :param content: (bytes)The stylesheet.
+    :param manifest: (dict)The fingerprinted path of every asset.
+    :return: (bytes)The rewritten stylesheet.
+    """
+    directory = os.path.dirname(path)
+
+    def replace(match) -> str:
+        reference = match.group(2)
+        if re.match(r"^([a-z]+:|/|#)", reference):
+            return match.group(0)
+        target = os.path.normpath(os.path.join(directory, reference)).replace(os.sep, "/")
+        if target not in manifest:
+            return match.group(0)
+        fingerprinted = os.path.relpath(manifest[target], directory or ".").replace(os.sep, "/")
+        return f"url({match.group(1)}{fingerprinted}{match.group(1)})"
+
+    return _CSS_URL.sub(replace, content.decode("utf-8")).encode("utf-8")
+
+
+def _compress(path) -> list:
+    """
+    Writes the precompressed variants of an asset, keeping only those that are smaller than the asset.
+
+    :param path: (str)The path of the asset.
+    :return: (list)The paths of the written variants.
+    """
+    with open(path, "rb") as asset:
+        content = asset.read()
+    variants = {".gz": gzip.compress(content, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+        variants[".br"] = brotli.compress(content, quality=11)
+    except ImportError:
+        pass
+
+    written = []
+    for suffix, compressed in variants.items():
+        if len(compressed) < len(content):
+            with open(path + suffix, "wb") as variant:
+                variant.write(compressed)
+            written.append(path + suffix)
+    return written
+
+
+def build(source="static", target=_STATIC_BUILD_DIR) -> dict:
+    """
+    Builds the static assets: copies them, writes a fingerprinted copy of each of them (the stylesheets last, since
+    their references are rewritten first) and the precompressed variants of the text assets, and the manifest.
+
+    :param source: (str)The static directory.
+    :param target: (str)The build directory, which is replaced.
+    :return: (dict)The manifest, the fingerprinted path of every asset.
+    """
+    shutil.rmtree(target, ignore_errors=True)
+    shutil.copytree(source, target)
+
+    assets = sorted(os.path.relpath(os.path.join(directory, name), source).replace(os.sep, "/")
+                    for directory, _, names in os.walk(source) for name in names)
+    manifest = {}
+    for path in sorted(assets, key=lambda asset: asset.endswith(".css")):
+        with open(os.path.join(source, path), "rb") as asset:
+            content = asset.read()
+        if path.endswith(".css"):
+            content = _rewrite_css(path, content, manifest)
+        manifest[path] = _fingerprinted(path, content)
+        with open(os.path.join(target, manifest[path]), "wb") as fingerprinted:
+            fingerprinted.write(content)
+
+    for path in assets:
+        if path.endswith(_COMPRESSIBLE):
+            _compress(os.path.join(target, path))
+            _compress(os.path.join(target, manifest[path]))
+
+    with open(os.path.join(target, _MANIFEST), "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(target=_STATIC_BUILD_DIR) -> dict | None:
+    """
+    :param target: (str)The build directory.
+    :return: (dict | None)The manifest of the build, or None if the assets were not built.
+    """
+    try:
+        with open(os.path.join(target, _MANIFEST), encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+
+
+def fingerprint(endpoint, values) -> None:
+    """
+    Replaces the asset path of the URLs of the 'static' endpoint with its fingerprinted path (see url_defaults).
+
+    :param endpoint: (str)The endpoint of the URL.
+    :param values: (dict)The URL values.
+    """
+    if endpoint == "static" and "filename" in values:
+        filename = values["filename"].lstrip("/")
+        values["filename"] = _manifest.get(filename, filename)
+
+
+def init_app(app, target=_STATIC_BUILD_DIR) -> None:
+    """
+    Serves the built assets, if any, instead of the 'static' directory: url_for('static', ...) returns the
+    fingerprinted URLs, and the 'static' endpoint serves the precompressed variants and the Cache-Control headers.
+    The 'STATIC_BUILD_ID' setting of the application identifies the build (e.g. in the ETags of the pages).
+
+    :param app: (Flask)The application.
+    :param target: (str)The build directory.
+    """
+    target = os.path.join(app.root_path, target)
+    manifest = load_manifest(target) or {}
+    _manifest.update(manifest)
+    fingerprints = set(manifest.values())
+    if manifest:
+        app.static_folder = target
+    app.config["STATIC_BUILD_ID"] = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode()).hexdigest()[:12] \
+        if manifest else "source"
+    app.url_defaults(fingerprint)
+
+    def send_static(filename):
+        """
+        Serves a static asset, precompressed if the client accepts one of its variants. The fingerprinted assets are
+        cacheable forever, the others for STATIC_MAX_AGE seconds.
+
+        :param filename: (str)The relative path of the asset.
+        :return: (Response)The asset.
+        """
+        for encoding, suffix in _ENCODINGS:
+            variant = safe_join(app.static_folder, filename + suffix)
+            if encoding in request.accept_encodings and variant is not None and os.path.isfile(variant):
+                response = send_from_directory(app.static_folder, filename + suffix,
+                                               mimetype=mimetypes.guess_type(filename)[0])
+                response.content_encoding = encoding
+                break
+        else:
+            response = send_from_directory(app.static_folder, filename)
+
+        response.vary.add("Accept-Encoding")
+        response.cache_control.public = True
+        if filename in fingerprints:
+            response.cache_control.max_age = _IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.max_age = _STATIC_MAX_AGE
+        return response
+
+    app.view_functions["static"] = send_static
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default="static")
+    parser.add_argument("--target", default=_STATIC_BUILD_DIR)
+    args = parser.parse_args()
+
+    built = build(args.source, args.target)
+    print(f"Built {len(built)} assets into {args.target}")
@@ -0,0 +1,12 @@
+import pytest
+import snapshot
+
+
+@pytest.fixture(autouse=True)
+def snapshot_dir(tmp_path, monkeypatch):
+    """
+    Writes the snapshots of every test into its own temporary directory, never into the SNAPSHOT_DIR of the host.
+    """
+    directory = tmp_path / "snapshots"
+    monkeypatch.setattr(snapshot, "_SNAPSHOT_DIR", str(directory))
+    return directory
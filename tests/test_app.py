@@ -0,0 +1,139 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("flask")
+pytest.importorskip("pandas")
+import app
+import database
+import reference_cache
+from benchmarks import synthetic_data
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    db = mongomock.MongoClient()["ThesisDB"]
+    synthetic_data.populate(db, 400)
+    reference_cache.invalidate()
+    saved = []
+    monkeypatch.setattr(database, "get_database", lambda: db)
+    monkeypatch.setattr(database, "save_data_record", lambda db, record: saved.append(record))
+    yield saved
+    reference_cache.invalidate()
+
+
+@pytest.fixture
+def payload():
+    return next(iter(synthetic_data.form_payloads(1, seed=2)))
+
+
+def test_api_predict_saves_nothing(saved, payload):
+    client = app.app.test_client()
+
+    for _ in range(3):
+        assert client.post("/api/predict", json=payload).status_code == 200
+
+    assert saved == []
+
+
+def test_results_saves_each_submission_once(saved, payload):
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session["form1_data"] = json.dumps(payload["form1"])
+        session["form2_data"] = json.dumps(payload["form2"])
+
+    first = client.get("/results")
+    assert first.status_code == 200 and len(saved) == 1
+    assert client.get("/results", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+    assert client.get("/results").status_code == 200
+    assert len(saved) == 1
+
+    with client.session_transaction() as session:
+        session.pop("submission_saved")
+    assert client.get("/results", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+    assert len(saved) == 1
+
+
+def test_metrics_scrape_imports_nothing():
+    script = textwrap.dedent("""
+        import sys
+        import app
+
+        reply = app.app.test_client().get("/metrics")
+        assert reply.status_code == 200, reply.status_code
+        loaded = [name for name in ("pandas", "sklearn", "matplotlib", "pymongo", "reference_cache", "database",
+                                    "Plot_generator") if app.loaded_module(name) is not None]
+        assert not loaded, loaded
+    """)
+    completed = subprocess.run([sys.executable, "-c", script], cwd=_ROOT, capture_output=True, text=True, timeout=120,
+                               env={**os.environ, "PYTHONPATH": _ROOT, "LAZY_IMPORTS": "1"})
+
+    assert completed.returncode == 0, completed.stderr
+
+
+def test_promotion_starts_once_per_process(monkeypatch):
+    started = []
+    monkeypatch.setattr(app, "_PROMOTION_INTERVAL", 60.0)
+    monkeypatch.setattr(app, "_schedulers", {})
+    monkeypatch.setattr(app.ingestion, "start_scheduler", lambda *args, **kwargs: started.append(kwargs["name"]))
+
+    app.start_promotion()
+    app.start_promotion()
+
+    assert started == ["promote-new-entries"]
+
+
+def test_api_predict_rejects_a_dwelling_without_consumption(saved, monkeypatch):
+    from benchmarks import lavoro_stub
+    monkeypatch.setattr(app.prediction.lavoro_api_calls, "get_element", lambda ID: (dict(lavoro_stub._META), None))
+
+    reply = app.app.test_client().post("/api/predict", json={"id": "dwelling"})
+
+    assert reply.status_code == 400
+    assert "'Kwh/day/m2' is missing." in reply.get_json()["error"]
+
+
+def test_api_predict_replies_json_on_unexpected_errors(saved, payload, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("unexpected")
+    monkeypatch.setattr(app.prediction, "predict_record", fail)
+
+    reply = app.app.test_client().post("/api/predict", json=payload)
+
+    assert reply.status_code == 500
+    assert reply.is_json and "error" in reply.get_json()
+
+
+def test_pages_without_session_data_are_cached_and_revalidated(payload, monkeypatch):
+    monkeypatch.setattr(app, "_page_cache", {})
+    client = app.app.test_client()
+
+    first = client.get("/form_page1")
+    assert first.status_code == 200 and first.cache_control.private and first.cache_control.no_cache
+    assert "Form1.html" in app._page_cache
+    assert client.get("/form_page1", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+
+    with client.session_transaction() as session:
+        session["form1_data"] = json.dumps(payload["form1"])
+    filled = client.get("/form_page1", headers={"If-None-Match": first.headers["ETag"]})
+    assert filled.status_code == 200 and filled.headers["ETag"] != first.headers["ETag"]
+
+
+def test_results_etag_changes_with_the_dataset_version(saved, payload, monkeypatch):
+    monkeypatch.setattr(reference_cache, "_VERSION_CHECK_INTERVAL", 0)
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session["form1_data"] = json.dumps(payload["form1"])
+        session["form2_data"] = json.dumps(payload["form2"])
+    etag = client.get("/results").headers["ETag"]
+
+    reference_cache.bump_version(database.get_database(), reference_cache.dataset_name())
+
+    reply = client.get("/results", headers={"If-None-Match": etag})
+    assert reply.status_code == 200 and reply.headers["ETag"] != etag
@@ -0,0 +1,61 @@
+import io
+import json
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("flask")
+import app
+import batch_scoring
+import data_manipulation
+import database
+import reference_cache
+from benchmarks import synthetic_data
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = mongomock.MongoClient()["ThesisDB"]
+    synthetic_data.populate(db, 400)
+    reference_cache.invalidate()
+    monkeypatch.setattr(database, "get_database", lambda: db)
+    yield db
+    reference_cache.invalidate()
+
+
+def _records(count=3) -> list:
+    return [dict(data_manipulation.transform_data(payload["form1"], payload["form2"]), id=i)
+            for i, payload in enumerate(synthetic_data.form_payloads(count, seed=4))]
+
+
+def test_malformed_lines_are_read_as_errors():
+    lines = [json.dumps({"id": 1, "Bedrooms": "2"}), "{not json", "[1, 2]", json.dumps({"id": 4, "Bedrooms": "two"})]
+
+    records = list(batch_scoring.read_records(io.StringIO("\n".join(lines) + "\n"), "jsonl"))
+
+    assert records[0] == {"id": 1, "Bedrooms": 2.0}
+    assert [batch_scoring._READ_ERROR in record for record in records] == [False, True, True, True]
+    assert records[3]["id"] == 4
+
+
+def test_malformed_csv_values_are_read_as_errors():
+    stream = io.StringIO("id,Bedrooms\n1,2\n2,many\n3,4\n")
+
+    records = list(batch_scoring.read_records(stream, "csv"))
+
+    assert [record.get(batch_scoring._READ_ERROR) is None for record in records] == [True, False, True]
+    assert records[1]["id"] == "2"
+
+
+def test_batch_endpoint_reports_malformed_lines_and_keeps_streaming(db):
+    records = _records()
+    body = "\n".join([json.dumps(records[0]), "{not json", json.dumps(dict(records[1], Bedrooms="two")),
+                      json.dumps(records[2])]) + "\n"
+
+    reply = app.app.test_client().post("/api/predict/batch", data=body, content_type="application/x-ndjson")
+
+    lines = [json.loads(line) for line in reply.get_data(as_text=True).splitlines()]
+    assert reply.status_code == 200
+    assert ["label" in line for line in lines[:4]] == [True, False, False, True]
+    assert lines[1]["error"].startswith("Invalid JSON line")
+    assert lines[2]["id"] == 1 and lines[2]["error"].startswith("Invalid record")
+    assert lines[4]["summary"]["records"] == 4
@@ -0,0 +1,68 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("pandas")
+import Clusters
+import data_manipulation
+import Knn
+import reference_cache
+from benchmarks import synthetic_data
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient()["ThesisDB"]
+    synthetic_data.populate(db, 400)
+    reference_cache.invalidate()
+    yield db
+    reference_cache.invalidate()
+
+
+@pytest.mark.parametrize("metric, reduce", [("euclidean", np.mean), ("l1", np.median)])
+def test_representatives_minimize_the_distance_under_the_metric(db, metric, reduce):
+    reference = reference_cache.get_reference_set(db, "No")
+
+    labels, points = reference.representatives(metric)
+
+    assert list(labels) == sorted(set(reference.labels))
+    for label, point in zip(labels, points):
+        np.testing.assert_allclose(point, reduce(reference.features[reference.labels == label], axis=0), rtol=1e-5)
+
+
+def test_centroid_mode_picks_the_closest_representative(db):
+    reference = reference_cache.get_reference_set(db, "No")
+    labels, points = reference.representatives("euclidean")
+
+    for label, point in zip(labels, points):
+        assert Clusters.classify(reference, point + np.float32(1e-3), "centroid") == (label, False)
+
+
+def test_hybrid_mode_falls_back_to_the_exact_search_between_two_representatives(db):
+    reference = reference_cache.get_reference_set(db, "No")
+    labels, points = reference.representatives("euclidean")
+    engine = reference.search_engine("euclidean")
+
+    assert Clusters.classify(reference, points[0], "hybrid") == (labels[0], False)
+    between = (points[0] + points[1]) / 2
+    label, exact_used = Clusters.classify(reference, between, "hybrid")
+    assert exact_used
+    assert label == Knn.Knn(record=between, k=Clusters._NUMBER_OF_NEIGHBORS, engine=engine)
+
+
+def test_agreement_rate_of_the_replayed_entries(db):
+    entries = [data_manipulation.transform_data(payload["form1"], payload["form2"])
+               for payload in synthetic_data.form_payloads(20, seed=2)]
+    db["New_entries"].insert_many(entries)
+
+    assert Clusters.agreement_rate(db, "exact") == {"records": 20, "agreement": 1.0, "fallback": 1.0}
+    report = Clusters.agreement_rate(db, "centroid")
+    assert report["records"] == 20 and report["fallback"] == 0.0
+    assert 0.0 <= report["agreement"] <= 1.0
+
+
+def test_unknown_mode_is_rejected(db):
+    reference = reference_cache.get_reference_set(db, "No")
+
+    with pytest.raises(ValueError):
+        Clusters.classify(reference, reference.features[0], "fastest")
@@ -0,0 +1,49 @@
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+pd = pytest.importorskip("pandas")
+import cluster_stats
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()["ThesisDB"]
+
+
+def _documents(version, records=40) -> list:
+    data_frame = pd.DataFrame({"Dwelling Grade": [float(i % 3) for i in range(records)],
+                               "Heating Source": ["Yes" if i % 2 else "No" for i in range(records)],
+                               "label": [i % 4 for i in range(records)],
+                               "Kwh/day/m2": [0.1 + i / records for i in range(records)]})
+    return cluster_stats.compute(data_frame, version)
+
+
+def test_save_replaces_the_previous_version(db):
+    cluster_stats.save(db, _documents(1))
+    cluster_stats.save(db, _documents(2))
+
+    assert cluster_stats.load(db, 1) is None
+    assert sorted(document["_id"] for document in cluster_stats.load(db, 2)) == \
+        sorted(document["_id"] for document in _documents(2))
+    stats = cluster_stats.ClusterStats(cluster_stats.load(db, 2))
+    assert stats.cluster(3, "Yes")["count"] == 10
+
+
+def test_an_interrupted_save_keeps_the_previous_version(db, monkeypatch):
+    cluster_stats.save(db, _documents(1))
+    collection = db[cluster_stats._STATS_COLLECTION]
+
+    # The job dies after writing part of the statistics of the new version.
+    def die(documents, *args, **kwargs):
+        collection.insert_one(documents[0])
+        raise RuntimeError("killed")
+    monkeypatch.setattr(type(collection), "insert_many", lambda self, *args, **kwargs: die(*args, **kwargs))
+    with pytest.raises(RuntimeError):
+        cluster_stats.save(db, _documents(2))
+    monkeypatch.undo()
+
+    assert len(cluster_stats.load(db, 1)) == len(_documents(1))
+    assert cluster_stats.load(db, 2) is None
+
+    cluster_stats.save(db, _documents(2))
+    assert len(cluster_stats.load(db, 2)) == len(_documents(2))
@@ -0,0 +1,89 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("pandas")
+import data_manipulation
+import reference_cache
+from benchmarks import synthetic_data
+
+
+def _records(count=5) -> list:
+    return [data_manipulation.transform_data(payload["form1"], payload["form2"])
+            for payload in synthetic_data.form_payloads(count, seed=3)]
+
+
+def test_constant_attributes_encode_as_zero():
+    records = _records()
+    columns = data_manipulation._NUMERICAL_LABELS
+    attributes_info = {attribute: {"min": 0.0, "max": 10.0} for attribute in columns}
+    attributes_info["Bedrooms"] = {"min": 2.0, "max": 2.0}
+    records[0]["Bedrooms"] = 40
+
+    matrix = data_manipulation.FeatureEncoder(attributes_info, columns).encode_batch(records)
+
+    assert np.isfinite(matrix).all()
+    assert (matrix[:, columns.index("Bedrooms")] == 0).all()
+
+
+def test_encoder_matches_the_preprocess_pipeline():
+    records = _records()
+    columns = data_manipulation._NUMERICAL_LABELS
+    attributes_info = {attribute: {"min": 0.0, "max": 10.0} for attribute in columns}
+    attributes_info["Occupants"] = {"min": 3.0, "max": 3.0}
+    db = mongomock.MongoClient()["ThesisDB"]
+    db["attributes_info"].insert_one(dict(attributes_info))
+
+    matrix = data_manipulation.FeatureEncoder(attributes_info, columns).encode_batch(records)
+
+    for row, record in zip(matrix, records):
+        record = dict(record)
+        data_manipulation.preprocess_pipeline(db, record)
+        assert np.allclose(row, [record[column] for column in columns])
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient()["ThesisDB"]
+    synthetic_data.populate(db, 200)
+    reference_cache.invalidate()
+    yield db
+    reference_cache.invalidate()
+
+
+def test_encoder_is_aligned_with_the_reference_columns(db):
+    reference = reference_cache.get_reference_set(db, "No")
+    encoder = reference_cache.get_feature_encoder(db, reference)
+    records = _records(20)
+
+    matrix = encoder.encode_batch(records)
+
+    for row, record in zip(matrix, records):
+        processed = dict(record)
+        data_manipulation.preprocess_pipeline(db, processed)
+        np.testing.assert_allclose(row, reference.encode(processed), rtol=1e-6)
+        np.testing.assert_array_equal(encoder.encode(record), row)
+
+
+def test_unknown_onehot_values_are_ignored(db):
+    reference = reference_cache.get_reference_set(db, "No")
+    encoder = reference_cache.get_feature_encoder(db, reference)
+    record = _records(1)[0]
+    unknown = dict(record, Income="Unknown")
+
+    columns = [i for i, column in enumerate(encoder.columns) if column.startswith("Income_")]
+    assert not encoder.encode(unknown)[columns].any()
+    assert encoder.encode(record)[columns].sum() == 1
+
+
+def test_encoder_is_rebuilt_when_the_attributes_info_changes(db, monkeypatch):
+    monkeypatch.setattr(reference_cache, "_VERSION_CHECK_INTERVAL", 0)
+    reference = reference_cache.get_reference_set(db, "No")
+    encoder = reference_cache.get_feature_encoder(db, reference)
+    assert reference_cache.get_feature_encoder(db, reference) is encoder
+
+    db["attributes_info"].update_one({}, {"$set": {"Bedrooms.max": 100.0}})
+
+    rebuilt = reference_cache.get_feature_encoder(db, reference)
+    assert rebuilt is not encoder
+    assert rebuilt.attributes_info["Bedrooms"]["max"] == 100.0
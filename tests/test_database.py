@@ -0,0 +1,27 @@
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+pd = pytest.importorskip("pandas")
+import database
+
+
+def test_retrieve_data_reads_mongomock_through_a_cursor():
+    db = mongomock.MongoClient()["ThesisDB"]
+    db["Active_data"].insert_many([{"Kwh/day/m2": 0.5 + row, "Dwelling Grade": "A", "Rooms": row}
+                                   for row in range(25)])
+
+    data_frame = database.retrieve_data(db, "Active_data", projection={"_id": 0}, batch_size=10)
+
+    assert len(data_frame) == 25
+    assert list(data_frame.columns) == ["Kwh/day/m2", "Dwelling Grade", "Rooms"]
+    assert data_frame["Rooms"].dtype == "int64"
+    assert data_frame["Kwh/day/m2"].tolist() == [0.5 + row for row in range(25)]
+
+
+def test_retrieve_data_filters_by_condition():
+    db = mongomock.MongoClient()["ThesisDB"]
+    db["Active_data"].insert_many([{"Heating Source": source, "Kwh/day/m2": 1.0} for source in "YNYN"])
+
+    data_frame = database.retrieve_data(db, "Active_data", {"Heating Source": "Y"}, {"_id": 0})
+
+    assert data_frame["Heating Source"].tolist() == ["Y", "Y"]
@@ -0,0 +1,53 @@
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+from pymongo.errors import BulkWriteError
+import ingestion
+
+
+class FlakyCollection:
+    def __init__(self, errors) -> None:
+        self.errors = list(errors)
+        self.attempts = 0
+
+    def insert_many(self, documents, ordered=True):
+        self.attempts += 1
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+@pytest.fixture
+def write_queue(monkeypatch):
+    monkeypatch.setattr(ingestion.time, "sleep", lambda seconds: None)
+    write_queue = ingestion.WriteBehindQueue(mongomock.MongoClient()["ThesisDB"])
+    yield write_queue
+    write_queue.close()
+
+
+def test_duplicates_of_a_retried_batch_count_as_written(write_queue):
+    write_queue.collection = FlakyCollection([BulkWriteError({"writeErrors": [{"code": 11000}],
+                                                              "writeConcernErrors": []})])
+
+    write_queue._write([{"a": 1}, {"a": 2}])
+
+    assert write_queue.collection.attempts == 1
+    assert (write_queue.written, write_queue.failed) == (2, 0)
+
+
+def test_write_concern_errors_are_retried(write_queue):
+    write_queue.collection = FlakyCollection([BulkWriteError({"writeErrors": [],
+                                                              "writeConcernErrors": [{"code": 64}]})])
+
+    write_queue._write([{"a": 1}, {"a": 2}])
+
+    assert write_queue.collection.attempts == 2
+    assert (write_queue.written, write_queue.failed) == (2, 0)
+
+
+def test_batch_is_dropped_after_the_last_attempt(write_queue):
+    write_queue.collection = FlakyCollection([BulkWriteError({"writeErrors": [], "writeConcernErrors": [{}]})]
+                                             * ingestion._RETRIES)
+
+    write_queue._write([{"a": 1}])
+
+    assert (write_queue.written, write_queue.failed) == (0, 1)
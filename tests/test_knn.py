@@ -0,0 +1,122 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+import Knn
+
+
+def _data(seed=0, rows=500, columns=8) -> tuple:
+    rng = np.random.default_rng(seed)
+    data = rng.random((rows, columns), dtype=np.float32)
+    # Duplicate rows, which are skipped as the record itself.
+    data[10:15] = data[0]
+    return data, rng.integers(0, 4, rows)
+
+
+def _expected(record, data, k, metric) -> np.ndarray:
+    diff = data.astype(np.float64) - record.astype(np.float64)
+    dist = np.sqrt((diff ** 2).sum(axis=1)) if metric == "euclidean" else np.abs(diff).sum(axis=1)
+    return np.sort(dist[dist > 0])[:k]
+
+
+@pytest.mark.parametrize("engine", ["brute", "kd_tree", "ball_tree"])
+@pytest.mark.parametrize("metric", ["euclidean", "l1"])
+def test_engines_find_the_exact_neighbors(engine, metric):
+    if engine != "brute":
+        pytest.importorskip("sklearn")
+    data, labels = _data()
+    search = Knn.make_engine(data, labels, metric, engine)
+
+    for record in data[:20]:
+        dist, neighbor_labels = search.query(record, 5)
+        np.testing.assert_allclose(dist, _expected(record, data, 5, metric), rtol=1e-5)
+        assert len(neighbor_labels) == 5
+
+
+@pytest.mark.parametrize("engine", ["brute", "kd_tree", "ball_tree"])
+@pytest.mark.parametrize("metric", ["euclidean", "l1"])
+def test_batch_queries_match_single_queries(engine, metric):
+    if engine != "brute":
+        pytest.importorskip("sklearn")
+    data, labels = _data()
+    search = Knn.make_engine(data, labels, metric, engine)
+
+    dist, neighbor_labels = search.query_batch(data[:20], 3)
+    for row, record in enumerate(data[:20]):
+        row_dist, row_labels = search.query(record, 3)
+        np.testing.assert_allclose(dist[row], row_dist, rtol=1e-5)
+        assert list(neighbor_labels[row]) == list(row_labels)
+
+
+def test_the_record_itself_is_skipped():
+    data = np.array([[0, 0], [0, 0], [1, 0], [3, 0]], dtype=np.float32)
+    labels = np.array([0, 0, 1, 2])
+
+    assert Knn.Knn(record=data[0], k=1, data=data, labels=labels) == 1
+    dist, _ = Knn.BruteForceSearch(data, labels).query_batch(data[:1], 4)
+    assert list(dist[0]) == [1.0, 3.0, np.inf, np.inf]
+
+
+def test_matches_the_heap_implementation():
+    data, labels = _data(seed=1)
+
+    for record in data[:50]:
+        assert Knn.Knn(record=record, k=3, data=data, labels=labels) == Knn.heap_Knn(record, 3, data, labels)
+
+
+def test_unknown_metric_and_engine_are_rejected():
+    data, labels = _data()
+
+    with pytest.raises(ValueError):
+        Knn.distances(data[0], data, "cosine")
+    with pytest.raises(ValueError):
+        Knn.make_engine(data, labels, engine="annoy")
+
+
+@pytest.mark.parametrize("metric", ["euclidean", "l1"])
+def test_ivf_scanning_every_list_is_exact(metric):
+    data, labels = _data()
+    search = Knn.IVFSearch(data, labels, metric, n_lists=8, n_probes=8)
+
+    for record in data[:20]:
+        dist, _ = search.query(record, 3)
+        np.testing.assert_allclose(dist, _expected(record, data, 3, metric), rtol=1e-5)
+
+
+@pytest.mark.parametrize("metric", ["euclidean", "l1"])
+def test_ivf_recall_grows_with_the_scanned_lists(metric):
+    data, labels = _data(seed=2, rows=4000)
+    queries = np.random.default_rng(3).random((100, data.shape[1]), dtype=np.float32)
+    exact = Knn.BruteForceSearch(data, labels, metric)
+    search = Knn.IVFSearch(data, labels, metric, n_lists=32)
+
+    recall = []
+    for n_probes in [1, 4, 32]:
+        search.n_probes = n_probes
+        recall.append(np.mean([np.isclose(search.query(query, 1)[0][0], exact.query(query, 1)[0][0])
+                               for query in queries]))
+    assert recall[0] <= recall[1] <= recall[2] == 1.0
+    assert recall[1] >= 0.5
+
+
+def test_ivf_scans_more_lists_when_the_probed_ones_are_short():
+    data, labels = _data(rows=64)
+    search = Knn.IVFSearch(data, labels, n_lists=16, n_probes=1)
+
+    dist, neighbor_labels = search.query_batch(data[:5], 10)
+
+    assert np.isfinite(dist).all()
+    assert neighbor_labels.shape == (5, 10)
+
+
+def test_approximate_classification_uses_the_ivf_engine():
+    pytest.importorskip("pandas")
+    import Clusters
+
+    class Reference:
+        def search_engine(self, metric="euclidean", engine=None):
+            assert engine == "ivf"
+            return Knn.IVFSearch(*_data(), metric, n_lists=4, n_probes=4)
+
+    data, labels = _data()
+    label, exact_used = Clusters.classify(Reference(), data[0], "approximate")
+    assert label == Knn.Knn(record=data[0], k=1, data=data, labels=labels) and not exact_used
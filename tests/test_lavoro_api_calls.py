@@ -0,0 +1,128 @@
+import asyncio
+import time
+import pytest
+
+pytest.importorskip("requests")
+import lavoro_api_calls
+from benchmarks import lavoro_stub
+
+
+@pytest.fixture(scope="module")
+def stub():
+    server = lavoro_stub.start_stub()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def client(stub, monkeypatch):
+    monkeypatch.setattr(lavoro_api_calls, "_BASE_URL", stub)
+    monkeypatch.setattr(lavoro_api_calls, "_TIMEOUT", (1.0, 0.5))
+    monkeypatch.setattr(lavoro_api_calls, "_RETRIES", 0)
+    monkeypatch.setattr(lavoro_api_calls, "breaker", lavoro_api_calls.CircuitBreaker(2, 0.5))
+    monkeypatch.setattr(lavoro_api_calls, "_clients", {})
+    monkeypatch.setattr(lavoro_api_calls, "_async_clients", {})
+    monkeypatch.setattr(lavoro_stub.StubHandler, "latency", 0.1)
+    monkeypatch.setattr(lavoro_stub.StubHandler, "delay", 1.0)
+    monkeypatch.setattr(lavoro_stub.StubHandler, "calls", {"meta": 0, "consumption": 0})
+    lavoro_api_calls.meta_cache.clear()
+    yield
+    lavoro_api_calls.meta_cache.clear()
+
+
+def _open_circuit() -> None:
+    for _ in range(2):
+        with pytest.raises(lavoro_api_calls.LavoroUnavailable):
+            lavoro_api_calls.get_element("broken")
+    assert lavoro_api_calls.breaker.state == "open"
+
+
+def test_calls_run_concurrently():
+    start = time.perf_counter()
+    meta, consumption = lavoro_api_calls.get_element("home-1")
+
+    assert meta == lavoro_stub._META
+    assert consumption == 0.042
+    assert time.perf_counter() - start < 2 * lavoro_stub.StubHandler.latency
+
+
+def test_meta_reply_is_cached():
+    lavoro_api_calls.get_element("home-1")
+    lavoro_api_calls.get_element("home-1")
+
+    assert lavoro_stub.StubHandler.calls == {"meta": 1, "consumption": 2}
+
+
+def test_unknown_id_returns_nones():
+    assert lavoro_api_calls.get_element("missing") == (None, None)
+    assert lavoro_api_calls.breaker.state == "closed"
+
+
+def test_read_timeout_is_enforced():
+    start = time.perf_counter()
+    with pytest.raises(lavoro_api_calls.LavoroUnavailable):
+        lavoro_api_calls.get_element("slow")
+
+    assert time.perf_counter() - start < lavoro_stub.StubHandler.delay
+
+
+def test_reply_that_is_not_json_counts_as_a_failure():
+    with pytest.raises(lavoro_api_calls.LavoroUnavailable):
+        lavoro_api_calls.get_element("garbage")
+
+    assert lavoro_api_calls.breaker.failures == 1
+
+
+def test_open_circuit_rejects_requests_without_calling_the_server():
+    _open_circuit()
+    calls = dict(lavoro_stub.StubHandler.calls)
+
+    with pytest.raises(lavoro_api_calls.LavoroUnavailable):
+        lavoro_api_calls.get_element("home-2")
+    assert lavoro_stub.StubHandler.calls == calls
+
+
+def test_trial_request_makes_both_calls_and_closes_the_circuit():
+    _open_circuit()
+    time.sleep(0.6)
+
+    assert lavoro_api_calls.get_element("home-3") == (lavoro_stub._META, 0.042)
+    assert lavoro_api_calls.breaker.state == "closed"
+
+
+def test_failed_trial_request_opens_the_circuit_again():
+    _open_circuit()
+    time.sleep(0.6)
+
+    with pytest.raises(lavoro_api_calls.LavoroUnavailable):
+        lavoro_api_calls.get_element("broken")
+    assert lavoro_api_calls.breaker.state == "open"
+
+
+def test_async_trial_request_makes_both_calls_and_closes_the_circuit():
+    pytest.importorskip("httpx")
+    _open_circuit()
+    time.sleep(0.6)
+
+    async def trial():
+        try:
+            return await lavoro_api_calls.get_element_async("home-4")
+        finally:
+            await lavoro_api_calls.close_async_client()
+
+    assert asyncio.run(trial()) == (lavoro_stub._META, 0.042)
+    assert lavoro_api_calls.breaker.state == "closed"
+
+
+def test_async_reply_that_is_not_json_counts_as_a_failure():
+    pytest.importorskip("httpx")
+
+    async def request():
+        try:
+            return await lavoro_api_calls.get_element_async("garbage")
+        finally:
+            await lavoro_api_calls.close_async_client()
+
+    with pytest.raises(lavoro_api_calls.LavoroUnavailable):
+        asyncio.run(request())
+    assert lavoro_api_calls.breaker.failures == 1
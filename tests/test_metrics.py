@@ -0,0 +1,76 @@
+import os
+import pytest
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    monkeypatch.setattr(metrics, "_histograms", {})
+    monkeypatch.setattr(metrics, "_counters", {})
+
+
+def test_histograms_are_rendered_with_cumulative_buckets():
+    metrics.observe("stage_seconds", 0.003, stage="knn")
+    metrics.observe("stage_seconds", 0.2, stage="knn")
+
+    lines = metrics.render().splitlines()
+
+    pid = os.getpid()
+    assert "# TYPE stage_seconds histogram" in lines
+    assert f'stage_seconds_bucket{{stage="knn",le="0.0025",pid="{pid}"}} 0' in lines
+    assert f'stage_seconds_bucket{{stage="knn",le="0.005",pid="{pid}"}} 1' in lines
+    assert f'stage_seconds_bucket{{stage="knn",le="+Inf",pid="{pid}"}} 2' in lines
+    assert f'stage_seconds_count{{stage="knn",pid="{pid}"}} 2' in lines
+
+
+def test_failed_stages_are_timed_and_counted_by_error_class():
+    with pytest.raises(KeyError):
+        with metrics.timed("cluster_mean"):
+            raise KeyError(3)
+
+    output = metrics.render()
+    assert f'stage_errors_total{{error="KeyError",stage="cluster_mean",pid="{os.getpid()}"}} 1' in output
+    assert f'stage_seconds_count{{stage="cluster_mean",pid="{os.getpid()}"}} 1' in output
+
+
+def test_counters_and_collected_gauges_are_rendered(monkeypatch):
+    monkeypatch.setattr(metrics, "_collectors", [])
+    metrics.inc("reference_cache_total", result="hit")
+    metrics.inc("reference_cache_total", 2, result="hit")
+    metrics.register_collector(lambda: [("reference_rows", {"dataset": "Active_data"}, 400)])
+
+    lines = metrics.render().splitlines()
+
+    pid = os.getpid()
+    assert f'reference_cache_total{{result="hit",pid="{pid}"}} 3' in lines
+    assert f'reference_rows{{dataset="Active_data",pid="{pid}"}} 400' in lines
+    assert any(line.startswith("process_resident_memory_bytes{") for line in lines)
+
+
+def test_sampled_requests_are_profiled(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "_PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(metrics, "_PROFILE_SAMPLE_RATE", 0)
+    assert metrics.start_profile() is None
+
+    monkeypatch.setattr(metrics, "_PROFILE_SAMPLE_RATE", 1)
+    profiler = metrics.start_profile()
+    sum(range(1000))
+    path = metrics.stop_profile(profiler, "results")
+
+    assert os.path.dirname(path) == str(tmp_path)
+    assert os.path.basename(path).startswith("results-") and os.path.getsize(path) > 0
+
+
+def test_requests_are_counted_by_endpoint_and_status():
+    pytest.importorskip("flask")
+    pytest.importorskip("pandas")
+    import app
+
+    client = app.app.test_client()
+    assert client.get("/").status_code == 200
+    reply = client.get("/metrics")
+
+    output = reply.get_data(as_text=True)
+    assert reply.mimetype == "text/plain"
+    assert f'requests_total{{endpoint="home",status="200",pid="{os.getpid()}"}} 1' in output
+    assert f'request_seconds_count{{endpoint="home",pid="{os.getpid()}"}} 1' in output
@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+import textwrap
+import pytest
+
+np = pytest.importorskip("numpy")
+import parallel
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_shards_cover_every_row():
+    assert parallel.shards(10, 3) == [(0, 3), (3, 6), (6, 10)]
+    assert parallel.shards(2, 4) == [(0, 1), (1, 2)]
+
+
+def test_shared_segments_are_released_once():
+    # The workers share the resource tracker of the pool owner, so it must not report the unlinked segments.
+    script = textwrap.dedent("""
+        import numpy as np
+        import parallel
+
+        if __name__ == "__main__":
+            parallel._MIN_ROWS = 10
+            data = np.random.default_rng(0).random((1000, 4))
+            for _ in range(3):
+                nearest = parallel.nearest(data, data[:5], count=2)
+            assert (nearest == parallel._nearest_rows(data, data[:5], "euclidean")).all()
+            parallel.shutdown()
+    """)
+    completed = subprocess.run([sys.executable, "-c", script], cwd=_ROOT, capture_output=True, text=True, timeout=120,
+                               env={**os.environ, "PYTHONPATH": _ROOT})
+
+    assert completed.returncode == 0, completed.stderr
+    assert "resource_tracker" not in completed.stderr
+    assert "leaked shared_memory" not in completed.stderr
@@ -0,0 +1,65 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("pandas")
+import Clusters
+import data_manipulation
+import Knn
+import prediction_table
+import reference_cache
+from benchmarks import synthetic_data
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient()["ThesisDB"]
+    synthetic_data.populate(db, 400)
+    reference_cache.invalidate()
+    prediction_table.memo.clear()
+    yield db
+    reference_cache.invalidate()
+    prediction_table.memo.clear()
+
+
+def _record(heating_source) -> dict:
+    payload = synthetic_data.form_payloads(1, seed=5)[0]
+    record = data_manipulation.transform_data(payload["form1"], payload["form2"])
+    record["Heating Source"] = heating_source
+    return record
+
+
+@pytest.mark.parametrize("heating_source", ["Yes", "No"])
+def test_records_are_classified_within_their_partition_with_its_metric(db, heating_source):
+    record = _record(heating_source)
+
+    prediction = Clusters.predict(db, record, "exact")
+
+    reference = reference_cache.get_reference_set(db, heating_source)
+    assert set(reference.data_frame["Heating Source"]) == {heating_source}
+    vector = reference_cache.get_feature_encoder(db, reference).encode(record)
+    engine = Knn.BruteForceSearch(reference.features, reference.labels, Clusters._PARTITIONS[heating_source]["metric"])
+    label = Knn.Knn(record=vector, k=Clusters._NUMBER_OF_NEIGHBORS, engine=engine)
+    cluster = reference.data_frame[reference.data_frame["label"] == label]
+    assert prediction["heating_source"] == heating_source
+    assert prediction["label"] == label
+    assert prediction["prediction"] == pytest.approx(cluster["Kwh/day/m2"].mean())
+
+
+def test_partitions_are_loaded_lazily_and_refreshed_independently(db, monkeypatch):
+    monkeypatch.setattr(reference_cache, "_VERSION_CHECK_INTERVAL", 0)
+
+    Clusters.predict(db, _record("No"), "exact")
+    assert set(reference_cache._cache) == {reference_cache.dataset_name("No")}
+
+    partition_no = reference_cache.get_reference_set(db, "No")
+    partition_yes = reference_cache.get_reference_set(db, "Yes")
+    reference_cache.bump_version(db, reference_cache.dataset_name("Yes"))
+
+    assert reference_cache.get_reference_set(db, "No") is partition_no
+    assert reference_cache.get_reference_set(db, "Yes") is not partition_yes
+
+
+def test_unknown_heating_source_is_rejected(db):
+    with pytest.raises(ValueError):
+        Clusters.predict(db, _record("Maybe"))
@@ -0,0 +1,54 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+import Plot_generator
+
+
+@pytest.fixture
+def base():
+    return Plot_generator.distribution_base(np.linspace(1.0, 2.0, 101))
+
+
+def _bin(edges, index) -> tuple:
+    return edges[index], edges[index + 1]
+
+
+def test_values_inside_the_histogram_keep_its_bins(base):
+    assert Plot_generator.covering_distribution(base, 1.5) is base
+
+    actual_bin, _, _ = Plot_generator.highlight_state(base["edges"], 1.5, 1.5)
+    low, high = _bin(base["edges"], actual_bin)
+    assert low <= 1.5 < high
+
+
+@pytest.mark.parametrize("actual", [0.5, 0.999, 2.3, 2.9, 500.0])
+def test_outliers_get_a_bin_of_their_own(base, actual):
+    covered = Plot_generator.covering_distribution(base, actual)
+    edges = covered["edges"]
+
+    actual_bin, prediction_bin, in_same_bin = Plot_generator.highlight_state(edges, 1.5, actual)
+    low, high = _bin(edges, actual_bin)
+    assert low <= actual <= high
+    assert covered["counts"][actual_bin] == 0
+    assert covered["counts"].sum() == base["counts"].sum()
+    assert len(covered["counts"]) == len(edges) - 1 <= 2 * Plot_generator._HISTOGRAM_BINS + 1
+    assert np.all(np.diff(edges) > 0)
+    assert in_same_bin == (actual <= 1.65)
+    if not in_same_bin:
+        assert _bin(edges, prediction_bin)[0] <= 1.5 <= _bin(edges, prediction_bin)[1]
+
+
+def test_chart_data_of_an_outlier():
+    data_frame = pd.DataFrame({"Dwelling Grade": [1.0] * 50, "Kwh/day/m2": np.linspace(0.1, 0.3, 50)})
+    data_frame.attrs["version"] = ("Active_data", 1)
+    inside = Plot_generator.ChartData(data_frame, 0.2, 0.2, {"Dwelling Grade": 1.0, "Kwh/day/m2": 0.2})
+    outlier = Plot_generator.ChartData(data_frame, 0.2, 0.6, {"Dwelling Grade": 1.0, "Kwh/day/m2": 0.6})
+
+    histogram, highlight = outlier.to_json()["histogram"], outlier.to_json()["highlight"]
+    edges = histogram["edges"]
+    assert edges[highlight["actual_bin"]] <= 0.6 <= edges[highlight["actual_bin"] + 1]
+    assert highlight["actual_bin"] == len(histogram["counts"]) - 1
+    assert histogram["counts"][highlight["actual_bin"]] == 1
+    assert sum(histogram["counts"]) == 51
+    assert inside.etag() != outlier.etag()
@@ -0,0 +1,83 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+import Knn
+import prediction_table
+
+
+class Reference:
+    def __init__(self, features, labels) -> None:
+        self.features = features
+        self.labels = labels
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def search_engine(self, metric="euclidean", engine=None):
+        return Knn.BruteForceSearch(self.features, self.labels, metric)
+
+
+def _reference(seed=0) -> Reference:
+    rng = np.random.default_rng(seed)
+    profiles = rng.random((400, 12), dtype=np.float32)
+    # Two distinct profiles closer than the rounding errors of the dot product expansion.
+    profiles[1] = profiles[0]
+    profiles[1, 0] += np.float32(2e-5)
+    profile_labels = rng.integers(0, 4, len(profiles))
+    profile_labels[1] = (profile_labels[0] + 1) % 4
+
+    rows = rng.integers(0, len(profiles), 3000)
+    rows[:2] = [0, 1]
+    return Reference(np.ascontiguousarray(profiles[rows]), profile_labels[rows])
+
+
+@pytest.mark.parametrize("metric", ["euclidean", "l1"])
+@pytest.mark.parametrize("k", [1, 3])
+def test_table_matches_exact_knn(metric, k):
+    reference = _reference()
+    table = prediction_table.build(reference, metric, k)
+    engine = reference.search_engine(metric)
+
+    keys = set()
+    for row in reference.features:
+        key = prediction_table.key_of(row)
+        if key not in keys:
+            keys.add(key)
+            assert table[key] == Knn.Knn(record=row, k=k, engine=engine)
+    assert len(table) == len(keys)
+
+
+def test_close_neighbors_are_not_skipped_as_the_record_itself():
+    reference = _reference()
+    table = prediction_table.build(reference, "euclidean", 1)
+
+    assert table[prediction_table.key_of(reference.features[0])] == reference.labels[1]
+    assert table[prediction_table.key_of(reference.features[1])] == reference.labels[0]
+
+
+def test_limit_keeps_the_most_frequent_profiles():
+    features = np.repeat(np.eye(4, dtype=np.float32), [5, 1, 3, 2], axis=0)
+    reference = Reference(features, np.repeat([0, 1, 2, 3], [5, 1, 3, 2]))
+
+    table = prediction_table.build(reference, "l1", 1, limit=2)
+
+    assert set(table) == {prediction_table.key_of(features[0]), prediction_table.key_of(features[6])}
+
+
+def test_lookup_of_a_near_duplicate_matches_exact_knn(monkeypatch):
+    reference = _reference()
+    reference.dataset, reference.version = "Active_data", 1
+    table = prediction_table.build(reference, "euclidean", 1)
+    monkeypatch.setattr(prediction_table, "get_table", lambda db, reference: table)
+    prediction_table.memo.clear()
+    engine = reference.search_engine("euclidean")
+    # Rounds onto reference row 0 at 5 decimals, but is not the row: its nearest neighbor is row 0 itself.
+    vector = reference.features[0].copy()
+    vector[0] = np.round(vector[0], 5) - np.float32(4e-6)
+    assert np.array_equal(np.round(vector, 5), np.round(reference.features[0], 5))
+    assert not np.array_equal(vector, reference.features[0])
+
+    label = prediction_table.lookup(None, reference, vector, "exact",
+                                    lambda: Knn.Knn(record=vector, k=1, engine=engine))
+
+    assert label == Knn.Knn(record=vector, k=1, engine=engine) == reference.labels[0]
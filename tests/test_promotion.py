@@ -0,0 +1,89 @@
+import time
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("pandas")
+import Clusters
+import data_manipulation
+import reference_cache
+from benchmarks import synthetic_data
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient()["ThesisDB"]
+    synthetic_data.populate(db, 400)
+    reference_cache.invalidate()
+    entries = [data_manipulation.transform_data(payload["form1"], payload["form2"])
+               for payload in synthetic_data.form_payloads(10, seed=1)]
+    db["New_entries"].insert_many(entries)
+    yield db
+    reference_cache.invalidate()
+
+
+def test_promotes_every_new_entry_once(db, snapshot_dir):
+    assert Clusters.promote_new_entries(db) == 10
+    assert (snapshot_dir / "Active_data" / "current").exists()
+    assert Clusters.promote_new_entries(db) == 0
+
+    assert db["Active_data"].count_documents({}) == 410
+    assert db["New_entries"].count_documents({"promoted": True}) == 10
+    assert db["New_entries"].count_documents({"claimed_at": {"$exists": True}}) == 0
+
+
+def test_reclaims_the_entries_of_a_dead_job(db, monkeypatch):
+    # The job dies after inserting the records of the first partition.
+    def die(*args):
+        raise RuntimeError("killed")
+    with monkeypatch.context() as patch:
+        patch.setattr(reference_cache, "extend", die)
+        with pytest.raises(RuntimeError):
+            Clusters.promote_new_entries(db)
+    assert 400 < db["Active_data"].count_documents({}) < 410
+    assert Clusters.promote_new_entries(db) == 0
+
+    db["New_entries"].update_many({}, {"$inc": {"claimed_at": -Clusters._PROMOTION_CLAIM_TIMEOUT - 1}})
+    assert Clusters.promote_new_entries(db) == 10
+
+    assert db["Active_data"].count_documents({}) == 410
+    assert db["New_entries"].count_documents({"promoted": True}) == 10
+    assert len(reference_cache.get_reference_set(db)) == 410
+
+
+def test_leaves_the_entries_of_a_running_job(db):
+    db["New_entries"].update_many({}, {"$set": {"promoted": "running-job", "claimed_at": time.time()}})
+
+    assert Clusters.promote_new_entries(db) == 0
+    assert db["New_entries"].count_documents({"promoted": "running-job"}) == 10
+
+
+def test_flags_the_entries_without_a_partition(db, caplog):
+    db["New_entries"].insert_many([{"Heating Source": "Maybe"}, {"Dwelling Grade": 0.5}])
+
+    assert Clusters.promote_new_entries(db) == 10
+    assert "Skipped 2 new entries" in caplog.text
+    assert db["New_entries"].count_documents({"promotion_error": {"$exists": True}}) == 2
+    assert db["New_entries"].count_documents({"promotion_error": {"$exists": True},
+                                              "promoted": {"$exists": True}}) == 0
+
+    assert Clusters.promote_new_entries(db) == 0
+    assert db["New_entries"].count_documents({"promotion_error": {"$exists": True}}) == 2
+
+
+def test_labels_match_the_per_record_pipeline(db, monkeypatch):
+    expected = {}
+    for entry in db["New_entries"].find():
+        record = dict(entry)
+        reference = reference_cache.get_reference_set(db, record["Heating Source"])
+        data_manipulation.preprocess_pipeline(db, record)
+        metric = Clusters._PARTITIONS[record["Heating Source"]]["metric"]
+        record["label"] = int(Clusters.classify(reference, reference.encode(record), "exact", metric)[0])
+        expected[entry["_id"]] = record
+
+    def fetch_per_record(*args):
+        raise AssertionError("the records were preprocessed one query at a time")
+    monkeypatch.setattr(data_manipulation, "preprocess_pipeline", fetch_per_record)
+    assert Clusters.promote_new_entries(db) == 10
+
+    promoted = db["Active_data"].find({"_id": {"$in": list(expected)}})
+    assert {document["_id"]: document for document in promoted} == expected
@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+import reference_cache
+import snapshot
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _reference(rows=200, seed=0) -> reference_cache.ReferenceSet:
+    rng = np.random.default_rng(seed)
+    data_frame = pd.DataFrame({"Dwelling Grade": rng.choice([0.25, 0.5, 0.75, 1.0], rows),
+                               "Bedrooms": rng.random(rows), "Income": rng.random(rows),
+                               "Heating Source": rng.choice(["No", "Yes"], rows),
+                               "label": rng.integers(0, 4, rows), "Kwh/day/m2": rng.gamma(2.0, 0.05, rows)})
+    return reference_cache.ReferenceSet(data_frame, 3)
+
+
+def test_data_frame_shares_the_mapped_arrays(snapshot_dir):
+    reference = _reference()
+    snapshot.write(reference, {})
+    data = snapshot.read(reference.dataset, reference.version)
+
+    frame = snapshot.data_frame(data)
+
+    for i, column in enumerate(data["columns"]):
+        if column != "Dwelling Grade":
+            assert np.shares_memory(frame[column].to_numpy(), data["features"])
+            assert np.array_equal(frame[column].to_numpy(), data["features"][:, i])
+    for column, name in (("Dwelling Grade", "grades"), ("label", "labels"), ("Kwh/day/m2", "consumption")):
+        assert np.shares_memory(frame[column].to_numpy(), data[name])
+    pd.testing.assert_series_equal(frame["Dwelling Grade"], reference.data_frame["Dwelling Grade"])
+    pd.testing.assert_series_equal(frame["Heating Source"], reference.data_frame["Heating Source"],
+                                   check_dtype=False)
+    assert set(frame.columns) == set(reference.data_frame.columns)
+
+
+def test_snapshots_are_disabled_by_default():
+    environment = {key: value for key, value in os.environ.items() if key != "SNAPSHOT_DIR"}
+    completed = subprocess.run([sys.executable, "-c", "import snapshot; print(snapshot.enabled())"], cwd=_ROOT,
+                               capture_output=True, text=True, timeout=60, env=environment)
+
+    assert completed.stdout.strip() == "False", completed.stderr
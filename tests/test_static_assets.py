@@ -0,0 +1,75 @@
+import gzip
+import json
+import pytest
+
+flask = pytest.importorskip("flask")
+import static_assets
+
+
+@pytest.fixture
+def source(tmp_path):
+    source = tmp_path / "static"
+    (source / "Css").mkdir(parents=True)
+    (source / "images").mkdir()
+    (source / "images" / "bg.png").write_bytes(b"\x89PNG" + bytes(256))
+    (source / "Css" / "base.css").write_text("body { background: url('../images/bg.png'); }\n" * 50)
+    return source
+
+
+@pytest.fixture
+def built(source, tmp_path, monkeypatch):
+    monkeypatch.setattr(static_assets, "_manifest", {})
+    target = tmp_path / "build"
+    manifest = static_assets.build(str(source), str(target))
+    app = flask.Flask(__name__, static_folder=str(source))
+    static_assets.init_app(app, str(target))
+    return app, manifest, target
+
+
+def test_build_fingerprints_and_precompresses_the_assets(built):
+    _, manifest, target = built
+
+    assert json.loads((target / "manifest.json").read_text()) == manifest
+    image, stylesheet = manifest["images/bg.png"], manifest["Css/base.css"]
+    assert image.startswith("images/bg.") and stylesheet.startswith("Css/base.")
+    content = (target / stylesheet).read_text()
+    assert f"url('../{image}')" in content
+    assert gzip.decompress((target / (stylesheet + ".gz")).read_bytes()).decode() == content
+    assert not (target / (image + ".gz")).exists()
+
+
+def test_urls_point_to_the_fingerprinted_assets(built):
+    app, manifest, _ = built
+
+    with app.test_request_context():
+        assert flask.url_for("static", filename="Css/base.css") == f"/static/{manifest['Css/base.css']}"
+
+
+def test_fingerprinted_assets_are_immutable_and_precompressed(built):
+    app, manifest, _ = built
+    client = app.test_client()
+
+    reply = client.get(f"/static/{manifest['Css/base.css']}", headers={"Accept-Encoding": "gzip"})
+    assert reply.headers["Content-Encoding"] == "gzip"
+    assert reply.mimetype == "text/css"
+    assert "Accept-Encoding" in reply.headers["Vary"]
+    assert reply.cache_control.immutable and reply.cache_control.max_age == static_assets._IMMUTABLE_MAX_AGE
+    reply.close()
+
+    reply = client.get("/static/Css/base.css")
+    assert "Content-Encoding" not in reply.headers
+    assert not reply.cache_control.immutable and reply.cache_control.max_age == static_assets._STATIC_MAX_AGE
+    reply.close()
+
+
+def test_without_a_build_the_source_assets_are_served(source, tmp_path, monkeypatch):
+    monkeypatch.setattr(static_assets, "_manifest", {})
+    app = flask.Flask(__name__, static_folder=str(source))
+    static_assets.init_app(app, str(tmp_path / "missing"))
+
+    assert app.config["STATIC_BUILD_ID"] == "source"
+    with app.test_request_context():
+        assert flask.url_for("static", filename="Css/base.css") == "/static/Css/base.css"
+    reply = app.test_client().get("/static/Css/base.css")
+    assert reply.status_code == 200
+    reply.close()
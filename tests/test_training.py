@@ -0,0 +1,87 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("sklearn")
+import Clusters
+import database
+import parallel
+import reference_cache
+from benchmarks import synthetic_data
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient()["ThesisDB"]
+    synthetic_data.populate(db, 400)
+    reference_cache.invalidate()
+    yield db
+    reference_cache.invalidate()
+
+
+def test_connection_string_of_shareable_clients_only(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(database, "_client", None)
+    assert database.connection_string(client["ThesisDB"]) is None
+
+    database.set_client(client, "mongodb://localhost:27017")
+    try:
+        assert database.connection_string(client["ThesisDB"]) == "mongodb://localhost:27017"
+        assert database.connection_string(mongomock.MongoClient()["ThesisDB"]) is None
+        database.set_client(client, "mongomock://")
+        assert database.connection_string(client["ThesisDB"]) is None
+    finally:
+        database.set_client(None)
+
+
+def test_partitions_of_an_unshared_database_train_in_process(db, monkeypatch):
+    trained = []
+    def spawn(*args, **kwargs):
+        raise AssertionError("the partitions were trained in other processes")
+    monkeypatch.setattr(parallel, "run_concurrently", spawn)
+    monkeypatch.setattr(Clusters, "train_clustering_algorithm",
+                        lambda target, heating_source, *args, **kwargs: trained.append((target, heating_source)))
+
+    Clusters.train_partitions(db, workers=2, profile_memory=False)
+
+    assert trained == [(db, heating_source) for heating_source in Clusters._PARTITIONS]
+
+
+def test_spawned_jobs_connect_to_the_database_of_the_caller(db, monkeypatch):
+    jobs = []
+    monkeypatch.setattr(database, "connection_string", lambda target: "mongodb://localhost:27017")
+    def run_concurrently(function, arguments, count):
+        jobs.extend(arguments)
+        return [[] for _ in arguments]
+    monkeypatch.setattr(parallel, "run_concurrently", run_concurrently)
+
+    Clusters.train_partitions(db, workers=2, profile_memory=False)
+
+    assert [job[:3] for job in jobs] == [("mongodb://localhost:27017", "ThesisDB", heating_source)
+                                         for heating_source in Clusters._PARTITIONS]
+
+
+@pytest.mark.parametrize("heating_source", list(Clusters._PARTITIONS))
+def test_scalable_mode_assigns_the_records_under_the_partition_metric(heating_source, monkeypatch):
+    metrics = []
+    nearest = parallel.nearest
+    def record_metric(data, points, metric="euclidean", count=None):
+        metrics.append(metric)
+        return nearest(data, points, metric, count)
+    monkeypatch.setattr(parallel, "nearest", record_metric)
+    features = np.random.default_rng(0).random((300, 6), dtype=np.float32)
+
+    labels = Clusters._cluster(features, Clusters._PARTITIONS[heating_source], "scalable", workers=1)
+
+    assert metrics == [Clusters._PARTITIONS[heating_source]["metric"]]
+    assert len(np.unique(labels)) <= Clusters._PARTITIONS[heating_source]["n_clusters"]
+
+
+def test_stream_partition_ignores_the_previous_labels(db):
+    _, features, _, _ = Clusters._stream_partition(db, "No", 64)
+    db["Active_data"].update_many({}, {"$set": {"label": 7}})
+
+    _, relabeled, _, _ = Clusters._stream_partition(db, "No", 64)
+
+    assert np.array_equal(features, relabeled)
+    assert features.shape[1] == len(reference_cache.get_reference_set(db, "No").columns)